@@ -0,0 +1,89 @@
+"""
+Benchmark of per-sentence postprocessing of ELMO40in2SpellingCorrector.make_fixes: detokenization
+of the output tokens and ё substitution.
+
+The legacy implementation (new MosesDetokenizer and regexes compiled from strings on every call)
+is compared with language_models.utils (module level detokenizer, precompiled regexes,
+str.replace substitutions), outputs are checked to be equal.
+
+Usage:
+    python benchmarks/bench_detokenize.py --limit 2000 --repeats 3
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+SELF_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SELF_DIR)
+sys.path.append(ROOT_DIR)
+from language_models.tokenization import regex_tokenize
+from language_models.utils import MosesDetokenizer, detokenize, detokenize_batch, yo_substitutor
+
+DEFAULT_TESTSET_PATH = os.path.join(ROOT_DIR, "data", "dialog16", "true_dialog_testset.txt")
+
+
+def legacy_detokenize(tokens):
+    """detokenize before module level state was introduced"""
+    detokenized_str = MosesDetokenizer().detokenize(tokens, return_str=True)
+    detokenized_str = re.sub(r"\( (.+?)", r"(\1", detokenized_str)
+    detokenized_str = re.sub(r"(.+?) »", r"\1»", detokenized_str)
+    detokenized_str = re.sub(r"« (.+?)", r"«\1", detokenized_str)
+    detokenized_str = re.sub(r": -\)", r":-)", detokenized_str)
+    return detokenized_str
+
+
+def legacy_yo_substitutor(sentence):
+    """yo_substitutor before module level state was introduced"""
+    yo_pat = re.compile("ё")
+    return yo_pat.sub("е", sentence)
+
+
+def best_time(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start_time = time.time()
+        outputs = func()
+        timings.append(time.time() - start_time)
+    return min(timings), outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--testset", default=DEFAULT_TESTSET_PATH)
+    parser.add_argument("--limit", type=int, default=None, help="max number of sentences")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.testset, "r", encoding="utf8") as testset_file:
+        sentences = [line.strip() for line in testset_file if line.strip()]
+    if args.limit:
+        sentences = sentences[:args.limit]
+    tokens_batch = [regex_tokenize(each_sentence)[0] for each_sentence in sentences]
+
+    benchmarks = [
+        ("legacy detokenize", lambda: [legacy_detokenize(tokens) for tokens in tokens_batch]),
+        ("detokenize", lambda: [detokenize(tokens) for tokens in tokens_batch]),
+        ("detokenize_batch", lambda: detokenize_batch(tokens_batch)),
+        ("legacy yo_substitutor", lambda: [legacy_yo_substitutor(each_sentence)
+                                           for each_sentence in sentences]),
+        ("yo_substitutor", lambda: [yo_substitutor(each_sentence) for each_sentence in sentences]),
+    ]
+    reference_outputs = {}
+    for name, func in benchmarks:
+        elapsed, outputs = best_time(func, args.repeats)
+        kind = name.split()[-1]
+        if kind.startswith("detokenize"):
+            kind = "detokenize"
+        if kind in reference_outputs:
+            assert outputs == reference_outputs[kind], "Outputs of %s differ from legacy" % name
+        else:
+            reference_outputs[kind] = outputs
+        print("%-22s | best of %d: %0.3f s | %6.1f us/sentence" % (
+            name, args.repeats, elapsed, 1e6 * elapsed / len(sentences)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark of KenlmElector on dialog16 test set with different numbers of processes.
+
+Levenshtein candidates are generated once, then the same batch is processed by KenlmElector
+with each n_processes value, outputs are checked to be equal to the serial ones. Processes are
+forked after the model is loaded, so with a binary model and lazy (mmap) load method they share
+one copy of the model.
+
+Usage:
+    python benchmarks/bench_kenlm_elector.py --model /path/to/model.binary \\
+        --words data/wordforms.txt --load-method lazy --n-processes 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import time
+
+SELF_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SELF_DIR)
+sys.path.append(ROOT_DIR)
+from dp_components.kenlm_elector import KenlmElector
+from dp_components.kenlm_loader import LOAD_METHODS
+from dp_components.levenshtein_searcher_component import LevenshteinSearcherComponent
+
+DEFAULT_TESTSET_PATH = os.path.join(ROOT_DIR, "data", "dialog16", "dialog_testset.txt")
+
+
+def load_tokenized_sentences(path, limit=None):
+    with open(path, "r", encoding="utf8") as testset_file:
+        sentences = [line.strip().lower().replace('ё', 'е').split() for line in testset_file]
+    sentences = [each_sentence for each_sentence in sentences if each_sentence]
+    return sentences[:limit] if limit else sentences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="path to kenlm model (arpa or binary)")
+    parser.add_argument("--words", required=True, help="path to dictionary (one word per line)")
+    parser.add_argument("--testset", default=DEFAULT_TESTSET_PATH)
+    parser.add_argument("--limit", type=int, default=None, help="max number of sentences")
+    parser.add_argument("--beam-size", type=int, default=4)
+    parser.add_argument("--n-processes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--load-method", choices=sorted(LOAD_METHODS), default=None,
+                        help="load method of kenlm model (lazy and populate mmap binary models)")
+    args = parser.parse_args()
+
+    sentences = load_tokenized_sentences(args.testset, args.limit)
+    with open(args.words, "r", encoding="utf8") as words_file:
+        words = words_file.read().splitlines()
+
+    start_time = time.time()
+    candidates_generator = LevenshteinSearcherComponent(words=words, max_distance=1.0)
+    batch = candidates_generator(sentences)
+    print("Candidates for %d sentences (%d tokens) are generated in %0.2f s" % (
+        len(sentences), sum(len(each_sentence) for each_sentence in sentences),
+        time.time() - start_time))
+
+    # the loader prints load time and resident memory:
+    elector = KenlmElector(args.model, beam_size=args.beam_size, load_method=args.load_method)
+
+    reference_outputs = None
+    for n_processes in args.n_processes:
+        elector.close()
+        elector.n_processes = n_processes
+        timings = []
+        for _ in range(args.repeats):
+            start_time = time.time()
+            outputs = elector(batch)
+            timings.append(time.time() - start_time)
+        if reference_outputs is None:
+            reference_outputs = outputs
+        assert outputs == reference_outputs, "Outputs differ from the first run"
+        best_time = min(timings)
+        print("n_processes: %2d | best of %d: %0.3f s | %0.1f sentences/s" % (
+            n_processes, args.repeats, best_time, len(batch) / best_time))
+    elector.close()
+
+
+if __name__ == '__main__':
+    main()
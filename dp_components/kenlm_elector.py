@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import heapq
+import multiprocessing
+from operator import itemgetter
 from pathlib import Path
 from typing import List, Tuple
 
@@ -22,6 +25,21 @@ from deeppavlov.core.common.registry import register
 from deeppavlov.core.models.component import Component
 from deeppavlov.core.common.log import get_logger
 
+from .kenlm_loader import load_kenlm_model
+from .kenlm_prefix_scorer import KenlmPrefixScorer
+
+# elector of the forked worker process:
+_WORKER_ELECTOR = None
+
+
+def _init_worker(elector):
+    global _WORKER_ELECTOR
+    _WORKER_ELECTOR = elector
+
+
+def _infer_instance_in_worker(candidates):
+    return _WORKER_ELECTOR._infer_instance(candidates)
+
 
 class KenlmElector(Component):
     """Component that chooses a candidate with the highest product of base and language model probabilities
@@ -29,15 +47,29 @@ class KenlmElector(Component):
     Args:
          load_path: path to the kenlm model file
          beam_size: beam size for highest probability search
+         load_method: None (default of KenLM) or load method of the model (see
+            kenlm_loader.LOAD_METHODS), "lazy" or "populate" memory map binary models
+         n_processes: number of worker processes forked after the model is loaded, so they
+            share one page-cached copy of memory mapped model, 0 or 1 means no processes (scoring
+            and beam search hold the GIL, so batches are parallelized by processes, not threads)
 
     Attributes:
         lm: kenlm object
         beam_size: beam size for highest probability search
+        n_processes: number of forked worker processes for batches
+        load_probe: dict with load time and resident memory after loading of the model
     """
 
-    def __init__(self, load_path: Path, beam_size: int = 4, *args, **kwargs):
-        self.lm = kenlm.Model(str(expand_path(load_path)))
+    def __init__(self, load_path: Path, beam_size: int = 4, load_method: str = None,
+                 n_processes: int = 0, *args, **kwargs):
+        self.lm, self.load_probe = load_kenlm_model(expand_path(load_path),
+                                                    load_method=load_method)
         self.beam_size = beam_size
+        self.n_processes = n_processes
+        # pool of forked processes for batches, initialized lazily
+        self._pool = None
+        # scorer of hypotheses with cache of prefixes, initialized lazily
+        self.prefix_scorer = None
 
     def __call__(self, batch: List[List[List[Tuple[float, str]]]]) -> List[List[str]]:
         """Choose the best candidate for every token
@@ -65,29 +97,70 @@ class KenlmElector(Component):
         Returns:
             batch of corrected tokenized sentences
         """
+        if self.n_processes > 1 and len(batch) > 1:
+            return self._get_pool().map(_infer_instance_in_worker, batch)
         return [self._infer_instance(candidates) for candidates in batch]
 
+    def _get_pool(self):
+        """
+        Forks worker processes after the model is loaded: workers inherit the elector (and the
+        memory mapping of the model) without pickling and loading
+        """
+        if self._pool is None:
+            context = multiprocessing.get_context("fork")
+            self._pool = context.Pool(self.n_processes, initializer=_init_worker,
+                                      initargs=(self,))
+        return self._pool
+
+    def close(self):
+        """Shuts down the pool of processes"""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __getstate__(self):
+        # the pool is not passed to workers
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
     def _infer_instance(self, candidates: List[List[Tuple[float, str]]]):
         candidates = candidates + [[(0, '</s>')]]
         state = kenlm.State()
         self.lm.BeginSentenceWrite(state)
-        beam = [(0, state, [])]
+        # beam items are tuples (score, state, node), where node is a back-pointer:
+        # (parent node, words of candidate) or None for the beginning of sentence
+        beam = [(0, state, None)]
         for sublist in candidates:
-            new_beam = []
-            for beam_score, beam_state, beam_words in beam:
+            # hypotheses are recombined by LM state: continuations of hypotheses with the same
+            # state get the same scores, so only the best of them is kept
+            expansions = {}
+            for beam_score, beam_state, beam_node in beam:
                 for score, candidate in sublist:
                     prev_state = beam_state
                     c_score = 0
                     cs = candidate.split()
-                    for candidate in cs:
+                    for word in cs:
                         state = kenlm.State()
-                        c_score += self.lm.BaseScore(prev_state, candidate, state)
+                        c_score += self.lm.BaseScore(prev_state, word, state)
                         prev_state = state
-                    new_beam.append((beam_score + score + c_score, state, beam_words + cs))
-            new_beam.sort(reverse=True)
-            beam = new_beam[:self.beam_size]
-        score, state, words = beam[0]
-        return words[:-1]
+                    new_score = beam_score + score + c_score
+                    recombined = expansions.get(prev_state)
+                    if recombined is None or new_score > recombined[0]:
+                        expansions[prev_state] = (new_score, prev_state, (beam_node, cs))
+            beam = heapq.nlargest(self.beam_size, expansions.values(), key=itemgetter(0))
+        score, state, node = beam[0]
+        return self._backtrace(node)[:-1]
+
+    @staticmethod
+    def _backtrace(node):
+        """Restores words of the hypothesis by back-pointers"""
+        words_chunks = []
+        while node is not None:
+            node, cs = node
+            words_chunks.append(cs)
+        return [word for cs in reversed(words_chunks) for word in cs]
 
     ##########################################################################
     def _tokenize(self, sentence):
@@ -108,23 +181,13 @@ class KenlmElector(Component):
         # TODO
 
     def score_sentences_hypotheses(self, hypotheses):
-        candidates = candidates + [[(0, '</s>')]]
-        state = kenlm.State()
-        self.lm.BeginSentenceWrite(state)
-        beam = [(0, state, [])]
-        for sublist in candidates:
-            new_beam = []
-            for beam_score, beam_state, beam_words in beam:
-                for score, candidate in sublist:
-                    prev_state = beam_state
-                    c_score = 0
-                    cs = candidate.split()
-                    for candidate in cs:
-                        state = kenlm.State()
-                        c_score += self.lm.BaseScore(prev_state, candidate, state)
-                        prev_state = state
-                    new_beam.append((beam_score + score + c_score, state, beam_words + cs))
-            new_beam.sort(reverse=True)
-            beam = new_beam[:self.beam_size]
-        score, state, words = beam[0]
-        return words[:-1]
+        """
+        Scores batch of sentences hypotheses, hypotheses sharing prefixes (ex.: variants of
+        correction of one sentence) are scored incrementally from cached LM states of prefixes.
+
+        :param hypotheses: list of hypotheses, each hypothesis is a string or a list of tokens
+        :return: list of log10 probabilities of hypotheses
+        """
+        if self.prefix_scorer is None:
+            self.prefix_scorer = KenlmPrefixScorer(self.lm)
+        return self.prefix_scorer.score_batch(hypotheses)
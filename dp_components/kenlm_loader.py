@@ -0,0 +1,116 @@
+"""
+Loading of KenLM models with memory mapping and a probe of loading costs.
+
+KenLM binary models (built by build_binary) may be memory mapped instead of being read into
+process memory. With lazy mapping pages of the model are loaded from the page cache on demand, so
+N processes which map the same file share one copy of the model in memory:
+
+    1. the parent process loads the model (load_method="lazy" or "populate"),
+    2. then it forks workers (multiprocessing with "fork" start method), workers inherit the
+       mapping and never load the model themselves (see KenlmElector n_processes).
+
+ARPA models can not be mapped, they are always parsed into memory of the process.
+"""
+import os
+import time
+
+import kenlm
+
+# load methods of KenLM (util::LoadMethod):
+LOAD_METHODS = {
+    # mmap without reading, pages are loaded on demand (the fastest start, shared page cache)
+    'lazy': kenlm.LoadMethod.LAZY,
+    # mmap with MAP_POPULATE: the model is read into page cache at start (shared page cache)
+    'populate': kenlm.LoadMethod.POPULATE_OR_LAZY,
+    # mmap with MAP_POPULATE if possible, otherwise read (default of KenLM)
+    'populate_or_read': kenlm.LoadMethod.POPULATE_OR_READ,
+    # read the model into private memory of the process
+    'read': kenlm.LoadMethod.READ,
+    # read the model into private memory in parallel threads
+    'parallel_read': kenlm.LoadMethod.PARALLEL_READ,
+}
+
+# the beginning of KenLM binary files
+KENLM_BINARY_MAGIC = b"mmap lm "
+
+
+def is_binary_model(path):
+    """
+    Checks if the file is a KenLM binary model (which may be memory mapped)
+
+    :param path: path to the model
+    :return: bool
+    """
+    with open(str(path), "rb") as model_file:
+        return model_file.read(len(KENLM_BINARY_MAGIC)) == KENLM_BINARY_MAGIC
+
+
+def resident_set_size():
+    """
+    :return: int, resident set size of the current process in bytes or None if it can not be
+        measured
+    """
+    try:
+        with open("/proc/self/statm", "r") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # max RSS (in kilobytes on linux), it is an upper bound of current RSS:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+def load_kenlm_model(path, load_method=None, verbose=True):
+    """
+    Loads KenLM model with specified load method and reports load time and resident memory
+
+    :param path: path to the model (binary or ARPA)
+    :param load_method: None (default of KenLM) or one of keys of LOAD_METHODS
+    :param verbose: if true then probe of loading is printed
+    :return: tuple (kenlm.Model, dict with probe of loading:
+        {'load_seconds', 'rss_bytes', 'rss_delta_bytes', 'is_binary', 'load_method'})
+    """
+    path = str(path)
+    binary = is_binary_model(path)
+    config = kenlm.Config()
+    if load_method is not None:
+        if load_method not in LOAD_METHODS:
+            raise ValueError("Unknown load method %s, use one of: %s" % (
+                load_method, ", ".join(LOAD_METHODS)))
+        if not binary and load_method in ('lazy', 'populate'):
+            print("KenLM model %s is in ARPA format, it can not be memory mapped. "
+                  "Convert it with build_binary to share it between processes." % path)
+        config.load_method = LOAD_METHODS[load_method]
+
+    rss_before = resident_set_size()
+    start_time = time.time()
+    model = kenlm.Model(path, config)
+    probe = {
+        'load_seconds': time.time() - start_time,
+        'rss_bytes': resident_set_size(),
+        'is_binary': binary,
+        'load_method': load_method,
+    }
+    if rss_before is not None and probe['rss_bytes'] is not None:
+        probe['rss_delta_bytes'] = probe['rss_bytes'] - rss_before
+    else:
+        probe['rss_delta_bytes'] = None
+
+    if verbose:
+        print(format_probe(path, probe))
+    return model, probe
+
+
+def format_probe(path, probe):
+    """
+    :return: str with report of probe of model loading
+    """
+    def megabytes(value):
+        return "n/a" if value is None else "%0.1f MB" % (value / 2 ** 20)
+
+    return "KenLM model %s (%s, load method: %s) is loaded in %0.2f s, RSS: %s (+%s)" % (
+        path, "binary" if probe['is_binary'] else "ARPA", probe['load_method'] or "default",
+        probe['load_seconds'], megabytes(probe['rss_bytes']), megabytes(probe['rss_delta_bytes']))
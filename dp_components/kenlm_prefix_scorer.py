@@ -0,0 +1,119 @@
+from pathlib import Path
+
+import kenlm
+
+from utilities.lru_cache import LRUCache
+
+# max number of cached prefixes
+DEFAULT_PREFIX_CACHE_SIZE = 100000
+
+
+class KenlmPrefixScorer():
+    """
+    Scorer of batches of sentences by KenLM model which caches KenLM states of sentence
+    prefixes, so hypotheses sharing prefixes (k-best variants of a sentence) are scored
+    incrementally: only the suffix after the longest cached prefix is queried.
+
+    Prefixes are keyed incrementally: a key is a pair (id of the parent prefix, token), so each
+    step of the walk costs O(1) regardless of the length of the prefix. Hits and misses are
+    counted by tokens: a hit is a token whose state is taken from the cache, a miss is a token
+    queried from KenLM.
+
+    Scores are log10 probabilities as in kenlm.Model.score.
+
+    Usage:
+        scorer = KenlmPrefixScorer("/path/to/model.binary")
+        scores = scorer.score_batch(["мама мыла раму", "мама мыла рамы"])
+    """
+
+    # ids of empty prefixes with and without the beginning of sentence context:
+    BOS_PREFIX_ID = 0
+    NULL_CONTEXT_PREFIX_ID = 1
+
+    def __init__(self, model, cache_size=DEFAULT_PREFIX_CACHE_SIZE):
+        """
+
+        :param model: kenlm.Model or path to the model file
+        :param cache_size: max number of cached prefixes
+        """
+        if isinstance(model, (str, Path)):
+            model = kenlm.Model(str(model))
+        self.lm = model
+        # {(parent prefix id, token): (prefix id, state, score)}
+        self.prefix_cache = LRUCache(cache_size)
+        # ids are never reused, so entries of evicted parents are not reachable and age out:
+        self._next_prefix_id = 2
+        self.hits = 0
+        self.misses = 0
+
+    def _initial_state(self, bos):
+        state = kenlm.State()
+        if bos:
+            self.lm.BeginSentenceWrite(state)
+        else:
+            self.lm.NullContextWrite(state)
+        return state
+
+    def score_tokens(self, tokens, bos=True, eos=True):
+        """
+        Scores tokenized sentence
+
+        :param tokens: list of tokens
+        :param bos: if true then the sentence is scored from the beginning of sentence context
+        :param eos: if true then the end of sentence is scored
+        :return: float, log10 probability
+        """
+        prefix_id = self.BOS_PREFIX_ID if bos else self.NULL_CONTEXT_PREFIX_ID
+        state = None
+        score = 0.0
+        # walk along cached prefixes:
+        prefix_len = 0
+        while prefix_len < len(tokens):
+            key = (prefix_id, tokens[prefix_len])
+            if key not in self.prefix_cache:
+                break
+            # counters of the cache are not used, see hits and misses of the scorer:
+            prefix_id, state, score = self.prefix_cache.get(key)
+            prefix_len += 1
+        self.hits += prefix_len
+        self.misses += len(tokens) - prefix_len
+
+        if state is None:
+            state = self._initial_state(bos)
+        # score and cache the rest of prefixes:
+        for token_idx in range(prefix_len, len(tokens)):
+            out_state = kenlm.State()
+            score += self.lm.BaseScore(state, tokens[token_idx], out_state)
+            state = out_state
+            key = (prefix_id, tokens[token_idx])
+            prefix_id = self._next_prefix_id
+            self._next_prefix_id += 1
+            self.prefix_cache.put(key, (prefix_id, state, score))
+
+        if eos:
+            score += self.lm.BaseScore(state, "</s>", kenlm.State())
+        return score
+
+    def score_batch(self, sentences, bos=True, eos=True):
+        """
+        Scores batch of sentences
+
+        :param sentences: list of strings (tokens are separated with spaces) or lists of tokens
+        :return: list of floats, log10 probabilities
+        """
+        return [self.score_tokens(each_sentence.split() if isinstance(each_sentence, str)
+                                  else each_sentence, bos=bos, eos=eos)
+                for each_sentence in sentences]
+
+    def stats(self):
+        """
+        :return: dict with counters of the prefix cache, hits and misses are counted by tokens
+        """
+        stats = self.prefix_cache.stats()
+        lookups = self.hits + self.misses
+        stats.update({
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        })
+        return stats
@@ -1,11 +1,25 @@
 import sys
 import copy
 import getopt
+import itertools
+import multiprocessing
 
 import numpy as np
 
 from collections import defaultdict, deque
 
+# коды обратных ссылок в make_levenstein_table (битовая маска ячейки):
+# замена (i-1, j-1), удаление (i, j-1), вставка (i-1, j), перестановка (i-2, j-2)
+REPLACE_POINTER, REMOVAL_POINTER, INSERTION_POINTER, TRANSPOSITION_POINTER = 1, 2, 4, 8
+
+# если оптимальное выравнивание неоднозначно, а число оптимальных путей не больше этого значения,
+# то выравнивание выбирается перебором путей (как в extract_best_alignment), иначе
+# выбирается канонический путь
+MAX_ENUMERATED_PATHS = 64
+
+# таблицы make_levenstein_table, содержащие не меньше ячеек, заполняются векторно по антидиагоналям
+ANTIDIAGONAL_MIN_CELLS = 4096
+
 def extract_words(line, make_lower=True):
     sents = line.split()
     words = []
@@ -26,16 +40,34 @@ def levenstein_dist(source, correct, allow_transpositions=False,
                     removal_cost=1.0, insertion_cost=1.0, replace_cost=1.0, transposition_cost=1.0):
     table, _ = make_levenstein_table(source, correct, allow_transpositions=allow_transpositions,
                                   removal_cost=removal_cost, insertion_cost=insertion_cost,
-                                  transposition_cost=transposition_cost)
+                                  replace_cost=replace_cost, transposition_cost=transposition_cost)
     return table[-1][-1]
 
 
+def encode_tokens(source, correct):
+    """
+    Кодирует токены (или символы) двух последовательностей целыми числами,
+    равные токены получают равные коды
+
+    :return: source_codes, correct_codes, numpy 1D-arrays of int
+    """
+    vocabulary = {}
+    source_codes = np.array([vocabulary.setdefault(token, len(vocabulary)) for token in source],
+                            dtype=np.int64)
+    correct_codes = np.array([vocabulary.setdefault(token, len(vocabulary)) for token in correct],
+                             dtype=np.int64)
+    return source_codes, correct_codes
+
+
 def make_levenstein_table(source, correct, allow_transpositions=False,
         removal_cost=1.0, insertion_cost=1.0, replace_cost=1.0, transposition_cost=1.0):
     """
     Строит динамическую таблицу, применяемую при вычислении расстояния Левенштейна,
     а также массив обратных ссылок, применяемый при восстановлении выравнивания
 
+    Токены кодируются целыми числами, большие таблицы заполняются векторно по антидиагоналям,
+    маленькие (меньше ANTIDIAGONAL_MIN_CELLS ячеек) --- построчно, результаты совпадают
+
     :param source: list of strs, исходное предложение
     :param correct: list of strs, исправленное предложение
     :param allow_transpositions: bool, optional(default=False),
@@ -51,62 +83,130 @@ def make_levenstein_table(source, correct, allow_transpositions=False,
     :return:
         table, numpy 2D-array of float, двумерная таблица расстояний между префиксами,
             table[i][j] = d(source[:i], correct[:j])
-        backtraces, 2D-array of lists,
-            двумерный массив обратных ссылок при вычислении оптимального выравнивания
-    """
-    first_length, second_length = len(source), len(correct)
-    table = np.zeros(shape=(first_length + 1, second_length + 1), dtype=float)
-    backtraces = [([None]  * (second_length + 1)) for _ in range(first_length + 1)]
-    for i in range(1, second_length + 1):
-        table[0][i] = i
-        backtraces[0][i] = [(0, i-1)]
-    for i in range(1, first_length + 1):
-        table[i][0] = i
-        backtraces[i][0] = [(i-1, 0)]
-    for i, first_word in enumerate(source, 1):
-        for j, second_word in enumerate(correct, 1):
+        backtraces, numpy 2D-array of uint8, битовые маски обратных ссылок
+            (REPLACE_POINTER, REMOVAL_POINTER, INSERTION_POINTER, TRANSPOSITION_POINTER)
+    """
+    source_codes, correct_codes = encode_tokens(source, correct)
+    if (len(source) + 1) * (len(correct) + 1) >= ANTIDIAGONAL_MIN_CELLS:
+        fill_table = _fill_levenstein_table_by_antidiagonals
+    else:
+        fill_table = _fill_levenstein_table_by_rows
+    return fill_table(source_codes, correct_codes, allow_transpositions,
+                      removal_cost, insertion_cost, replace_cost, transposition_cost)
+
+def _fill_levenstein_table_by_antidiagonals(source_codes, correct_codes, allow_transpositions,
+        removal_cost, insertion_cost, replace_cost, transposition_cost):
+    """
+    Заполняет таблицу make_levenstein_table по антидиагоналям i + j = const:
+    ячейки одной антидиагонали зависят только от двух предыдущих антидиагоналей.
+    Таблица хранится в плоском массиве, антидиагональ в нём --- срез с шагом n
+    """
+    first_length, second_length = len(source_codes), len(correct_codes)
+    width = second_length + 1
+    table = np.empty(shape=((first_length + 1) * width,), dtype=float)
+    backtraces = np.empty(shape=((first_length + 1) * width,), dtype=np.uint8)
+    table[:width] = np.arange(width)
+    table[::width] = np.arange(first_length + 1)
+    backtraces[:width] = REMOVAL_POINTER
+    backtraces[::width] = INSERTION_POINTER
+    backtraces[0] = 0
+    if first_length == 0 or second_length == 0:
+        return table.reshape(first_length + 1, width), backtraces.reshape(first_length + 1, width)
+    are_equal = np.zeros(shape=(first_length + 1, width), dtype=bool)
+    are_equal[1:, 1:] = source_codes[:, None] == correct_codes[None, :]
+    are_equal = are_equal.ravel()
+    if allow_transpositions:
+        # source[i-2:i] == correct[j-1:j-3:-1]:
+        are_transposed = np.zeros(shape=(first_length + 1, width), dtype=bool)
+        are_transposed[2:, 2:] = ((source_codes[1:, None] == correct_codes[None, :-1]) &
+                                  (source_codes[:-1, None] == correct_codes[None, 1:]))
+        are_transposed = are_transposed.ravel() & ~are_equal
+    for diagonal in range(2, first_length + second_length + 1):
+        first_row = max(1, diagonal - second_length)
+        last_row = min(first_length, diagonal - 1)
+        start = first_row * width + diagonal - first_row
+        stop = last_row * width + diagonal - last_row + 1
+        cells = slice(start, stop, second_length)
+        replace_source_values = table[start-width-1:stop-width-1:second_length]
+        replace_values = replace_source_values + replace_cost
+        removal_values = table[start-1:stop-1:second_length] + removal_cost
+        insertion_values = table[start-width:stop-width:second_length] + insertion_cost
+        values = np.minimum(np.minimum(replace_values, removal_values), insertion_values)
+        transposed = are_transposed[cells] if allow_transpositions else None
+        if transposed is not None and transposed.any():
+            transposition_values = np.full(len(transposed), np.inf)
+            transposition_values[transposed] = table[
+                np.arange(start, stop, second_length)[transposed] - 2 * width - 2] + transposition_cost
+            values = np.minimum(values, transposition_values)
+        else:
+            transposition_values = None
+        pointers = ((replace_values == values) * REPLACE_POINTER |
+                    (removal_values == values) * REMOVAL_POINTER |
+                    (insertion_values == values) * INSERTION_POINTER)
+        if transposition_values is not None:
+            pointers |= (transposition_values == values) * TRANSPOSITION_POINTER
+        equal = are_equal[cells]
+        table[cells] = np.where(equal, replace_source_values, values)
+        backtraces[cells] = np.where(equal, REPLACE_POINTER, pointers)
+    return table.reshape(first_length + 1, width), backtraces.reshape(first_length + 1, width)
+
+def _fill_levenstein_table_by_rows(source_codes, correct_codes, allow_transpositions,
+        removal_cost, insertion_cost, replace_cost, transposition_cost):
+    """
+    Заполняет таблицу make_levenstein_table построчно,
+    для маленьких таблиц это быстрее векторного заполнения
+    """
+    source_codes, correct_codes = source_codes.tolist(), correct_codes.tolist()
+    first_length, second_length = len(source_codes), len(correct_codes)
+    table = [[float(j) for j in range(second_length + 1)]]
+    backtraces = [[0] + [REMOVAL_POINTER] * second_length]
+    for i, first_word in enumerate(source_codes, 1):
+        prev_row, row = table[-1], [float(i)] + [0.0] * second_length
+        row_pointers = [INSERTION_POINTER] + [0] * second_length
+        for j, second_word in enumerate(correct_codes, 1):
             if first_word == second_word:
-                table[i][j] = table[i-1][j-1]
-                backtraces[i][j] = [(i-1, j-1)]
+                row[j] = prev_row[j-1]
+                row_pointers[j] = REPLACE_POINTER
+                continue
+            replace_value = prev_row[j-1] + replace_cost
+            removal_value = row[j-1] + removal_cost
+            insertion_value = prev_row[j] + insertion_cost
+            value = min(replace_value, removal_value, insertion_value)
+            # source[i-2:i] == correct[j-1:j-3:-1]:
+            if (allow_transpositions and min(i, j) >= 2 and first_word == correct_codes[j-2]
+                    and source_codes[i-2] == second_word):
+                transposition_value = table[i-2][j-2] + transposition_cost
+                value = min(value, transposition_value)
             else:
-                table[i][j] = min((table[i-1][j-1] + replace_cost,
-                                   table[i][j-1] + removal_cost,
-                                   table[i-1][j] + insertion_cost))
-                if (allow_transpositions and min(i, j) >= 2
-                        and first_word == correct[j-2] and second_word == source[j-2]):
-                    table[i][j] = min(table[i][j], table[i-2][j-2] + transposition_cost)
-                curr_backtraces = []
-                if table[i-1][j-1] + replace_cost == table[i][j]:
-                    curr_backtraces.append((i-1, j-1))
-                if table[i][j-1] + removal_cost == table[i][j]:
-                    curr_backtraces.append((i, j-1))
-                if table[i-1][j] + insertion_cost == table[i][j]:
-                    curr_backtraces.append((i-1, j))
-                if (allow_transpositions and min(i, j) >= 2
-                    and first_word == correct[j-2] and second_word == source[j-2]
-                        and table[i][j] == table[i-2][j-2] + transposition_cost):
-                    curr_backtraces.append((i-2, j-2))
-                backtraces[i][j] = copy.copy(curr_backtraces)
-    return table, backtraces
+                transposition_value = None
+            row[j] = value
+            row_pointers[j] = ((REPLACE_POINTER if replace_value == value else 0) |
+                               (REMOVAL_POINTER if removal_value == value else 0) |
+                               (INSERTION_POINTER if insertion_value == value else 0) |
+                               (TRANSPOSITION_POINTER if transposition_value == value else 0))
+        table.append(row)
+        backtraces.append(row_pointers)
+    return np.array(table, dtype=float), np.array(backtraces, dtype=np.uint8)
 
 def extract_best_alignment(backtraces):
     """
     Извлекает оптимальное выравнивание из таблицы обратных ссылок
 
-    :param backtraces, 2D-array of lists,
-        двумерный массив обратных ссылок при вычислении оптимального выравнивания
+    :param backtraces, 2D-array of uint8,
+        битовые маски обратных ссылок из make_levenstein_table
     :return: best_paths, list of lists,
         список путей, ведущих из точки (0, 0) в точку (m, n) в массиве backtraces
     """
+    backtraces = backtraces.tolist()
     m, n = len(backtraces) - 1, len(backtraces[0]) - 1
     used_vertexes = {(m, n)}
     reverse_path_graph = defaultdict(list)
-    vertexes_queue = [(m, n)]
+    vertexes_queue = deque([(m, n)])
     # строим граф наилучших путей в таблице
     while len(vertexes_queue) > 0:
-        i, j = vertex = vertexes_queue.pop(0)
+        i, j = vertex = vertexes_queue.popleft()
         if i > 0 or j > 0:
-            for new_vertex in backtraces[i][j]:
+            for new_vertex in _pointer_sources(backtraces, i, j):
                 reverse_path_graph[new_vertex].append(vertex)
                 if new_vertex not in used_vertexes:
                     vertexes_queue.append(new_vertex)
@@ -135,6 +235,100 @@ def extract_best_alignment(backtraces):
         current_path[-1] = neighbor_vertexes_list[-1][last_indexes[-1]]
     return best_paths
 
+def _pointer_sources(pointers, i, j):
+    """Ячейки, на которые ведут обратные ссылки ячейки (i, j)"""
+    mask = pointers[i][j]
+    if mask & REPLACE_POINTER:
+        yield i-1, j-1
+    if mask & REMOVAL_POINTER:
+        yield i, j-1
+    if mask & INSERTION_POINTER:
+        yield i-1, j
+    if mask & TRANSPOSITION_POINTER:
+        yield i-2, j-2
+
+
+def count_optimal_paths(pointers, backward=True):
+    """
+    Считает число оптимальных путей через ячейки таблицы
+
+    :param pointers: list of lists of int, битовые маски обратных ссылок из
+        make_levenstein_table (без перестановок)
+    :param backward: считать ли backward_counts
+    :return:
+        forward_counts, list of lists of int, число оптимальных путей из (0, 0) в (i, j)
+        backward_counts, list of lists of int (или None), число путей из (i, j) в (m, n),
+            продолжающих оптимальные пути. Через ячейку (i, j) проходит
+            forward_counts[i][j] * backward_counts[i][j] оптимальных путей
+    """
+    m, n = len(pointers) - 1, len(pointers[0]) - 1
+    forward_counts = [[1] * (n + 1) for _ in range(m + 1)]
+    for i in range(1, m + 1):
+        prev_row, row, row_pointers = forward_counts[i-1], forward_counts[i], pointers[i]
+        for j in range(1, n + 1):
+            mask = row_pointers[j]
+            count = prev_row[j-1] if mask & REPLACE_POINTER else 0
+            if mask & REMOVAL_POINTER:
+                count += row[j-1]
+            if mask & INSERTION_POINTER:
+                count += prev_row[j]
+            row[j] = count
+    if not backward:
+        return forward_counts, None
+    backward_counts = [[0] * (n + 1) for _ in range(m + 1)]
+    backward_counts[m][n] = 1
+    for i in range(m, -1, -1):
+        for j in range(n, -1, -1):
+            count = backward_counts[i][j]
+            if count == 0:
+                continue
+            mask = pointers[i][j]
+            if mask & REPLACE_POINTER:
+                backward_counts[i-1][j-1] += count
+            if mask & REMOVAL_POINTER:
+                backward_counts[i][j-1] += count
+            if mask & INSERTION_POINTER:
+                backward_counts[i-1][j] += count
+    return forward_counts, backward_counts
+
+
+def extract_canonical_alignment(pointers):
+    """
+    Извлекает один (канонический) оптимальный путь: из каждой ячейки идём по первой
+    обратной ссылке в порядке замена, удаление, вставка (порядок make_levenstein_table)
+
+    :param pointers: list of lists of int, битовые маски обратных ссылок из
+        make_levenstein_table
+    :return: path, list of pairs of ints, путь из (0, 0) в (m, n)
+    """
+    i, j = len(pointers) - 1, len(pointers[0]) - 1
+    path = [(i, j)]
+    while i > 0 or j > 0:
+        i, j = next(_pointer_sources(pointers, i, j))
+        path.append((i, j))
+    path.reverse()
+    return path
+
+
+def _is_path_choice_irrelevant(pointers, cells):
+    """
+    Проверяет, что все оптимальные пути проходят через одни и те же ячейки из cells:
+    ячейка лежит на всех оптимальных путях, если число путей через неё равно числу всех путей
+
+    :return: tuple (bool, число оптимальных путей)
+    """
+    forward_counts, _ = count_optimal_paths(pointers, backward=False)
+    paths_count = forward_counts[-1][-1]
+    if paths_count == 1:
+        return True, paths_count
+    _, backward_counts = count_optimal_paths(pointers)
+    for i, j in cells:
+        paths_through = forward_counts[i][j] * backward_counts[i][j]
+        if 0 < paths_through < paths_count:
+            return False, paths_count
+    return True, paths_count
+
+
 def extract_basic_alignment_paths(paths_in_alignments, source, correct):
     """
     Извлекает из путей в таблице Левенштейна тождественные замены в выравнивании
@@ -172,7 +366,71 @@ def extract_levenstein_alignments(source, correct, replace_cost=1.0):
     basic_alignment_paths = extract_basic_alignment_paths(paths_in_alignments, source, correct)
     return basic_alignment_paths
 
-def get_partition_indexes(first, second):
+def extract_levenstein_alignment(source, correct, replace_cost=1.0,
+                                 max_enumerated_paths=MAX_ENUMERATED_PATHS):
+    """
+    Находит позиции тождественных замен в одном оптимальном выравнивании между source и
+    correct без перебора всех оптимальных путей.
+
+    Если все оптимальные пути содержат одни и те же тождественные замены (обычный случай),
+    то они берутся из канонического пути. Иначе, если путей не больше max_enumerated_paths,
+    ответ совпадает с extract_levenstein_alignments(...)[0], а при большем числе путей
+    берётся канонический путь.
+
+    :param source: str. исходная строка
+    :param correct: str, исправленная строка
+    :param max_enumerated_paths: int or None, None означает перебор всех оптимальных путей
+    :return: list of pairs of ints, позиции тождественных замен
+    """
+    if max_enumerated_paths is None:
+        return list(extract_levenstein_alignments(source, correct, replace_cost=replace_cost)[0])
+    table, pointers = make_levenstein_table(source, correct, replace_cost=replace_cost)
+    pointers = pointers.tolist()
+    equal_cells = [(i, j) for i, first_word in enumerate(source, 1)
+                   for j, second_word in enumerate(correct, 1) if first_word == second_word]
+    is_unique, paths_count = _is_path_choice_irrelevant(pointers, equal_cells)
+    if not is_unique and paths_count <= max_enumerated_paths:
+        return list(extract_levenstein_alignments(source, correct, replace_cost=replace_cost)[0])
+    path = extract_canonical_alignment(pointers)
+    return [(i, j) for i, j in path[1:] if i > 0 and j > 0 and source[i-1] == correct[j-1]]
+
+def _make_word_ends(words):
+    """Позиции концов слов в " ".join(words) (с фиктивным концом 0 в начале)"""
+    word_ends = [0]
+    last = -1
+    for word in words:
+        last = last + len(word) + 1
+        word_ends.append(last)
+    return word_ends
+
+def _partition_of_path(path, first_word_ends, second_word_ends):
+    """
+    Разбиение на группы, которое задаёт путь в таблице Левенштейна для " ".join(first) и
+    " ".join(second) (см. get_partition_indexes)
+
+    :return: tuple (список пар индексов, является ли разбиение хорошим)
+    """
+    first_length, second_length = len(first_word_ends) - 1, len(second_word_ends) - 1
+    current_indexes = [(0, 0)]
+    first_pos, second_pos = 0, 0
+    is_partition_good = True
+    for i, j in path[1:]:
+        if i > first_word_ends[first_pos]:
+            first_pos += 1
+        if j > second_word_ends[second_pos]:
+            second_pos += 1
+        if i == first_word_ends[first_pos] and j == second_word_ends[second_pos]:
+            if first_pos > current_indexes[-1][0] and second_pos > current_indexes[-1][1]:
+                current_indexes.append((first_pos, second_pos))
+                if first_pos < first_length:
+                    first_pos += 1
+                if second_pos < second_length:
+                    second_pos += 1
+            else:
+                is_partition_good = False
+    return current_indexes, is_partition_good
+
+def get_partition_indexes(first, second, max_enumerated_paths=None):
     """
     Строит оптимальное разбиение на группы (ошибка, исправление)
     Группа заканчивается после first[i] и second[j], если пара из
@@ -181,6 +439,9 @@ def get_partition_indexes(first, second):
 
     :param first: list of strs, список исходных слов
     :param second: list of strs, их исправление
+    :param max_enumerated_paths: int or None, если None, то перебираются все оптимальные пути,
+        иначе разбиение строится по каноническому пути за линейное время, когда выбор пути не
+        влияет на разбиение или путей больше max_enumerated_paths
     :return: answer, list of pairs of ints,
         список пар (f[0], s[0]), (f[1], s[1]), ...
         отрезок second[s[i]: s[i+1]] является исправлением для first[f[i]: f[i+1]]
@@ -189,70 +450,61 @@ def get_partition_indexes(first, second):
     answer = [(0, 0)]
     if m <= 1 or n <= 1:
         answer += [(m, n)]
+        return answer
+    word_ends = _make_word_ends(first), _make_word_ends(second)
+    if max_enumerated_paths is not None:
+        # разбиение зависит только от того, через какие пары концов слов проходит путь:
+        table, pointers = make_levenstein_table(" ".join(first), " ".join(second))
+        pointers = pointers.tolist()
+        word_ends_cells = [(i, j) for i in word_ends[0] for j in word_ends[1]]
+        is_unique, paths_count = _is_path_choice_irrelevant(pointers, word_ends_cells)
+        if is_unique or paths_count > max_enumerated_paths:
+            current_indexes, _ = _partition_of_path(extract_canonical_alignment(pointers),
+                                                    *word_ends)
+            return tuple(current_indexes) if current_indexes[-1] == (m, n) else []
+    levenstein_table, backtraces = make_levenstein_table(" ".join(first), " ".join(second))
+    best_paths_in_table = extract_best_alignment(backtraces)
+    good_partitions, other_partitions = set(), set()
+    for path in best_paths_in_table:
+        current_indexes, is_partition_good = _partition_of_path(path, *word_ends)
+        if current_indexes[-1] == (m, n):
+            if is_partition_good:
+                good_partitions.add(tuple(current_indexes))
+            else:
+                other_partitions.add(tuple(current_indexes))
+    if len(good_partitions) >= 1:
+        answer = list(good_partitions)[0]
     else:
-        levenstein_table, backtraces = make_levenstein_table(" ".join(first), " ".join(second))
-        best_paths_in_table = extract_best_alignment(backtraces)
-        good_partitions, other_partitions = set(), set()
-        word_ends = [0], [0]
-        last = -1
-        for i, word in enumerate(first):
-            last = last + len(word) + 1
-            word_ends[0].append(last)
-        last = -1
-        for i, word in enumerate(second):
-            last = last + len(word) + 1
-            word_ends[1].append(last)
-        for path in best_paths_in_table:
-            current_indexes = [(0, 0)]
-            first_pos, second_pos = 0, 0
-            is_partition_good = True
-            for i, j in path[1:]:
-                if i > word_ends[0][first_pos]:
-                    first_pos += 1
-                if j > word_ends[1][second_pos]:
-                    second_pos += 1
-                if i == word_ends[0][first_pos] and j == word_ends[1][second_pos]:
-                    if first_pos > current_indexes[-1][0] and second_pos > current_indexes[-1][1]:
-                        current_indexes.append((first_pos, second_pos))
-                        if first_pos < len(first):
-                            first_pos += 1
-                        if second_pos < len(second):
-                            second_pos += 1
-                    else:
-                        is_partition_good = False
-            if current_indexes[-1] == (m, n):
-                if is_partition_good:
-                    good_partitions.add(tuple(current_indexes))
-                else:
-                    other_partitions.add(tuple(current_indexes))
-        if len(good_partitions) >= 1:
-            answer = list(good_partitions)[0]
+        if len(other_partitions):
+            answer = list(other_partitions)[0]
         else:
-            if len(other_partitions):
-                answer = list(other_partitions)[0]
-            else:
-                answer = []
+            answer = []
     return answer
 
-def align_sents(source, correct, return_only_different=False, replace_cost=1.0, partition_intermediate=True):
+def align_sents(source, correct, return_only_different=False, replace_cost=1.0, partition_intermediate=True,
+                max_enumerated_paths=MAX_ENUMERATED_PATHS):
     """
     Возвращает индексы границ групп в оптимальном выравнивании
 
     :param source, correct: str, исходное и исправленное предложение
     :param return_only_different: следует ли возвращать только индексы нетождественных исправлений
+    :param max_enumerated_paths: int or None, предел перебора оптимальных путей
+        (см. extract_levenstein_alignment), None означает перебор всех путей
     :return: answer, list of pairs of tuples,
         оптимальное разбиение на группы. Если answer[i] == ((i, j), (k, l)), то
         в одну группу входят source[i:j] и correct[k:l]
     """
-    alignments = extract_levenstein_alignments(source, correct, replace_cost=replace_cost)
+    alignment = extract_levenstein_alignment(source, correct, replace_cost=replace_cost,
+                                             max_enumerated_paths=max_enumerated_paths)
     m, n = len(source), len(correct)
     prev = 0, 0
     answer = []
-    for i, j in alignments[0]:
+    for i, j in alignment:
         if i > prev[0] + 1 or j > prev[1] + 1:
             if partition_intermediate:
                 partition_indexes =\
-                    get_partition_indexes(source[prev[0]: i-1], correct[prev[1]: j-1])
+                    get_partition_indexes(source[prev[0]: i-1], correct[prev[1]: j-1],
+                                          max_enumerated_paths=max_enumerated_paths)
                 if partition_indexes is not None:
                     for pos, (f, s) in enumerate(partition_indexes[:-1]):
                         answer.append(((prev[0] + f, prev[0] + partition_indexes[pos+1][0]),
@@ -267,7 +519,8 @@ def align_sents(source, correct, return_only_different=False, replace_cost=1.0,
     if m > prev[0] or n > prev[1]:
         if partition_intermediate:
             partition_indexes =\
-                    get_partition_indexes(source[prev[0]: m], correct[prev[1]: n])
+                    get_partition_indexes(source[prev[0]: m], correct[prev[1]: n],
+                                          max_enumerated_paths=max_enumerated_paths)
             if partition_indexes is not None:
                 for pos, (f, s) in enumerate(partition_indexes[:-1]):
                         answer.append(((prev[0] + f, prev[0] + partition_indexes[pos+1][0]),
@@ -288,6 +541,19 @@ def test(task=1):
         align_sents(first, second)
 
 
+def extract_corrections(source, correct):
+    """
+    Извлекает исправления из выравнивания двух предложений
+
+    :param source: list of strs, исходное предложение
+    :param correct: list of strs, исправленное предложение
+    :return: dict, {(i, j): tuple of strs}, группа слов source[i:j]
+        исправлена на кортеж слов из correct
+    """
+    indexes = align_sents(source, correct, return_only_different=True, replace_cost=1.9)
+    return {(i, j): tuple(correct[k:l]) for ((i, j), (k, l)) in indexes}
+
+
 def evaluate_spelling_corrector(source_sents, correct_sents, answer_sents):
     """
     Function for evaluation of spelling corrector models
@@ -310,12 +576,10 @@ def evaluate_spelling_corrector(source_sents, correct_sents, answer_sents):
     answer_corrections = dict()
     for num, (source, correct, answer) in \
             enumerate(zip(source_sents, correct_sents, answer_sents)):
-        indexes = align_sents(source, correct, return_only_different=True, replace_cost=1.9)
-        for ((i, j), (k, l)) in indexes:
-            etalon_corrections[(num, i, j)] = tuple(correct[k:l])
-        indexes = align_sents(source, answer, return_only_different=True, replace_cost=1.9)
-        for ((i, j), (k, l)) in indexes:
-            answer_corrections[(num, i, j)] = tuple(answer[k:l])
+        for (i, j), correction in extract_corrections(source, correct).items():
+            etalon_corrections[(num, i, j)] = correction
+        for (i, j), correction in extract_corrections(source, answer).items():
+            answer_corrections[(num, i, j)] = correction
     TP = 0
     for triple, answer_correction in answer_corrections.items():
         etalon_correction = etalon_corrections.get(triple)
@@ -386,25 +650,152 @@ def evaluate_spelling_corrector(source_sents, correct_sents, answer_sents):
     #                                                                            width=width))
     #             fout.write("\n")
 
+def read_nonempty_lines(infile):
+    """
+    Лениво читает непустые строки файла (без концевых пробелов)
+    """
+    for line in infile:
+        line = line.strip()
+        if line != "":
+            yield line
+
+
+def make_chunks(iterable, chunk_size):
+    """
+    Лениво разбивает последовательность на списки длины chunk_size (последний может быть короче)
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if len(chunk) == 0:
+            break
+        yield chunk
+
+
+def count_chunk_corrections(chunk):
+    """
+    Считает исправления в группе предложений
+
+    :param chunk: list of triples (source, correct, answer), исходные строки
+    :return: число предложений, TP, число ответов системы, число эталонных исправлений
+    """
+    TP, answer_corrections_number, etalon_corrections_number = 0, 0, 0
+    for source, correct, answer in chunk:
+        source, correct, answer = extract_words(source), extract_words(correct), extract_words(answer)
+        etalon_corrections = extract_corrections(source, correct)
+        answer_corrections = extract_corrections(source, answer)
+        TP += sum(int(etalon_corrections.get(indexes) == answer_correction)
+                  for indexes, answer_correction in answer_corrections.items())
+        answer_corrections_number += len(answer_corrections)
+        etalon_corrections_number += len(etalon_corrections)
+    return len(chunk), TP, answer_corrections_number, etalon_corrections_number
+
+
+def _imap_bounded(pool, func, iterable, max_pending):
+    """
+    Аналог pool.imap, но не читает iterable больше чем на max_pending задач вперёд
+    """
+    pending = deque()
+    for elem in iterable:
+        pending.append(pool.apply_async(func, (elem,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+
+def evaluate_spelling_corrector_streaming(sentence_triples, jobs=1, chunk_size=1000,
+                                          verbose=True):
+    """
+    Потоковая версия evaluate_spelling_corrector для больших корпусов:
+    предложения читаются лениво, выравниваются группами по chunk_size предложений
+    в jobs процессах, после чего счётчики групп складываются
+
+    :param sentence_triples: iterable of triples (source, correct, answer), исходные строки
+    :param jobs: int, число процессов (1 --- считать в текущем процессе)
+    :param chunk_size: int, число предложений в одной задаче
+    :param verbose: печатать ли прогресс после каждой группы
+    :return: dict with precision, recall, f_measure, TP,
+        answer_corrections_number, etalon_corrections_number, sentences_number
+    """
+    TP, answer_corrections_number, etalon_corrections_number = 0, 0, 0
+    sentences_number = 0
+    chunks = make_chunks(sentence_triples, chunk_size)
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    try:
+        if pool is not None:
+            # держим заданными не более двух групп на процесс, чтобы не читать файлы целиком
+            chunk_counts = _imap_bounded(pool, count_chunk_corrections, chunks, 2 * jobs)
+        else:
+            chunk_counts = map(count_chunk_corrections, chunks)
+        for chunk_index, (chunk_sentences_number, chunk_TP, chunk_answers_number,
+                          chunk_etalons_number) in enumerate(chunk_counts):
+            sentences_number += chunk_sentences_number
+            TP += chunk_TP
+            answer_corrections_number += chunk_answers_number
+            etalon_corrections_number += chunk_etalons_number
+            if verbose:
+                print("Chunk {0}: {1} sentences, TP={2} answers={3} etalons={4}; "
+                      "total: {5} sentences, TP={6} answers={7} etalons={8}".format(
+                          chunk_index, chunk_sentences_number, chunk_TP, chunk_answers_number,
+                          chunk_etalons_number, sentences_number, TP, answer_corrections_number,
+                          etalon_corrections_number))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    precision = TP / answer_corrections_number if answer_corrections_number > 0 else 0
+    recall = TP / etalon_corrections_number if etalon_corrections_number > 0 else 0
+    f_measure = 2 * precision * recall / (precision + recall) if TP > 0 else 0
+    print("Precision={0:.2f} Recall={1:.2f} FMeasure={2:.2f}".format(
+        100 * precision, 100 * recall, 100 * f_measure))
+    print(TP, answer_corrections_number, etalon_corrections_number)
+    return {
+        'precision': precision,
+        'recall': recall,
+        'f_measure': f_measure,
+        'TP': TP,
+        'answer_corrections_number': answer_corrections_number,
+        'etalon_corrections_number': etalon_corrections_number,
+        'sentences_number': sentences_number,
+    }
+
 if __name__ == "__main__":
     args = sys.argv[1:]
     output_differences = False
-    opts, args = getopt.getopt(args, "d:", ["--differences="])
+    jobs, chunk_size = 1, 1000
+    opts, args = getopt.getopt(args, "d:j:", ["differences=", "jobs=", "chunk-size="])
     for opt, val in opts:
         if opt in ["-d", "--differences"]:
             output_differences = True
             diff_file = val
+        elif opt in ["-j", "--jobs"]:
+            jobs = int(val)
+        elif opt == "--chunk-size":
+            chunk_size = int(val)
         else:
             print(ValueError("Wrong option {0}".format(opt)))
     if len(args) == 0:
         test()
         sys.exit(0)
     if len(args) != 3:
-        sys.exit("Использование: evaluate.py source_file correct_file answer_file\n"
+        sys.exit("Использование: evaluate.py [-d diff_file] [-j jobs] [--chunk-size N] "
+                 "source_file correct_file answer_file\n"
                  "source_file: исходный файл\n"
                  "correct_file: файл с эталонными исправлениями\n"
-                 "answer_file: файл с ответами системы\n")
+                 "answer_file: файл с ответами системы\n"
+                 "-d, --differences: файл для вывода расхождений с эталоном\n"
+                 "-j, --jobs: число процессов (потоковая оценка без вывода расхождений)\n"
+                 "--chunk-size: число предложений в одной задаче потоковой оценки\n")
     source_file, correct_file, answer_file = args
+    if not output_differences:
+        with open(source_file, "r", encoding="utf8") as fsource,\
+                open(correct_file, "r", encoding="utf8") as fcorr,\
+                open(answer_file, "r", encoding="utf8") as fans:
+            sentence_triples = zip(read_nonempty_lines(fsource), read_nonempty_lines(fcorr),
+                                   read_nonempty_lines(fans))
+            evaluate_spelling_corrector_streaming(sentence_triples, jobs=jobs,
+                                                  chunk_size=chunk_size)
+        sys.exit(0)
     with open(source_file, "r", encoding="utf8") as fsource,\
             open(correct_file, "r", encoding="utf8") as fcorr,\
             open(answer_file, "r", encoding="utf8") as fans:
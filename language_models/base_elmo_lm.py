@@ -1,6 +1,47 @@
 import numpy as np
 # from nltk.tokenize import sent_tokenize, word_tokenize
 from nltk.tokenize import word_tokenize
+from language_models.batch_scheduler import LengthBucketedBatchScheduler
+
+
+class CandidatesElmoData():
+    """
+    ELMO data of a sentence restricted to a subset of words of the vocabulary.
+
+    It holds probabilities only for requested words (ex.: correction candidates of the
+    sentence) instead of the full [TOKENS_NUM x 2 x VOCAB_SIZE] matrix, but it is indexed the
+    same way as the full matrix: elmo_data[position, direction, word_idx], where word_idx is an
+    index in the full vocabulary.
+    """
+    def __init__(self, word_ids, probas):
+        """
+
+        :param word_ids: sequence of word indexes of the vocabulary
+        :param probas: ndarray [TOKENS_NUM, 2, len(word_ids)] of probabilities of the words
+        """
+        self.word_ids = np.asarray(word_ids, dtype=np.int64)
+        self.probas = probas
+        self._columns = {word_idx: column for column, word_idx in enumerate(word_ids)}
+
+    def __getitem__(self, key):
+        *position_keys, word_idx = key
+        try:
+            column = self._columns[word_idx]
+        except KeyError:
+            raise KeyError("Probability of word with index %s was not requested from LM" % word_idx)
+        return self.probas[tuple(position_keys) + (column,)]
+
+    def __len__(self):
+        return len(self.probas)
+
+    def covers(self, word_ids):
+        """Checks if probabilities of all word_ids are present"""
+        return all(word_idx in self._columns for word_idx in word_ids)
+
+    @property
+    def nbytes(self):
+        return self.probas.nbytes + self.word_ids.nbytes
+
 
 class BaseELMOLM():
     """
@@ -9,6 +50,41 @@ class BaseELMOLM():
     # discount number to reduce probability of UNKNOWN words
     UNK_DISCOUNTER = 1e-6
 
+    # scheduler of dynamic batches, initialized lazily by get_batch_scheduler
+    batch_scheduler = None
+
+    # cache of outputs of elmo_lm_for_word_ids (ElmoOutputCache), disabled by default
+    output_cache = None
+
+    def set_output_cache(self, output_cache):
+        """
+        Sets cache of ELMO outputs of sentences (see language_models.elmo_output_cache)
+
+        :param output_cache: ElmoOutputCache or None to disable caching
+        """
+        self.output_cache = output_cache
+
+    def get_batch_scheduler(self):
+        """
+        Returns a scheduler of length bucketed batches with budget measured against available
+        memory and the vocabulary size of the LM.
+        """
+        if self.batch_scheduler is None:
+            self.batch_scheduler = LengthBucketedBatchScheduler(vocab_size=len(self.words))
+        return self.batch_scheduler
+
+    def elmo_lm_batched(self, tokenized_sentences, batch_scheduler=None):
+        """
+        Runs elmo_lm over dynamic batches of sentences of close lengths.
+
+        :param tokenized_sentences: list of tokenized sentences (of any size)
+        :param batch_scheduler: LengthBucketedBatchScheduler, if None the LM's one is used
+        :return: list of elmo datas in the order of tokenized_sentences
+        """
+        if batch_scheduler is None:
+            batch_scheduler = self.get_batch_scheduler()
+        return batch_scheduler.map(self.elmo_lm, tokenized_sentences)
+
     @staticmethod
     def chunk_generator(items_list, chunk_size):
         """
@@ -57,6 +133,64 @@ class BaseELMOLM():
         data = self.elmo_lm([tok_wrapped])[0]
         return data
 
+    def elmo_lm_for_word_ids(self, tokenized_sentences, word_ids_batch):
+        """
+        Calculates ELMO data restricted to requested words of the vocabulary for each sentence.
+        Index of <UNK> is always requested, because lookups of unknown tokens fall back to it.
+        Duplicate sentences of the batch are calculated once, if output_cache is set then
+        cached sentences are not calculated at all.
+
+        :param tokenized_sentences: list of tokenized sentences
+        :param word_ids_batch: list of iterables of word indexes (one iterable per sentence)
+        :return: list of CandidatesElmoData
+        """
+        # duplicate sentences are collapsed, so each unique sentence is calculated once with
+        # the union of requested words:
+        unique_word_ids = {}
+        unique_sentences = {}
+        for tokenized_sentence, word_ids in zip(tokenized_sentences, word_ids_batch):
+            key = tuple(tokenized_sentence)
+            if key not in unique_word_ids:
+                unique_word_ids[key] = {self.word_index.get("<UNK>")}
+                unique_sentences[key] = tokenized_sentence
+            unique_word_ids[key].update(word_ids)
+
+        results = {}
+        if self.output_cache is not None:
+            for key, word_ids in unique_word_ids.items():
+                elmo_data = self.output_cache.get(unique_sentences[key], word_ids)
+                if elmo_data is not None:
+                    results[key] = elmo_data
+
+        missed_keys = [key for key in unique_word_ids if key not in results]
+        if missed_keys:
+            missed_word_ids = [sorted(unique_word_ids[key]) for key in missed_keys]
+            probas_batch = self._elmo_lm_for_word_ids(
+                [unique_sentences[key] for key in missed_keys], missed_word_ids)
+            for key, word_ids, probas in zip(missed_keys, missed_word_ids, probas_batch):
+                elmo_data = CandidatesElmoData(word_ids, probas)
+                if self.output_cache is not None:
+                    elmo_data = self.output_cache.put(unique_sentences[key], elmo_data)
+                results[key] = elmo_data
+
+        return [results[tuple(tokenized_sentence)] for tokenized_sentence in tokenized_sentences]
+
+    def _elmo_lm_for_word_ids(self, tokenized_sentences, word_ids_batch):
+        """
+        Backend specific calculation of probabilities of requested words.
+
+        Default implementation calculates full ELMO data and slices it, backends override it to
+        avoid copying of full distributions.
+
+        :param tokenized_sentences: list of tokenized sentences
+        :param word_ids_batch: list of sorted lists of word indexes (one list per sentence)
+        :return: list of ndarrays [TOKENS_NUM, 2, len(word_ids)]
+        """
+        elmo_datas = self.elmo_lm(tokenized_sentences)
+        return [np.ascontiguousarray(elmo_data[:len(tokenized_sentence)][:, :, word_ids])
+                for elmo_data, tokenized_sentence, word_ids in zip(
+                    elmo_datas, tokenized_sentences, word_ids_batch)]
+
     def get_word_idx(self, word):
         """
         Get a word's index from word string
@@ -97,12 +231,24 @@ class BaseELMOLM():
         likelihood = np.mean(products)
         return likelihood
 
-    def estimate_likelihood_batch(self, sentences_batch, preserve_states=True, batch_size=10):
+    def estimate_likelihood_batch(self, sentences_batch, preserve_states=True, batch_size=None):
         """
         Method estimates a likelihood of the batch of sentences with slicing the batch into minibatches
         to avoid memory error
+
+        :param batch_size: if None then minibatches are formed by the batch scheduler of the LM,
+            otherwise the batch is sliced into minibatches of fixed size
         """
-        if len(sentences_batch) > batch_size:
+        if batch_size is None:
+            tok_sents = self.tokenize_sentence_batch(list(sentences_batch))
+            output_batch = [None] * len(sentences_batch)
+            for batch_indexes, _ in self.get_batch_scheduler().schedule(tok_sents):
+                likelihoods_mini = self._estimate_likelihood_minibatch(
+                    [sentences_batch[idx] for idx in batch_indexes],
+                    preserve_states=preserve_states)
+                for idx, each_likelihood in zip(batch_indexes, likelihoods_mini):
+                    output_batch[idx] = each_likelihood
+        elif len(sentences_batch) > batch_size:
             batch_gen = self.chunk_generator(sentences_batch, batch_size)
             output_batch = []
             for mini_batch in batch_gen:
@@ -0,0 +1,175 @@
+"""
+Dynamic batching of tokenized sentences for forward passes of ELMO LMs.
+
+Sentences are sorted by length and grouped into buckets of close lengths, then each bucket is
+sliced into batches so that padded size of a batch (max_len * batch_size) fits into a budget of
+padded tokens. The budget may be fixed or measured against available memory (GPU memory if torch
+with CUDA is available, otherwise host memory).
+"""
+import os
+
+# size of the vocabulary of ELMO LMs used in the project:
+DEFAULT_VOCAB_SIZE = 1000000
+
+# how many bytes are allocated per one padded token of the batch: logits and softmax outputs
+# (float32) for 2 directions over the vocabulary
+BYTES_PER_VOCAB_ITEM = 2 * 2 * 4
+
+# fraction of available memory which a batch is allowed to occupy
+DEFAULT_MEMORY_FRACTION = 0.5
+
+# budget which is used when available memory can not be measured
+FALLBACK_PADDED_TOKENS_BUDGET = 500
+
+
+def available_memory_bytes():
+    """
+    Measures memory available for LM outputs.
+
+    :return: int, free bytes of the current CUDA device if torch with CUDA is available, free
+        bytes of host memory otherwise. None if memory can not be measured.
+    """
+    try:
+        import torch
+        if torch.cuda.is_available():
+            free_bytes, _ = torch.cuda.mem_get_info()
+            return free_bytes
+    except (ImportError, AttributeError, RuntimeError):
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class LengthBucketedBatchScheduler():
+    """
+    Scheduler which slices a list of tokenized sentences into batches of sentences of close
+    lengths so that padding is minimal and padded size of each batch fits into budget.
+
+    Usage:
+        scheduler = LengthBucketedBatchScheduler(max_padded_tokens=500)
+        for indexes, batch in scheduler.schedule(tokenized_sentences):
+            outputs = lm.elmo_lm(batch)
+        print(scheduler.report())
+    """
+
+    def __init__(self, max_padded_tokens=None, bucket_width=4, max_batch_size=None,
+                 vocab_size=DEFAULT_VOCAB_SIZE, memory_fraction=DEFAULT_MEMORY_FRACTION):
+        """
+
+        :param max_padded_tokens: int or None, budget of padded tokens (max_len * batch_size) per
+            batch. If None the budget is measured against available memory before each schedule.
+        :param bucket_width: int, sentences whose lengths differ by bucket_width or more never
+            get into the same batch (so padding per sentence is less than bucket_width)
+        :param max_batch_size: int or None, optional limit of sentences in batch
+        :param vocab_size: size of vocabulary of the LM, determines memory per padded token
+        :param memory_fraction: fraction of available memory which a batch may occupy
+        """
+        self.max_padded_tokens = max_padded_tokens
+        self.bucket_width = max(1, bucket_width)
+        self.max_batch_size = max_batch_size
+        self.bytes_per_padded_token = vocab_size * BYTES_PER_VOCAB_ITEM
+        self.memory_fraction = memory_fraction
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Resets counters of padding efficiency"""
+        self.stats = {
+            'batches': 0,
+            'sentences': 0,
+            'real_tokens': 0,
+            'padded_tokens': 0
+        }
+
+    def padded_tokens_budget(self):
+        """
+        :return: int, max number of padded tokens allowed in a batch
+        """
+        if self.max_padded_tokens:
+            return self.max_padded_tokens
+
+        free_bytes = available_memory_bytes()
+        if not free_bytes:
+            return FALLBACK_PADDED_TOKENS_BUDGET
+        return max(1, int(free_bytes * self.memory_fraction / self.bytes_per_padded_token))
+
+    def schedule(self, tokenized_sentences):
+        """
+        Generator of batches.
+
+        Sentences are processed from the longest to the shortest, so memory errors (if any) occur
+        at the first batch.
+
+        :param tokenized_sentences: list of lists of tokens
+        :return: yields tuples (indexes, batch), where indexes are positions of sentences of the
+            batch in tokenized_sentences
+        """
+        budget = self.padded_tokens_budget()
+        lengths = [len(each_sent) for each_sent in tokenized_sentences]
+        order = sorted(range(len(tokenized_sentences)), key=lambda idx: lengths[idx],
+                       reverse=True)
+
+        batch_indexes = []
+        # batch is sorted by decreasing length so the first sentence is the longest
+        batch_max_len = 0
+        for idx in order:
+            length = lengths[idx]
+            if batch_indexes:
+                overflows_budget = batch_max_len * (len(batch_indexes) + 1) > budget
+                overflows_size = self.max_batch_size and len(batch_indexes) >= self.max_batch_size
+                other_bucket = batch_max_len - length >= self.bucket_width
+                if overflows_budget or overflows_size or other_bucket:
+                    yield self._emit(batch_indexes, tokenized_sentences, lengths)
+                    batch_indexes = []
+            if not batch_indexes:
+                batch_max_len = length
+                if length > budget:
+                    print("Sentence is longer than padded tokens budget (%d > %d)" % (
+                        length, budget))
+            batch_indexes.append(idx)
+
+        if batch_indexes:
+            yield self._emit(batch_indexes, tokenized_sentences, lengths)
+
+    def _emit(self, batch_indexes, tokenized_sentences, lengths):
+        """Updates stats and prepares batch for yielding"""
+        real_tokens = sum(lengths[idx] for idx in batch_indexes)
+        self.stats['batches'] += 1
+        self.stats['sentences'] += len(batch_indexes)
+        self.stats['real_tokens'] += real_tokens
+        self.stats['padded_tokens'] += lengths[batch_indexes[0]] * len(batch_indexes)
+        return batch_indexes, [tokenized_sentences[idx] for idx in batch_indexes]
+
+    def padding_efficiency(self):
+        """
+        :return: float, share of real tokens among padded ones over scheduled batches
+        """
+        if not self.stats['padded_tokens']:
+            return 1.0
+        return self.stats['real_tokens'] / self.stats['padded_tokens']
+
+    def report(self):
+        """
+        :return: str with summary of scheduled batches
+        """
+        return "batches: %d, sentences: %d, padded tokens: %d, padding efficiency: %0.3f" % (
+            self.stats['batches'], self.stats['sentences'], self.stats['padded_tokens'],
+            self.padding_efficiency())
+
+    def map(self, batch_fn, tokenized_sentences):
+        """
+        Applies batch_fn to scheduled batches and returns its outputs in the order of input.
+
+        :param batch_fn: function which receives a list of tokenized sentences and returns a
+            sequence of per sentence outputs of the same length (ex.: BaseELMOLM.elmo_lm)
+        :param tokenized_sentences: list of lists of tokens
+        :return: list of outputs aligned with tokenized_sentences
+        """
+        outputs = [None] * len(tokenized_sentences)
+        for batch_indexes, batch in self.schedule(tokenized_sentences):
+            batch_outputs = batch_fn(batch)
+            for idx, each_output in zip(batch_indexes, batch_outputs):
+                outputs[idx] = each_output
+        return outputs
@@ -0,0 +1,160 @@
+"""
+Cache of ELMO outputs of sentences.
+
+Chat logs repeat identical utterances constantly, so outputs of LM (restricted to candidate
+words, see BaseELMOLM.elmo_lm_for_word_ids) are cached by tokenized sentence. Memory tier is
+LRU bounded by bytes of cached arrays, optional disk tier keeps outputs between restarts. Files
+of the disk tier are keyed by the fingerprint of the model too, so outputs of another model (or
+of another version of the model) are never loaded.
+
+Usage:
+    lm.set_output_cache(ElmoOutputCache(max_bytes=256 * 2 ** 20, cache_dir="/tmp/elmo_cache",
+                                        model_fingerprint="elmo_ru_news_v2"))
+    ...
+    print(lm.output_cache.stats())
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from language_models.base_elmo_lm import CandidatesElmoData
+from utilities.lru_cache import LRUCache
+
+# default budget of memory tier
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+
+
+class ElmoOutputCache():
+    """
+    Two tier (memory, disk) cache of CandidatesElmoData keyed by tokenized sentence.
+
+    Cached data is valid for a request if it covers all requested word indexes, data of a
+    sentence which is calculated for other words is merged with the cached one.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, cache_dir=None, dtype=None,
+                 model_fingerprint=None):
+        """
+
+        :param max_bytes: int, budget of memory tier in bytes
+        :param cache_dir: str or None, directory of disk tier. If None, disk tier is disabled
+        :param dtype: dtype of stored probabilities (ex.: np.float32 halves memory of float64
+            outputs), if None outputs are stored as is
+        :param model_fingerprint: str which identifies the model and its version (ex.: path and
+            checksum of weights), it is required for disk tier
+        """
+        if cache_dir and not model_fingerprint:
+            raise ValueError("model_fingerprint is required for disk tier of ElmoOutputCache")
+        self.memory = LRUCache(max_bytes, size_fn=lambda elmo_data: elmo_data.nbytes)
+        self.cache_dir = cache_dir
+        self.dtype = dtype
+        self.model_fingerprint = model_fingerprint
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.disk_hits = 0
+        self.disk_writes = 0
+
+    @staticmethod
+    def make_key(tokenized_sentence):
+        return tuple(tokenized_sentence)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1("\u0001".join((self.model_fingerprint, ) + key).encode(
+            "utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".npz")
+
+    def get(self, tokenized_sentence, word_ids):
+        """
+        Looks up ELMO data of the sentence which covers all word_ids
+
+        :param tokenized_sentence: list of tokens
+        :param word_ids: iterable of requested word indexes
+        :return: CandidatesElmoData or None
+        """
+        key = self.make_key(tokenized_sentence)
+        elmo_data = self.memory.get(key, is_valid=lambda cached: cached.covers(word_ids))
+        if elmo_data is not None:
+            return elmo_data
+
+        if self.cache_dir and self.memory.peek(key) is None:
+            elmo_data = self._load(key)
+            if elmo_data is not None:
+                # data which does not cover the request is kept to be merged by put:
+                self.memory.put(key, elmo_data)
+                if elmo_data.covers(word_ids):
+                    self.disk_hits += 1
+                    return elmo_data
+        return None
+
+    def put(self, tokenized_sentence, elmo_data):
+        """
+        Stores ELMO data of the sentence in memory tier and writes it to disk tier
+
+        :param tokenized_sentence: list of tokens
+        :param elmo_data: CandidatesElmoData
+        """
+        key = self.make_key(tokenized_sentence)
+        if self.dtype is not None and elmo_data.probas.dtype != self.dtype:
+            elmo_data = CandidatesElmoData(elmo_data.word_ids, elmo_data.probas.astype(self.dtype))
+        cached_elmo_data = self.memory.peek(key)
+        if cached_elmo_data is not None:
+            elmo_data = self._merge(cached_elmo_data, elmo_data)
+        self.memory.put(key, elmo_data)
+        if self.cache_dir:
+            self._dump(key, elmo_data)
+        return elmo_data
+
+    @staticmethod
+    def _merge(cached_elmo_data, elmo_data):
+        """
+        :return: CandidatesElmoData with words of both datas (new probabilities are preferred)
+        """
+        if len(cached_elmo_data) != len(elmo_data):
+            return elmo_data
+        extra_columns = [column for column, word_idx in enumerate(cached_elmo_data.word_ids)
+                         if not elmo_data.covers((word_idx, ))]
+        if not extra_columns:
+            return elmo_data
+        word_ids = np.concatenate([elmo_data.word_ids, cached_elmo_data.word_ids[extra_columns]])
+        probas = np.concatenate([elmo_data.probas,
+                                 cached_elmo_data.probas[:, :, extra_columns]], axis=2)
+        return CandidatesElmoData(word_ids.tolist(), probas)
+
+    def _load(self, key):
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as npz:
+                # sha1 collisions are unlikely but tokens and the model are checked anyway:
+                if tuple(npz['tokens']) != key or \
+                        str(npz['model_fingerprint']) != self.model_fingerprint:
+                    return None
+                return CandidatesElmoData(npz['word_ids'].tolist(), npz['probas'])
+        except (OSError, ValueError, KeyError) as e:
+            print("Broken ELMO cache file %s: %s" % (path, e))
+            return None
+
+    def _dump(self, key, elmo_data):
+        path = self._disk_path(key)
+        # write to temporary file and rename, so concurrent readers never see partial files:
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "wb") as tmp_file:
+            np.savez(tmp_file, tokens=np.array(key), word_ids=elmo_data.word_ids,
+                     probas=elmo_data.probas, model_fingerprint=np.array(self.model_fingerprint))
+        os.replace(tmp_path, path)
+        self.disk_writes += 1
+
+    def clear(self):
+        """Clears memory tier (disk tier is kept)"""
+        self.memory.clear()
+
+    def stats(self):
+        """
+        :return: dict with counters of memory tier and disk tier
+        """
+        stats = self.memory.stats()
+        stats['disk_hits'] = self.disk_hits
+        stats['disk_writes'] = self.disk_writes
+        return stats
@@ -95,6 +95,32 @@ class ELMOLMTorch(BaseELMOLM):
         :param tokenized_sentences: list of tokenized sentences.
         :return: tensor BATCH_SIZE x TOKENS_NUM x 2 x 1000000
         """
+        softmaxed_output = self._forward(tokenized_sentences)
+        return softmaxed_output.cpu().detach().numpy()
+
+    def _elmo_lm_for_word_ids(self, tokenized_sentences, word_ids_batch):
+        """
+        Gathers probabilities of requested words on GPU, so only [TOKENS_NUM x 2 x len(word_ids)]
+        slices are copied to host instead of full distributions over the vocabulary.
+        """
+        results = []
+        with torch.no_grad():
+            softmaxed_output = self._forward(tokenized_sentences)
+            for sent_idx, (tokenized_sentence, word_ids) in enumerate(zip(tokenized_sentences,
+                                                                           word_ids_batch)):
+                word_ids_tensor = torch.tensor(word_ids, dtype=torch.long,
+                                               device=softmaxed_output.device)
+                sentence_output = softmaxed_output[sent_idx, :len(tokenized_sentence)]
+                gathered = torch.index_select(sentence_output, 2, word_ids_tensor)
+                results.append(gathered.cpu().numpy())
+        return results
+
+    def _forward(self, tokenized_sentences):
+        """
+        Forward pass of ELMO and softmax projection
+        :param tokenized_sentences: list of tokenized sentences.
+        :return: torch tensor (on GPU) BATCH_SIZE x TOKENS_NUM x 2 x 1000000
+        """
         # TODO clarify usage of s, /s
         # if tokenized_sentences[0][0].lower() == "<s>":
         #     # wrapped tokenization, then we need to unwrap it because torchy ELMO wraps itself
@@ -140,35 +166,7 @@ class ELMOLMTorch(BaseELMOLM):
         right_results = self._ff(right_activations)
         stacked_output = torch.stack((left_results, right_results), dim=2)
         softmaxed_output = self._softmax_fn(stacked_output)
-
-        # outputs:
-        the_first_half = last_layer_activations[:, :, :512]
-        the_right_half = last_layer_activations[:, :, 512:]
-
-        tfh = the_first_half.cpu().detach().numpy()
-        trh = the_right_half.cpu().detach().numpy()
-        # print('min, max')
-        # print(min(tfh), max(tfh))
-        # print('std, mean, sum')
-        # print(np.std(tfh),
-        #       np.mean(tfh), np.sum(tfh))
-        # print("the_first_half:")
-        # print(tfh)
-        # print(tfh.shape)
-        # print("the_right_half:")
-        # print(trh)
-        # print(trh.shape)
-        # # lla = last_layer_activations.cpu().detach().numpy()
-        # print("the_right_half Activations")
-        # lla_ravel = trh.ravel()
-        # for each_num in lla_ravel:
-        #     print(each_num, end=", ")
-        # print("___")
-        # # just test if it print all values
-        # print(lla_ravel)
-        # print("___")
-
-        return softmaxed_output.cpu().detach().numpy()
+        return softmaxed_output
 
     def _estimate_likelihood_minibatch(self, sentences_batch, preserve_states=True):
         """
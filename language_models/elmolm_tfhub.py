@@ -2,8 +2,6 @@
 import tensorflow as tf
 import tensorflow_hub as hub
 import numpy as np
-import scipy
-import scipy.special
 from language_models.base_elmo_lm import BaseELMOLM
 from bilm.data import UnicodeCharsVocabulary
 # import sys
@@ -16,19 +14,23 @@ ROOT_DIR = os.path.dirname(SELF_DIR)
 class ELMOLMTFHub(BaseELMOLM):
     """
     This ELMO LM tries to reimplement faster TF ELMO from TF hub
+
+    The graph (hub module call, softmax projection and candidates gathering) is built once at
+    initialization and is served by a persistent session, so each call of elmo_lm only feeds
+    placeholders.
     """
+    # size of each of directional halves of lstm_outputs2 of the hub module
+    LSTM_HALF_DIM = 512
+
     def __init__(self):
-        self._elmo = hub.Module(
-            ROOT_DIR + "/bidirectional_lms/elmo_ru_news/tf_hub_model_epoch_n_3/",
-            trainable=True)
         base_path = ROOT_DIR + "/bidirectional_lms/elmo_ru_news"
         ckpt_prefixed_path = base_path + "/model.ckpt-0003"
         # metafile_path = base_path + "/model.ckpt-0003.meta"
         # ckpt_prefixed_path = base_path + "/model.ckpt-1327437"
         # metafile_path = base_path + "/model.ckpt-1327437.meta"
 
-        self.softmax_w = tf.train.load_variable(ckpt_prefixed_path, 'lm/softmax/W')
-        self.softmax_bias = tf.train.load_variable(ckpt_prefixed_path, 'lm/softmax/b')
+        softmax_w = tf.train.load_variable(ckpt_prefixed_path, 'lm/softmax/W')
+        softmax_bias = tf.train.load_variable(ckpt_prefixed_path, 'lm/softmax/b')
 
         # read vocabulary
         path_to_vocab = base_path + "/tokens_set.txt"
@@ -44,66 +46,115 @@ class ELMOLMTFHub(BaseELMOLM):
         # index of unknown token:
         self.IDX_UNK_TOKEN = self.word_index.get("<UNK>")
 
-    def elmo_lm(self, tokenized_sentences):
+        self._build_graph(softmax_w, softmax_bias)
+
+    def _build_graph(self, softmax_w, softmax_bias):
         """
+        Builds the inference graph and the session which is reused by all calls.
 
-        :param tokenized_sentences: Ex.: ["<S>", "мама", "мыла", "раму", "</S>"], ["<S>", "мама", "</S>"]
-        :return:
+        Softmax matrix (1M x 512) is too large for a graph constant (protobuf limit is 2GB), so it
+        is stored in a non trainable variable initialized from placeholder at session start.
+
+        :param softmax_w: ndarray [VOCAB_SIZE, 512] of projection of lstm outputs into words
+        :param softmax_bias: ndarray [VOCAB_SIZE] bias of projection
+        """
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            self._elmo = hub.Module(
+                ROOT_DIR + "/bidirectional_lms/elmo_ru_news/tf_hub_model_epoch_n_3/",
+                trainable=True)
+
+            self._tokens_ph = tf.placeholder(tf.string, shape=[None, None], name="tokens")
+            self._lengths_ph = tf.placeholder(tf.int32, shape=[None], name="sequence_len")
+            # ids of words which probabilities are requested by gathering op:
+            self._word_ids_ph = tf.placeholder(tf.int32, shape=[None], name="word_ids")
+
+            softmax_w_init = tf.placeholder(tf.float32, shape=softmax_w.shape)
+            softmax_w_var = tf.Variable(softmax_w_init, trainable=False, name="softmax_w")
+            softmax_b = tf.constant(softmax_bias, dtype=tf.float32, name="softmax_b")
+
+            lstm_outputs = self._elmo(inputs={
+                "tokens": self._tokens_ph,
+                "sequence_len": self._lengths_ph
+            }, signature="tokens", as_dict=True)["lstm_outputs2"]
+
+            # [BATCH, TOKENS, 2, 512]: left (forward) half goes first, then right (backward) one
+            directional_outputs = tf.stack(
+                [lstm_outputs[:, :, :self.LSTM_HALF_DIM], lstm_outputs[:, :, self.LSTM_HALF_DIM:]],
+                axis=2)
+            # [BATCH, TOKENS, 2, VOCAB_SIZE]
+            logits = tf.tensordot(directional_outputs, softmax_w_var, axes=[[3], [1]]) + softmax_b
+            self._probas_op = tf.nn.softmax(logits, axis=-1)
+
+            # probabilities of requested words only: [BATCH, TOKENS, 2, len(word_ids)]
+            log_normalizer = tf.reduce_logsumexp(logits, axis=-1, keepdims=True)
+            gathered_logits = tf.gather(logits, self._word_ids_ph, axis=-1)
+            self._gathered_probas_op = tf.exp(gathered_logits - log_normalizer)
+
+            self._sess = tf.Session(graph=self._graph)
+            self._sess.run([tf.global_variables_initializer(), tf.tables_initializer()],
+                           feed_dict={softmax_w_init: softmax_w})
+        self._graph.finalize()
+
+    @staticmethod
+    def _pad_batch(tokenized_sentences):
+        """
+        Pads sentences with "" to the length of the longest one.
+
+        :return: tuple (padded_sentences, lengths)
         """
-        # find_the longest sentence and padd other sentences with  "" to allign batch
-        # tokenized_sentences = [["<S>", "мама", "мыла", "раму", "</S>"]]
         lengths = [len(each_sent) for each_sent in tokenized_sentences]
         max_len = max(lengths)
+        padded_sentences = [each_sent + [""] * (max_len - lengths[idx])
+                            for idx, each_sent in enumerate(tokenized_sentences)]
+        return padded_sentences, lengths
 
-        # make padding:
-        padded_sentences = []
-        for idx, each_sent in enumerate(tokenized_sentences):
-            if lengths[idx] < max_len:
-                pad_count = max_len - lengths[idx]
-                padded_sent = each_sent + [""]* pad_count
-                padded_sentences.append(padded_sent)
-            else:
-                padded_sentences.append(each_sent)
-        # #################################################################################
-        # new model from n3 tf hub checkpont:
-        sess = tf.Session()
-        sess.run(tf.global_variables_initializer())
-
-        # tokens_length = [5]
-        embeddings = self._elmo(inputs={
-            "tokens": padded_sentences,
-            "sequence_len": lengths
-        }, signature="tokens", as_dict=True)["lstm_outputs2"]
-        elmo_data = sess.run(embeddings)
-        # #################################################################################
+    def elmo_lm(self, tokenized_sentences):
+        """
 
+        :param tokenized_sentences: Ex.: ["<S>", "мама", "мыла", "раму", "</S>"], ["<S>", "мама", "</S>"]
+        :return: list of ndarrays of shape (tokens_num, 2, VOCAB_SIZE) (padding is removed)
+        """
+        padded_sentences, lengths = self._pad_batch(tokenized_sentences)
+        elmo_data = self._sess.run(self._probas_op, feed_dict={
+            self._tokens_ph: padded_sentences,
+            self._lengths_ph: lengths
+        })
         # now we need to postprocess outputs to remove zeros from short sentences
         # (sents that are shorter than max_len)
-        padless_elmo_datas = []
-        for idx, each_elmo_data in enumerate(elmo_data):
-            if lengths[idx] < max_len:
-                padless_elmo_data = each_elmo_data[:lengths[idx]]
-                padless_elmo_datas.append(padless_elmo_data)
-            else:
-                padless_elmo_datas.append(each_elmo_data)
-
-        # #################################################################################
-        # feed forward and softmax:
-        result_elmo_datas = []
-        # TODO optimize if this work
-        for each_result in padless_elmo_datas:
-            #
-            right_results= np.dot(each_result[:, 512:], self.softmax_w.transpose()) + self.softmax_bias
-            left_results = np.dot(each_result[:, :512], self.softmax_w.transpose()) + self.softmax_bias
-            right_probas = scipy.special.softmax(right_results, axis=1)
-            left_probas = scipy.special.softmax(left_results, axis=1)
-            sent_array = np.array([left_probas, right_probas])
-            # gives a shape like (2, 5, 1000000): (2, tokens_num, 1000000)
-
-            # we need to swap axes so the tokens axis is the first:
-            result_elmo_datas.append(np.swapaxes(sent_array, 0, 1))
-
-        return result_elmo_datas
+        return [each_elmo_data[:lengths[idx]] for idx, each_elmo_data in enumerate(elmo_data)]
+
+    def elmo_lm_gathered(self, tokenized_sentences, word_ids):
+        """
+        Calculates probabilities only for the requested words of vocabulary. The full
+        distribution is normalized on graph and never leaves it.
+
+        :param tokenized_sentences: list of tokenized sentences
+        :param word_ids: list of word indexes of the vocabulary
+        :return: list of ndarrays of shape (tokens_num, 2, len(word_ids))
+        """
+        padded_sentences, lengths = self._pad_batch(tokenized_sentences)
+        elmo_data = self._sess.run(self._gathered_probas_op, feed_dict={
+            self._tokens_ph: padded_sentences,
+            self._lengths_ph: lengths,
+            self._word_ids_ph: word_ids
+        })
+        return [each_elmo_data[:lengths[idx]] for idx, each_elmo_data in enumerate(elmo_data)]
+
+    def _elmo_lm_for_word_ids(self, tokenized_sentences, word_ids_batch):
+        """
+        Gathers union of requested words of the batch on graph and then selects columns
+        of each sentence.
+        """
+        union_word_ids = sorted(set().union(*word_ids_batch))
+        columns = {word_idx: column for column, word_idx in enumerate(union_word_ids)}
+        elmo_datas = self.elmo_lm_gathered(tokenized_sentences, union_word_ids)
+        return [np.ascontiguousarray(elmo_data[:, :, [columns[word_idx] for word_idx in word_ids]])
+                for elmo_data, word_ids in zip(elmo_datas, word_ids_batch)]
+
+    def close(self):
+        """Releases the session"""
+        self._sess.close()
 
     def _estimate_likelihood_minibatch(self, sentences_batch, preserve_states=True):
         """
@@ -0,0 +1,227 @@
+"""
+Tokenization of input sentences which is computed once per sentence and shared by the stages of
+spelling correction (batching, LM, hypotheses generation, lettercasing).
+
+Two tokenizers are available:
+    'nltk': nltk.word_tokenize (punkt sentence splitting + NLTK word tokenizer),
+    'regex': regex tokenizer which reproduces output of nltk.word_tokenize on Russian texts
+        (see regex_tokenize), it is faster and it falls back to untrained punkt if punkt models
+        are not downloaded.
+
+Conformance of 'regex' with 'nltk' was checked with NLTK 3.10.3 (no mismatches on the corpora of
+data/dialog and data/dialog16), tokenizers of NLTK<3.8.2 may differ on quotes and periods.
+
+Usage:
+    tokenized_sentence = tokenize_sentence("Мама мыла раму.", tokenizer='regex',
+                                           preprocess=lambda x: x.lower())
+    tokenized_sentence.tokens  # ['Мама', 'мыла', 'раму', '.']
+    tokenized_sentence.lowered_tokens  # ['мама', 'мыла', 'раму', '.']
+    tokenized_sentence.offsets  # [(0, 4), (5, 9), (10, 14), (14, 15)]
+"""
+import re
+
+import nltk
+from nltk.tokenize import word_tokenize
+from nltk.tokenize.punkt import PunktSentenceTokenizer
+
+# characters which are always separate tokens in NLTK tokenizer:
+_SEPARATE_CHARS = r";@#$%&?!*()\[\]{}<>‒-―«“‘„»”’`"
+# tokens of NLTK tokenizer, words are split further by _split_word and _is_final_period:
+_TOKEN_RE = re.compile(r"""
+    (?P<ellipsis>\.{2,})
+    |(?P<double_dash>--)
+    |(?P<double_quote>"|'')
+    |(?P<backticks>`+)
+    |(?P<separate>[%s])
+    |(?P<comma_or_colon>[:,](?!\d))
+    |(?P<word>(?:[^\s.:,"'%s-]|[:,](?=\d)|\.(?!\.)|-(?!-)|'(?!'))+)
+    |(?P<apostrophe>')
+    |(?P<dash>-)
+    """ % (_SEPARATE_CHARS, _SEPARATE_CHARS), re.VERBOSE)
+# NLTK splits the final period of a sentence off the word if only closing punctuation follows it,
+# quotes after spaces and brackets are opening ones (they are converted into `` beforehand):
+_OPENING_QUOTE_RE = re.compile(r"""(?<=[\s(\[{<«“‘„`])(?:"|'')""")
+_CLOSING_TAIL_RE = re.compile(r"""[\])}>"'»”’\s]*""")
+# english clitics which are split off by NLTK tokenizer:
+_CLITIC_RE = re.compile(r"(?i)(?<=[^' ])('s|'m|'d|'ll|'re|'ve|n't|')$")
+_LEADING_APOSTROPHE_RE = re.compile(r"(?i)^'(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)")
+_SENTENCE_TOKENIZER = None
+
+
+class TokenizedSentence(object):
+    """
+    Tokenization of a sentence
+
+    Attributes:
+        text: str, the input sentence
+        tokens: list of str, tokens of the sentence (cased)
+        offsets: list of tuples (start, end) of tokens in the text, (None, None) if the token
+            can not be found in the text (ex.: NLTK converts quotes " into `` and '')
+        lowered_tokens: list of str, tokens after preprocessing (lowercasing)
+    """
+
+    def __init__(self, text, tokens, offsets, preprocess=None):
+        self.text = text
+        self.tokens = tokens
+        self.offsets = offsets
+        if preprocess is None:
+            self.lowered_tokens = [each_token.lower() for each_token in tokens]
+        else:
+            self.lowered_tokens = [preprocess(each_token) for each_token in tokens]
+
+    def wrapped_tokens(self, lowered=True):
+        """
+        :param lowered: if true then preprocessed tokens are returned
+        :return: list of tokens wrapped with <S>, </S> (the format of tokenized_input_sentence)
+        """
+        tokens = self.lowered_tokens if lowered else self.tokens
+        return ['<S>'] + tokens + ['</S>']
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __repr__(self):
+        return "TokenizedSentence(%r)" % self.tokens
+
+
+def align_tokens(text, tokens):
+    """
+    Finds offsets of tokens in the text
+
+    :param text: str
+    :param tokens: list of str
+    :return: list of tuples (start, end), (None, None) for tokens which are not found
+    """
+    offsets = []
+    cursor = 0
+    for each_token in tokens:
+        start = text.find(each_token, cursor)
+        if start < 0 and each_token in ("``", "''"):
+            start = text.find('"', cursor)
+            end = start + 1
+        else:
+            end = start + len(each_token)
+        if start < 0:
+            offsets.append((None, None))
+            continue
+        offsets.append((start, end))
+        cursor = end
+    return offsets
+
+
+def _split_word(word, start):
+    """Splits apostrophes and clitics off the word as NLTK does"""
+    if not word:
+        return
+    if _LEADING_APOSTROPHE_RE.match(word):
+        yield "'", start, start + 1
+        word, start = word[1:], start + 1
+    clitic = _CLITIC_RE.search(word)
+    if clitic and clitic.start() > 0:
+        yield word[:clitic.start()], start, start + clitic.start()
+        yield clitic.group(), start + clitic.start(), start + len(word)
+    else:
+        yield word, start, start + len(word)
+
+
+def _load_punkt():
+    """
+    :return: english punkt tokenizer as nltk.word_tokenize loads it (punkt_tab since NLTK 3.8.2,
+        pickled punkt before)
+    """
+    try:
+        from nltk.tokenize.punkt import PunktTokenizer
+    except ImportError:
+        return nltk.data.load('tokenizers/punkt/english.pickle')
+    return PunktTokenizer("english")
+
+
+def _get_sentence_tokenizer():
+    """
+    :return: punkt tokenizer of nltk.word_tokenize, untrained punkt if its parameters are not
+        downloaded (they are not needed for Russian texts)
+    """
+    global _SENTENCE_TOKENIZER
+    if _SENTENCE_TOKENIZER is None:
+        try:
+            _SENTENCE_TOKENIZER = _load_punkt()
+        except LookupError:
+            _SENTENCE_TOKENIZER = PunktSentenceTokenizer()
+    return _SENTENCE_TOKENIZER
+
+
+def _is_final_period(text, position, sentence_end):
+    """
+    :param text: str
+    :param position: int, position of the text after the word which ends with a period
+    :param sentence_end: int, end of the sentence
+    :return: true if NLTK splits the period off the word at the end of the sentence
+    """
+    tail = _OPENING_QUOTE_RE.sub("``", text[position - 1:sentence_end])
+    return _CLOSING_TAIL_RE.fullmatch(tail, 1) is not None
+
+
+def regex_tokenize(text):
+    """
+    Regex tokenizer which reproduces output of nltk.word_tokenize for Russian texts: the text is
+    split into sentences by punkt as nltk.word_tokenize does (it is cheap), then each sentence is
+    tokenized by a single regex pass instead of the sequence of NLTK substitutions. Punctuation
+    is split off words except periods inside sentences, commas and colons followed by digits and
+    hyphens of words, quotes " are converted into `` and ''.
+
+    :param text: str
+    :return: tuple (list of tokens, list of tuples (start, end) of tokens in the text)
+    """
+    tokens, offsets = [], []
+    for sentence_start, sentence_end in _get_sentence_tokenizer().span_tokenize(text):
+        previous_end = None
+        for match in _TOKEN_RE.finditer(text, sentence_start, sentence_end):
+            kind, token, start, end = match.lastgroup, match.group(), match.start(), match.end()
+            if kind == 'word':
+                if len(token) > 1 and token.endswith(".") and \
+                        _is_final_period(text, end, sentence_end):
+                    pieces = list(_split_word(token[:-1], start)) + [(".", end - 1, end)]
+                else:
+                    pieces = _split_word(token, start)
+            elif kind == 'double_quote':
+                # opening quotes are at the beginning of a sentence or after spaces and brackets:
+                opening = start != previous_end or text[start - 1] in "([{<"
+                pieces = [("``" if opening else "''", start, end)]
+            else:
+                pieces = [(token, start, end)]
+            for each_token, each_start, each_end in pieces:
+                tokens.append(each_token)
+                offsets.append((each_start, each_end))
+            previous_end = end
+    return tokens, offsets
+
+
+def nltk_tokenize(text):
+    """
+    :param text: str
+    :return: tuple (list of tokens of nltk.word_tokenize, list of offsets of tokens)
+    """
+    tokens = word_tokenize(text)
+    return tokens, align_tokens(text, tokens)
+
+
+TOKENIZERS = {
+    'nltk': nltk_tokenize,
+    'regex': regex_tokenize,
+}
+
+
+def tokenize_sentence(text, tokenizer='nltk', preprocess=None):
+    """
+    Tokenizes the sentence once for all stages of spelling correction
+
+    :param text: str, the input sentence
+    :param tokenizer: one of keys of TOKENIZERS
+    :param preprocess: function which preprocesses (lowercases) tokens
+    :return: TokenizedSentence
+    """
+    if tokenizer not in TOKENIZERS:
+        raise ValueError("Unknown tokenizer %s, use one of: %s" % (
+            tokenizer, ", ".join(TOKENIZERS)))
+    tokens, offsets = TOKENIZERS[tokenizer](text)
+    return TokenizedSentence(text, tokens, offsets, preprocess=preprocess)
@@ -1,4 +1,8 @@
-from nltk.tokenize.moses import MosesDetokenizer
+try:
+    from nltk.tokenize.moses import MosesDetokenizer
+except ImportError:
+    # NLTK>=3.3 moved Moses tokenizers into sacremoses
+    from sacremoses import MosesDetokenizer
 import re
 
 # def tokenize_sentence_batch(self, sentences_batch, wrap_s=True):
@@ -47,30 +51,41 @@ import re
 #
 # find_top_k_words_for_elmo_mat(out_mat, 3, torch_lm.words)
 
+# detokenizer and patterns are created once, MosesDetokenizer keeps no state between calls:
+_MOSES_DETOKENIZER = MosesDetokenizer()
+# spaces which Moses leaves inside brackets, guillemets and smileys:
+_DETOKENIZATION_SUBSTITUTIONS = [
+    (re.compile(r"\( (.+?)"), r"(\1"),
+    (re.compile(r"(.+?) »"), r"\1»"),
+    (re.compile(r"« (.+?)"), r"«\1"),
+    (re.compile(r": -\)"), r":-)"),
+    # (re.compile(r": D"), r":D"),
+]
+
+
 def detokenize(tokens):
     """Given a list of tokens it returns merged string"""
-    detokenized_str = MosesDetokenizer().detokenize(tokens, return_str=True)
-    detokenized_str = re.sub(r"\( (.+?)", r"(\1", detokenized_str)
-    detokenized_str = re.sub(r"(.+?) »", r"\1»", detokenized_str)
-    detokenized_str = re.sub(r"« (.+?)", r"«\1", detokenized_str)
-    detokenized_str = re.sub(r": -\)", r":-)", detokenized_str)
-    # detokenized_str = re.sub(r": D", r":D", detokenized_str)
+    detokenized_str = _MOSES_DETOKENIZER.detokenize(tokens, return_str=True)
+    for pattern, replacement in _DETOKENIZATION_SUBSTITUTIONS:
+        detokenized_str = pattern.sub(replacement, detokenized_str)
     return detokenized_str
 
+
+def detokenize_batch(tokens_batch):
+    """Given a list of lists of tokens it returns list of merged strings"""
+    return [detokenize(tokens) for tokens in tokens_batch]
+
+
 def yi_substitutor(sentence):
     """Substitutes й letter with и"""
-    yi_pat = re.compile("й")
+    return sentence.replace("й", "и")
 
-    return yi_pat.sub("и", sentence)
 
 def yo_substitutor(sentence):
     """Substitutes ё letter with е"""
-    yo_pat = re.compile("ё")
+    return sentence.replace("ё", "е")
 
-    return yo_pat.sub("е", sentence)
 
 def yo_substitutor_batch(sentences):
     """Substitutes ё letter with е"""
-    yo_pat = re.compile("ё")
-
-    return [yo_pat.sub("е", each_sent) for each_sent in sentences]
+    return [each_sent.replace("ё", "е") for each_sent in sentences]
@@ -60,7 +60,8 @@ class LettercaserForSpellchecker(Lettercaser):
     """
     It restores cases in sentence looking to reference sentence.
     It can process sentences with difference size, alignment is based on
-    Levenstein distance.
+    Levenstein distance. If the corrector knows which source tokens produced each correct
+    token (ex.: by spans of hypotheses) it may pass this alignment, then alignment is skipped.
 
     Args:
         cases: dictionary that describes map,
@@ -81,9 +82,19 @@ class LettercaserForSpellchecker(Lettercaser):
         super().__init__(cases, default_case)
         self.aligment_func = partial(align_sents, replace_cost=1.9)
 
-    def correct_cases(self, source, correct):
-        alignment = self.aligment_func(source=source, correct=correct)
+    def correct_cases(self, source, correct, alignment=None):
+        """It detects lettercases of tokens of correct sentence
+        Args:
+            source: tokens of source sentence
+            correct: tokens of correct sentence
+            alignment: None or alignment of source and correct in the format of 'aligment_func',
+                       if it is given then alignment is not calculated
+        Return:
+            list of names of lettercases of correct tokens
+        """
         source_cases = [self.determine_lettercase(token) for token in source]
+        if alignment is None:
+            alignment = self.aligment_func(source=source, correct=correct)
         correct_cases = ['lower'] * len(correct)
         for s_border, c_border in alignment:
             if len(range(*c_border)) == 1 and\
@@ -101,13 +112,16 @@ class LettercaserForSpellchecker(Lettercaser):
                     correct_cases[c_border[0]] = 'capitalize'
         return correct_cases
 
-    def rest_cases(self, source: List[str], correct: List[str]):
-        correct_cases = self.correct_cases(source, correct)
+    def rest_cases(self, source: List[str], correct: List[str], alignment: list = None):
+        correct_cases = self.correct_cases(source, correct, alignment)
         return [self.put_in_lettercase(token, case) for token, case in zip(correct, correct_cases)]
 
-    def __call__(self, source: List[List[str]], corrections: List[List[str]]):
-        ziped = zip(source, corrections)
-        return [self.rest_cases(s, c) for s, c in ziped]
+    def __call__(self, source: List[List[str]], corrections: List[List[str]],
+                 alignments: List[list] = None):
+        if alignments is None:
+            alignments = [None] * len(source)
+        ziped = zip(source, corrections, alignments)
+        return [self.rest_cases(s, c, a) for s, c, a in ziped]
 
 if __name__ == '__main__':
     letter = LettercaserForSpellchecker()
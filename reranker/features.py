@@ -0,0 +1,70 @@
+"""
+Feature matrices of substitution candidates for the reranker.
+
+Rows of a matrix are candidates of HypothesesTable (in the order of its rows), columns are
+FEATURE_NAMES. The schema is fixed: columns are in the order of keys of
+ReRanker40inRegressor.preprocess_feature_dict, so a row equals
+binarize_features(preprocess_feature_dict(candidate)) and trained models stay valid.
+
+Usage:
+    table = HypothesesTable.of_analysis_dict(analysis_dict)
+    matrix = table_feature_matrix(table)
+    matrix[:, FEATURE_INDEX['lm_advantage']]
+    batch_matrix, row_offsets = batch_feature_matrix([table, other_table])
+"""
+import numpy as np
+
+FEATURE_NAMES = ('advantage', 'lm_advantage', 'error_score', 'token_merges', 'token_splits',
+                 '1letter_word', '2letter_word', 'has_digit', 'short_word_with_punctuation',
+                 'is_abbrev', 'levenshtein_distance', 'zero_hypothesis', 'capitalize', 'upper')
+FEATURE_INDEX = {name: idx for idx, name in enumerate(FEATURE_NAMES)}
+
+# features which are set if the substring is in the comment of the candidate, substrings are the
+# same as in preprocess_feature_dict (comments of the corrector are "1letter word" and
+# "2letter word", so 1letter_word and 2letter_word columns are zero as in trained models):
+COMMENT_FEATURES = (('1letter_word', '1letter_word'), ('2letter_word', '2letter_word'),
+                    ('has_digit', 'has digit'),
+                    ('short_word_with_punctuation', 'short word with punctuation'))
+
+
+def table_feature_matrix(table):
+    """
+    Computes features of all candidates of the sentence
+
+    :param table: HypothesesTable
+    :return: float64 ndarray of shape (len(table), len(FEATURE_NAMES)), absent values (NaN in
+        the table) are zeros
+    """
+    matrix = np.zeros((len(table), len(FEATURE_NAMES)), dtype=np.float64)
+    matrix[:, FEATURE_INDEX['advantage']] = table.advantage
+    matrix[:, FEATURE_INDEX['lm_advantage']] = table.lm_advantage
+    matrix[:, FEATURE_INDEX['error_score']] = table.error_score
+    # NO_TOKEN_MERGES and NO_TOKEN_SPLITS (None) are 0:
+    matrix[:, FEATURE_INDEX['token_merges']] = np.maximum(table.token_merges, 0)
+    matrix[:, FEATURE_INDEX['token_splits']] = np.maximum(table.token_splits, 0)
+    matrix[:, FEATURE_INDEX['zero_hypothesis']] = table.zero_hypothesis
+    for row, extra in table.extras.items():
+        comment = extra.get('comment')
+        if comment:
+            for feature_name, substring in COMMENT_FEATURES:
+                if substring in comment:
+                    matrix[row, FEATURE_INDEX[feature_name]] = 1.0
+        if 'is_abbrev' in extra:
+            matrix[row, FEATURE_INDEX['is_abbrev']] = 1.0
+    np.nan_to_num(matrix, copy=False)
+    return matrix
+
+
+def batch_feature_matrix(tables):
+    """
+    Computes one feature matrix of candidates of a batch of sentences
+
+    :param tables: list of HypothesesTable
+    :return: tuple (matrix, row_offsets), rows of i-th table are
+        matrix[row_offsets[i]:row_offsets[i + 1]]
+    """
+    row_offsets = np.zeros(len(tables) + 1, dtype=np.int64)
+    row_offsets[1:] = np.cumsum([len(table) for table in tables])
+    if not tables:
+        return np.zeros((0, len(FEATURE_NAMES)), dtype=np.float64), row_offsets
+    return np.vstack([table_feature_matrix(table) for table in tables]), row_offsets
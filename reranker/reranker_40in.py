@@ -1,9 +1,32 @@
+import itertools
+import logging
+
 import numpy as np
 from sklearn.linear_model import LinearRegression
 from sklearn.linear_model import LogisticRegression
-import pprint
 from spelling_correction_models.elmo_40in_spelling_corrector.helper_fns import SCAnalysisDictManager
-from sklearn.externals import joblib
+from spelling_correction_models.elmo_40in_spelling_corrector.hypotheses_table import HypothesesTable
+from spelling_correction_models.elmo_40in_spelling_corrector.lattice_decoder import decode_lattice
+from reranker.features import batch_feature_matrix, table_feature_matrix
+try:
+    from sklearn.externals import joblib
+except ImportError:
+    # sklearn>=0.23 does not vendor joblib
+    import joblib
+
+# labels of pairs of candidates: 1 if the first candidate is better
+PAIR_CLASSES = np.array([-1, 1])
+
+# version of the format of saved models, models of older formats are rejected by load:
+#   2: pairwise examples are etalon - alternative (models of format 1 were trained with the
+#      inverted sign, so they prefer the worst candidates)
+MODEL_FORMAT_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+# versions of rerankers are unique in the process, so results cached with a model are never
+# attributed to another one (unlike ids of objects which are reused):
+_MODEL_VERSIONS = itertools.count(1)
 
 
 class ReRanker40inRegressor():
@@ -18,65 +41,77 @@ class ReRanker40inRegressor():
 
     #         self.cls_params = cls_params if cls_params is not None else dict(warm_start=True)
     #         self.reg = cls(**self.cls_params)
-    def __init__(self):
-        self.reg = LogisticRegression(warm_start=True, solver='lbfgs')
+    def __init__(self, reg=None):
+        """
+        :param reg: linear classifier of pairs of candidates (with coef_ and intercept_), if None
+            then LogisticRegression, use classifiers with partial_fit (ex.: SGDClassifier) for
+            streaming training (see reranker.streaming_trainer)
+        """
+        self.reg = reg if reg is not None else LogisticRegression(warm_start=True, solver='lbfgs')
+        # changes with every fit or load of the model (see model_updated):
+        self.version = next(_MODEL_VERSIONS)
+        # number of token fronts skipped in training data preparation because they have no etalon:
+        self.skipped_fronts = 0
 
     #         self.reg = LogisticRegression(warm_start=True, solver='newton-cg')
 
     # TODO saving loading functionality
 
+    def decision_scores(self, features_matrix, intercept=True):
+        """
+        Scores of candidates by the regressor, one matrix multiplication for all rows
+
+        :param features_matrix: ndarray (candidates, features), see reranker.features
+        :param intercept: if false then the intercept of the regressor is not added, so scores
+            are additive along paths of the lattice (the regressor is trained on differences of
+            features, so the intercept does not rank candidates)
+        :return: ndarray of scores (the same as decision_function of the regressor)
+        """
+        scores = features_matrix.dot(self.reg.coef_[0])
+        if intercept:
+            scores += self.reg.intercept_[0]
+        return scores
+
+    def predict_hypotheses_batch(self, sentence_data_analysis_dicts, k_best=1):
+        """
+        Given a batch of data analysis dicts it finds the best sentence hypotheses: features of
+        all candidates of the batch are scored at once, then scores are weights of edges of the
+        lattice of spans of each sentence (see lattice_decoder), so a winning multitoken
+        hypothesis covers all tokens of its span
+
+        :param sentence_data_analysis_dicts: list of DataAnalysisDict objects (dicts)
+        :param k_best: int, number of hypotheses of each sentence
+        :return: list of lists of SentenceHypothesis (best first)
+        """
+        tables = [HypothesesTable.of_analysis_dict(each_dict)
+                  for each_dict in sentence_data_analysis_dicts]
+        features_matrix, row_offsets = batch_feature_matrix(tables)
+        scores = self.decision_scores(features_matrix, intercept=False)
+        results = []
+        for table_idx, table in enumerate(tables):
+            table_scores = scores[row_offsets[table_idx]:row_offsets[table_idx + 1]]
+            # all candidates are edges, the reranker decides:
+            results.append(decode_lattice(table, min_advantage_treshold=-np.inf, k_best=k_best,
+                                          edge_scores=table_scores))
+        return results
+
+    def predict_fixes_tokens_batch(self, sentence_data_analysis_dicts):
+        """
+        Given a batch of data analysis dicts it outputs sentence hypotheses as sequences of tokens
+
+        :param sentence_data_analysis_dicts: list of DataAnalysisDict objects (dicts)
+        :return: list of lists of token strings
+        """
+        return [[each_token['token_str'] for each_token in hypotheses[0].token_hypotheses]
+                for hypotheses in self.predict_hypotheses_batch(sentence_data_analysis_dicts)]
+
     def predict_fixes_tokens(self, sentence_data_analysis_dict):
         """
         given data anlysis dict it outputs sentence hypothesis as sequence of tokens
         :param sentence_data_analysis_dict: DataAnalysisDict object (dict)
         :return: list of token strings
         """
-        winning_tokens = []
-        total_length = len(sentence_data_analysis_dict['tokenized_input_sentence'])
-        for current_token_idx, each_tok in enumerate(
-                sentence_data_analysis_dict['tokenized_input_sentence']):
-            if current_token_idx == 0: continue
-            if current_token_idx == total_length - 1:
-                # last token is </S>. skip it
-                continue
-
-            suffixes_hypotheses = SCAnalysisDictManager.filter_by_start_index(
-                data_anal_dict=sentence_data_analysis_dict, start_index=current_token_idx)
-
-            #################################################################
-            # TODO check that we are not under multitoken hypothesis segment ?
-            flat_hypotheses_list = []
-            for each_segment_hypotheses_hub in suffixes_hypotheses:
-                flat_hypotheses_list.extend(each_segment_hypotheses_hub['top_k_candidates'])
-
-            #################################################################
-            if len(flat_hypotheses_list) > 1:
-                preprocessed_features = list(
-                    map(ReRanker40inRegressor.preprocess_feature_dict, flat_hypotheses_list))
-                #             print("preprocessed_features")
-                #             pprint.pprint(preprocessed_features)
-                # binarize features
-                # binarized_features = list(map(ReRanker40inRegressor.binarize_features, preprocessed_features))
-                binarized_features = np.array(
-                    list(map(ReRanker40inRegressor.binarize_features, preprocessed_features)))
-                #                 predictions = np.array(map(self.reg.predict, binarized_features))
-                predictions = self.reg.decision_function(binarized_features)
-
-                print("predictions at %d" % current_token_idx)
-                print(predictions)
-                #                 import ipdb; ipdb.set_trace()
-                max_pred_idx = np.argmax(predictions)
-                print("max_pred_idx")
-                print(max_pred_idx)
-                print("winner:")
-                print(flat_hypotheses_list[max_pred_idx])
-                winning_tokens.append(flat_hypotheses_list[max_pred_idx]['token_str'])
-            elif len(flat_hypotheses_list) == 1:
-                winning_tokens.append(flat_hypotheses_list[0]['token_str'])
-            else:
-                raise Exception("Zero hypotheses?")
-        # todo add check of multispan!?
-        return winning_tokens
+        return self.predict_fixes_tokens_batch([sentence_data_analysis_dict])[0]
 
     def predict_fixes(self, sentence_data_analysis_dict):
         """
@@ -87,12 +122,13 @@ class ReRanker40inRegressor():
 
         winning_tokens = self.predict_fixes_tokens(sentence_data_analysis_dict)
         final_str = " ".join(winning_tokens)
-        print(final_str)
         return final_str
 
     def _prepare_token_front_data(self, list_of_feature_lists, etalon_idx):
         """Given a list of feature lists and index of etalon we make mini-batch for training
         return X and y attachable to big dataset
+
+        Differences etalon - alternative are positive examples, so the etalon gets the max score
         """
         etalon_feature_list = list_of_feature_lists[etalon_idx]
         training_data = []
@@ -101,22 +137,36 @@ class ReRanker40inRegressor():
             if hypo_idx == etalon_idx:
                 continue
 
-            diff = feature_list - etalon_feature_list
+            diff = etalon_feature_list - feature_list
             training_data.extend((diff, -diff))
             training_labels.extend((1, -1))
         return training_data, training_labels
 
     def fit_token_front(self, list_of_feature_lists, etalon_idx):
-        """Given a list of feature lists and index of etalon list we make training operation"""
+        """Given a list of feature lists and index of etalon list we make training operation,
+        classifiers with partial_fit are updated incrementally instead of refitting"""
         training_data, training_labels = self._prepare_token_front_data(list_of_feature_lists,
                                                                         etalon_idx)
-        self.reg = self.reg.fit(training_data, training_labels)
-        #         self.reg.partial_fit(training_data, training_labels)
-        self.coef_ = self.reg.coef_
+        if hasattr(self.reg, 'partial_fit'):
+            self.partial_fit(training_data, training_labels)
+        else:
+            self.reg = self.reg.fit(training_data, training_labels)
+            self.model_updated()
         print("self.coef_")
         print(self.coef_)
         return self.reg
 
+    def partial_fit(self, training_data, training_labels):
+        """One step of incremental training on pairwise examples (see _prepare_token_front_data)"""
+        self.reg.partial_fit(training_data, training_labels, classes=PAIR_CLASSES)
+        self.model_updated()
+        return self.reg
+
+    def model_updated(self):
+        """Must be called after the model is changed, results of older versions are stale"""
+        self.coef_ = self.reg.coef_
+        self.version = next(_MODEL_VERSIONS)
+
     # deprecated
     def fit_from_sorokin(self, data):
         """
@@ -148,7 +198,7 @@ class ReRanker40inRegressor():
                 training_data.extend((diff, -diff))
                 training_labels.extend((1, -1))
         self.reg = self.reg.fit(training_data)
-        self.coef_ = self.reg.coef_
+        self.model_updated()
 
         return self
 
@@ -172,6 +222,11 @@ class ReRanker40inRegressor():
         """
         features = []
         labels = []
+        table = HypothesesTable.of_analysis_dict(sentence_data_analysis_dict)
+        features_matrix = table_feature_matrix(table)
+        if 'word_substitutions_candidates' not in sentence_data_analysis_dict:
+            # candidates are kept in the table only, groups are restored once for all tokens:
+            sentence_data_analysis_dict = table.to_analysis_dict()
 
         for current_token_idx, each_tok in enumerate(
                 sentence_data_analysis_dict['tokenized_input_sentence']):
@@ -192,10 +247,8 @@ class ReRanker40inRegressor():
                 if 'etalon_ref' in each_item:
                     if etalon_hypothesis_feature_dict:
                         # not none!
-                        print("flat_hypotheses_list:")
-                        print(pprint.pprint(flat_hypotheses_list))
-                        print("sentence_data_analysis_dict")
-                        print(sentence_data_analysis_dict)
+                        logger.debug("Multiple etalons at token %d of %s", current_token_idx,
+                                     sentence_data_analysis_dict['tokenized_input_sentence'])
                         if isinstance(etalon_hypothesis_feature_dict['etalon_ref'],
                                       list) and isinstance(each_item['etalon_ref'], int):
                             pass
@@ -209,26 +262,21 @@ class ReRanker40inRegressor():
                     # debug me?
                     else:
                         etalon_hypothesis_feature_dict = each_item
-                etalon_index = idx
+                    if etalon_hypothesis_feature_dict is each_item:
+                        etalon_index = idx
             if not etalon_hypothesis_feature_dict:
-                print("No Etalon Found current_token_index = %d, each_tok= %s" %
-                      (current_token_idx, each_tok))
-                print("skipping training step")
+                self.skipped_fronts += 1
+                logger.debug("No etalon found at token %d (%s), the front is skipped",
+                             current_token_idx, each_tok)
                 continue
                 # can not fit/ skip sentence?
             # ok etalon found we can train
             if len(flat_hypotheses_list) <= 1:
                 continue
             #################################################################
-            preprocessed_features = list(
-                map(ReRanker40inRegressor.preprocess_feature_dict, flat_hypotheses_list))
-            # binarize features
-            binarized_features = list(
-                map(ReRanker40inRegressor.binarize_features, preprocessed_features))
-
-            print("fitting")
-            print("binarized_features:")
-            print(binarized_features)
+            # features of the front (rows of the table are in the order of flat_hypotheses_list):
+            binarized_features = list(features_matrix[table.rows_starting_at(current_token_idx)])
+
             tokfront_features, tokfront_labels = self._prepare_token_front_data(binarized_features,
                                                                                 etalon_index)
             features.extend(tokfront_features)
@@ -330,16 +378,24 @@ class ReRanker40inRegressor():
 
     def save(self, filename='/tmp/reranker_40in.joblib.pkl'):
         """
-        save model of reranker
+        save model of reranker (with MODEL_FORMAT_VERSION)
         :return:
         """
-        return joblib.dump(self.reg, filename, compress=9)
+        model = {'format_version': MODEL_FORMAT_VERSION, 'reg': self.reg}
+        return joblib.dump(model, filename, compress=9)
 
     def load(self, filename='/tmp/reranker_40in.joblib.pkl'):
         """
-        Load model of rernaker
+        Load model of rernaker, models of other formats raise ValueError (models saved before
+        format 2 rank candidates in the inverted order, they must be retrained)
         :return:
         """
-        reg = joblib.load(filename)
-        self.reg = reg
+        model = joblib.load(filename)
+        format_version = model.get('format_version', 1) if isinstance(model, dict) else 1
+        if format_version != MODEL_FORMAT_VERSION:
+            raise ValueError("Reranker model %s has format %d, format %d is expected, "
+                             "retrain the model" % (filename, format_version,
+                                                    MODEL_FORMAT_VERSION))
+        self.reg = model['reg']
+        self.model_updated()
         return self
@@ -0,0 +1,294 @@
+"""
+Streaming (out-of-core) training of ReRanker40inRegressor on annotated analysis dicts.
+
+Analysis dicts with etalons markup (etalon_ref keys of candidates) are read from JSONL shards
+one by one, pairwise examples of each dict are generated on the fly (see
+ReRanker40inRegressor._prepare_sentence_training_data) and collected into mini-batches, each
+mini-batch is a partial_fit step of the classifier. So memory does not depend on the size of the
+dataset. Shards are shuffled on each epoch, the model and the state of training are saved after
+each epoch (and each checkpoint_every mini-batches), so interrupted training is resumed from the
+last checkpoint: the order of mini-batches of an epoch is deterministic, so mini-batches fitted
+before the checkpoint are skipped.
+
+Usage:
+    write_analysis_dicts_jsonl(annotated_data_anal_dicts, "/data/reranker/shard-000.jsonl")
+    trainer = StreamingRerankerTrainer(batch_size=4096,
+                                       checkpoint_path="/tmp/reranker_40in.joblib.pkl")
+    trainer.train(["/data/reranker/shard-000.jsonl", "/data/reranker/shard-001.jsonl"], epochs=3)
+    corrector.reranker = trainer.reranker
+
+    python reranker/streaming_trainer.py --epochs 3 --checkpoint /tmp/reranker_40in.joblib.pkl \\
+        /data/reranker/shard-*.jsonl
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+
+SELF_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SELF_DIR)
+sys.path.append(ROOT_DIR)
+from reranker.features import FEATURE_NAMES
+from reranker.reranker_40in import ReRanker40inRegressor
+from spelling_correction_models.elmo_40in_spelling_corrector.hypotheses_table import \
+    HYPOTHESES_TABLE_KEY, materialize_analysis_dict
+
+
+def _to_json(value):
+    """Converts numpy values of analysis dicts into JSON ones"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("%r is not JSON serializable" % value)
+
+
+def write_analysis_dicts_jsonl(analysis_dicts, path):
+    """
+    Writes analysis dicts into a JSONL shard (one dict per line)
+
+    :param analysis_dicts: iterable of dicts SentenceAnalysisDictionary (candidates in
+        HypothesesTable are written as word_substitutions_candidates)
+    :param path: str
+    :return: number of written dicts
+    """
+    count = 0
+    with open(path, "w", encoding="utf8") as shard_file:
+        for each_dict in analysis_dicts:
+            if HYPOTHESES_TABLE_KEY in each_dict:
+                each_dict = materialize_analysis_dict(each_dict)
+            shard_file.write(json.dumps(each_dict, ensure_ascii=False, default=_to_json))
+            shard_file.write("\n")
+            count += 1
+    return count
+
+
+def _file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as checked_file:
+        for chunk in iter(lambda: checked_file.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def read_analysis_dicts_jsonl(paths):
+    """
+    Reads analysis dicts from JSONL shards lazily
+
+    :param paths: list of paths of shards
+    :return: generator of dicts SentenceAnalysisDictionary (tok_idx of merges are tuples)
+    """
+    for path in paths:
+        with open(path, "r", encoding="utf8") as shard_file:
+            for line in shard_file:
+                if not line.strip():
+                    continue
+                analysis_dict = json.loads(line)
+                for each_group in analysis_dict['word_substitutions_candidates']:
+                    if isinstance(each_group['tok_idx'], list):
+                        each_group['tok_idx'] = tuple(each_group['tok_idx'])
+                yield analysis_dict
+
+
+def iterate_pairwise_batches(reranker, analysis_dicts, batch_size=4096):
+    """
+    Generates mini-batches of pairwise examples of analysis dicts
+
+    :param reranker: ReRanker40inRegressor
+    :param analysis_dicts: iterable of annotated analysis dicts
+    :param batch_size: int, min number of examples in a mini-batch (pairs of a dict are not
+        split, the last mini-batch may be smaller)
+    :return: generator of tuples (X, y) of ndarrays
+    """
+    batch_features, batch_labels = [], []
+    for each_dict in analysis_dicts:
+        features, labels = reranker._prepare_sentence_training_data(each_dict)
+        batch_features.extend(features)
+        batch_labels.extend(labels)
+        if len(batch_labels) >= batch_size:
+            yield np.array(batch_features), np.array(batch_labels)
+            batch_features, batch_labels = [], []
+    if batch_labels:
+        yield np.array(batch_features), np.array(batch_labels)
+
+
+class StreamingRerankerTrainer():
+    """
+    Trains the reranker by partial_fit on mini-batches of pairwise examples streamed from shards
+
+    Attributes:
+        reranker: ReRanker40inRegressor, its classifier must support partial_fit
+        epoch: int, number of completed epochs
+        epoch_batches: int, number of mini-batches of the current epoch fitted so far
+        batches_count, examples_count: int, numbers of mini-batches and examples fitted so far
+    """
+
+    def __init__(self, reranker=None, batch_size=4096, checkpoint_path=None,
+                 checkpoint_every=None, random_state=0):
+        """
+        :param reranker: ReRanker40inRegressor, if None then reranker with SGDClassifier (hinge
+            loss on differences of candidates, i.e. linear RankSVM) is trained
+        :param batch_size: int, number of pairwise examples in a partial_fit step
+        :param checkpoint_path: str, path of the model (loadable by ReRanker40inRegressor.load),
+            the state of training is saved next to it (checkpoint_path + ".state.json"), if None
+            then checkpoints are not saved
+        :param checkpoint_every: int, number of mini-batches between checkpoints inside epochs,
+            if None then checkpoints are saved after epochs only
+        :param random_state: int, seed of shuffling of shards (and of the default classifier)
+        """
+        if reranker is None:
+            reranker = ReRanker40inRegressor(SGDClassifier(loss='hinge', alpha=1e-5,
+                                                           fit_intercept=False,
+                                                           random_state=random_state))
+        if not hasattr(reranker.reg, 'partial_fit'):
+            raise ValueError("Classifier %s does not support partial_fit" %
+                             type(reranker.reg).__name__)
+        self.reranker = reranker
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.random_state = random_state
+        self.epoch = 0
+        self.epoch_batches = 0
+        self.batches_count = 0
+        self.examples_count = 0
+
+    @property
+    def state_path(self):
+        return self.checkpoint_path + ".state.json"
+
+    @property
+    def tmp_checkpoint_path(self):
+        return self.checkpoint_path + ".tmp"
+
+    def save_checkpoint(self):
+        """
+        Saves the model and the state of training.
+
+        Both files are written to temporary files and renamed. The state is renamed first and
+        keeps the hash of the new model, so if the process dies before the model is renamed,
+        load_checkpoint finishes the rename.
+        """
+        self.reranker.save(self.tmp_checkpoint_path)
+        state = {'epoch': self.epoch, 'epoch_batches': self.epoch_batches,
+                 'batches_count': self.batches_count,
+                 'examples_count': self.examples_count,
+                 'random_state': self.random_state,
+                 'feature_names': list(FEATURE_NAMES),
+                 'model_sha256': _file_sha256(self.tmp_checkpoint_path)}
+        tmp_state_path = self.state_path + ".tmp"
+        with open(tmp_state_path, "w", encoding="utf8") as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_state_path, self.state_path)
+        os.replace(self.tmp_checkpoint_path, self.checkpoint_path)
+
+    def load_checkpoint(self):
+        """
+        Restores the model and the state of training from the checkpoint
+
+        :return: true if the checkpoint exists
+        """
+        if not (self.checkpoint_path and os.path.exists(self.state_path)):
+            return False
+        with open(self.state_path, "r", encoding="utf8") as state_file:
+            state = json.load(state_file)
+        if state['feature_names'] != list(FEATURE_NAMES):
+            raise ValueError("Features of checkpoint %s differ from FEATURE_NAMES" %
+                             self.checkpoint_path)
+        if not os.path.exists(self.checkpoint_path) or \
+                _file_sha256(self.checkpoint_path) != state['model_sha256']:
+            if os.path.exists(self.tmp_checkpoint_path) and \
+                    _file_sha256(self.tmp_checkpoint_path) == state['model_sha256']:
+                # the process died between renames of the state and the model:
+                os.replace(self.tmp_checkpoint_path, self.checkpoint_path)
+            else:
+                raise ValueError("Model %s does not match the state of training %s" % (
+                    self.checkpoint_path, self.state_path))
+        self.reranker.load(self.checkpoint_path)
+        self.epoch = state['epoch']
+        self.epoch_batches = state['epoch_batches']
+        self.batches_count = state['batches_count']
+        self.examples_count = state['examples_count']
+        self.random_state = state['random_state']
+        return True
+
+    def fit_batch(self, features, labels):
+        """One step of training on a mini-batch of pairwise examples"""
+        self.reranker.partial_fit(features, labels)
+        self.epoch_batches += 1
+        self.batches_count += 1
+        self.examples_count += len(labels)
+        if self.checkpoint_path and self.checkpoint_every and \
+                self.batches_count % self.checkpoint_every == 0:
+            self.save_checkpoint()
+
+    def train_epoch(self, shard_paths):
+        """
+        One pass over shards in random order (the order depends on the seed and the epoch only,
+        so resumed training sees the same orders), mini-batches fitted before the checkpoint
+        (epoch_batches) are skipped
+
+        :param shard_paths: list of paths of JSONL shards
+        """
+        permutation = np.random.RandomState(self.random_state + self.epoch).permutation(
+            len(shard_paths))
+        shard_paths = [shard_paths[idx] for idx in permutation]
+        analysis_dicts = read_analysis_dicts_jsonl(shard_paths)
+        for batch_no, (features, labels) in enumerate(
+                iterate_pairwise_batches(self.reranker, analysis_dicts, self.batch_size)):
+            if batch_no < self.epoch_batches:
+                continue
+            self.fit_batch(features, labels)
+        self.epoch += 1
+        self.epoch_batches = 0
+        if self.checkpoint_path:
+            self.save_checkpoint()
+
+    def train(self, shard_paths, epochs=1, resume=True):
+        """
+        Trains the reranker
+
+        :param shard_paths: list of paths of JSONL shards
+        :param epochs: int, total number of passes over shards
+        :param resume: if true then training continues from the checkpoint (completed epochs are
+            not repeated)
+        :return: ReRanker40inRegressor
+        """
+        if resume and self.load_checkpoint():
+            print("Resumed from %s: epoch %d, mini-batch %d, %d examples" % (
+                self.checkpoint_path, self.epoch, self.epoch_batches, self.examples_count))
+        while self.epoch < epochs:
+            # the counter of the reranker is cumulative, fronts of this epoch are reported:
+            skipped_fronts = self.reranker.skipped_fronts
+            self.train_epoch(shard_paths)
+            print("Epoch %d: %d mini-batches, %d examples, %d fronts without etalon skipped" % (
+                self.epoch, self.batches_count, self.examples_count,
+                self.reranker.skipped_fronts - skipped_fronts))
+        return self.reranker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("shards", nargs="+", help="JSONL shards of annotated analysis dicts")
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--checkpoint", required=True, help="path of the model checkpoint")
+    parser.add_argument("--checkpoint-every", type=int, default=None,
+                        help="number of mini-batches between checkpoints inside epochs")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="start from scratch even if the checkpoint exists")
+    args = parser.parse_args()
+
+    trainer = StreamingRerankerTrainer(batch_size=args.batch_size,
+                                       checkpoint_path=args.checkpoint,
+                                       checkpoint_every=args.checkpoint_every)
+    trainer.train(args.shards, epochs=args.epochs, resume=not args.no_resume)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,5 @@
 from .elmo_40in2_spelling_corrector import ELMO40in2SpellingCorrector
 from reranker.reranker_40in import ReRanker40inRegressor
-from language_models.utils import detokenize
 
 
 class ELMO40in2RerankingSpellingCorrector(ELMO40in2SpellingCorrector):
@@ -13,6 +12,13 @@ class ELMO40in2RerankingSpellingCorrector(ELMO40in2SpellingCorrector):
         # load model
         self.reranker = ReRanker40inRegressor()
 
+    def _models(self):
+        return super()._models() + (self.reranker, )
+
+    def model_fingerprint(self):
+        # the version of the reranker changes when it is trained or loaded in place:
+        return super().model_fingerprint() + (self.reranker.version, )
+
     def make_fixes(self, analysis_dict, *args, **kwargs):
         """
         Method that actually makes fixes of anlyzed sentence with ReRanker
@@ -21,13 +27,16 @@ class ELMO40in2RerankingSpellingCorrector(ELMO40in2SpellingCorrector):
         :param kwargs:
         :return: string with corrected sentence
         """
-        output_sentence_tokens = self.reranker.predict_fixes_tokens(analysis_dict)
-
-        # restore capitalization:
-        tokenized_input_sentence_with_s_wrap = analysis_dict['tokenized_input_sentence']
-        tokenized_input_sentence = tokenized_input_sentence_with_s_wrap[1:len(tokenized_input_sentence_with_s_wrap)-2]
-        output_sentence_tokens = self._lettercaser([tokenized_input_sentence],
-                                                   [output_sentence_tokens])[0]
+        return self.make_fixes_batch([analysis_dict])[0]
 
-        output_sentence = detokenize(output_sentence_tokens)
-        return output_sentence
+    def make_fixes_batch(self, analysis_dicts, *args, **kwargs):
+        """
+        Makes fixes of a batch of analyzed sentences, candidates of all sentences are scored by
+        ReRanker at once and the best hypothesis is decoded on the lattice of spans
+        :param analysis_dicts: list of dicts SentenceAnalysisDictionary
+        :return: list of strings with corrected sentences
+        """
+        hypotheses_batch = self.reranker.predict_hypotheses_batch(analysis_dicts)
+        # capitalization is restored by spans of the hypothesis:
+        return [self._restore_sentence(analysis_dict, hypotheses[0])
+                for analysis_dict, hypotheses in zip(analysis_dicts, hypotheses_batch)]
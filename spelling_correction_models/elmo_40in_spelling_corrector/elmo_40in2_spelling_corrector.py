@@ -1,19 +1,53 @@
 import datetime as dt
+import multiprocessing
+import queue
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from rusenttokenize import ru_sent_tokenize
 from nltk.tokenize import sent_tokenize, word_tokenize
 from .elmo_40in_spelling_corrector import ELMO40inSpellingCorrector
-from .helper_fns import estimate_the_best_s_hypotheses
+from .hypotheses_table import HYPOTHESES_TABLE_KEY, HypothesesTableBuilder, \
+    materialize_analysis_dict
+from .lattice_decoder import decode_lattice
 from language_models.utils import detokenize
-# increment of the logit for merging 2tokens->1token:
-ERROR_SCORE_FOR_MERGE = -2.0
+from language_models.tokenization import tokenize_sentence
+from language_models.batch_scheduler import LengthBucketedBatchScheduler
+from utilities.lru_cache import LRUCache, deep_sizeof
+from spelling_correction_models.utils import ERROR_SCORE_FOR_MERGE, merge_segments, \
+    split_multisentences, group_multisentences
 
 # Size of batch in elmo lm:
 ELMO_BATCH_SIZE = 8
 
 # batch size measured in tokens count in sentences of the batch
+# (legacy budget of chunk_generator_token_weighted, now budget of padded tokens is measured by
+# the batch scheduler of the LM unless max_tokens_count is specified explicitly)
 ELMO_BATCH_TOKEN_SIZE = 500
-# TODO fix duplicated parameter. Need tor etrireve batch size from elmo lm model?
+
+# max number of LM outputs of minibatches waiting for hypotheses generation in pipelined mode:
+PIPELINE_QUEUE_SIZE = 2
+
+# corrector of the process of hypotheses generation:
+_HYPOTHESES_WORKER_CORRECTOR = None
+
+
+def _init_hypotheses_worker(spelling_corrector):
+    global _HYPOTHESES_WORKER_CORRECTOR
+    _HYPOTHESES_WORKER_CORRECTOR = spelling_corrector
+
+
+def _generate_hypotheses_in_worker(task):
+    sentence_analysis_dict, elmo_data, candidates = task
+    return _HYPOTHESES_WORKER_CORRECTOR._analyze_sentence_with_elmo_data(
+        sentence_analysis_dict, elmo_data, candidates)
+
+
+def _weak_ref(model):
+    """Weak reference to the model, models which are None are referenced as is"""
+    if model is None:
+        return lambda: None
+    return weakref.ref(model)
 
 
 class ELMO40in2SpellingCorrector(ELMO40inSpellingCorrector):
@@ -21,8 +55,77 @@ class ELMO40in2SpellingCorrector(ELMO40inSpellingCorrector):
     This class is featured with improved hypothesis generation which may
     merge 2 tokens into one
     """
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, pipelined=False, hypotheses_workers=0,
+                 hypotheses_start_method='fork', result_cache_size=0, tokenizer='nltk',
+                 **kwargs):
+        """
+        :param pipelined: if true then LM forward passes of minibatches are overlapped with
+            candidates generation and hypotheses generation (see _analyze_mini_batches_pipelined)
+        :param hypotheses_workers: number of processes for hypotheses generation in
+            pipelined mode (0 or 1 means generation in the calling thread)
+        :param hypotheses_start_method: start method of processes of hypotheses workers: 'fork',
+            'forkserver' or 'spawn' (see _get_hypotheses_pool)
+        :param result_cache_size: max size in bytes of corrections cached by
+            process_sentences_batch (0 disables the cache), analysis dicts are cached only if
+            they are requested (supply_anal_dict)
+        :param tokenizer: tokenizer of input sentences, 'nltk' (nltk.word_tokenize) or 'regex'
+            (faster regex tokenizer with the same output, see language_models.tokenization)
+        """
         super().__init__(*args, **kwargs)
+        self.tokenizer = tokenizer
+        self.pipelined = pipelined
+        self.hypotheses_workers = hypotheses_workers
+        self.hypotheses_start_method = hypotheses_start_method
+        self._hypotheses_pool = None
+        self.result_cache = LRUCache(result_cache_size, size_fn=deep_sizeof) \
+            if result_cache_size else None
+        # version of models, it is a part of keys of the result cache:
+        self.models_version = 0
+        self._models_refs = ()
+
+    def _models(self):
+        """
+        :return: tuple of models which determine corrections
+        """
+        return (self.lm, self.sccg, self._lettercaser)
+
+    def models_updated(self):
+        """
+        Must be called after a model is changed in place (ex.: retrained), cached results of
+        older versions of models are dropped. Replacement of models is detected automatically.
+        """
+        self.models_version += 1
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
+    def model_fingerprint(self):
+        """
+        Fingerprint of models and settings which determine corrections, it is a part of keys of
+        the result cache, so replacement of a model invalidates cached results.
+
+        :return: tuple
+        """
+        models = self._models()
+        # models are referenced weakly, so a new model is never confused with a collected one:
+        if len(models) != len(self._models_refs) or any(
+                each_ref() is not each_model
+                for each_ref, each_model in zip(self._models_refs, models)):
+            self._models_refs = tuple(_weak_ref(each_model) for each_model in models)
+            self.models_updated()
+        return (self.models_version, self.max_num_fixes, self.fix_treshold, self.tokenizer,
+                tuple((pattern.pattern, pattern.flags)
+                      for pattern in self.frozen_words_regex_patterns))
+
+    def tokenize_input_sentence(self, sentence):
+        """
+        Tokenizes the input sentence once for all stages of correction: batching, LM, hypotheses
+        generation and lettercasing
+
+        :param sentence: str
+        :return: TokenizedSentence with cased tokens and preprocessed (lowercased) tokens
+        """
+        return tokenize_sentence(sentence, tokenizer=self.tokenizer,
+                                 preprocess=self.preprocess_sentence)
 
     def process_sentence(self, sentence):
         """
@@ -31,7 +134,7 @@ class ELMO40in2SpellingCorrector(ELMO40inSpellingCorrector):
         :param sentence: str
         :return: str, sentence with corrections
         """
-        analysis_dict = self.prepare_analysis_dict_for_sentence(sentence)
+        analysis_dict = self._prepare_analysis_dict_for_sentence(sentence)
         # Atomic Hypotheses space is constructed.
         # now we should compose them into sentence hypotheses with reduction of bad hypotheses
         output_sentence = self.make_fixes(analysis_dict, min_advantage_treshold=4.0)
@@ -40,53 +143,223 @@ class ELMO40in2SpellingCorrector(ELMO40inSpellingCorrector):
 
     def make_fixes(self, analysis_dict, min_advantage_treshold=4.0):
 
-        #  we may start construction of sentence hypotheses and reduct them
-        hypotheses = estimate_the_best_s_hypotheses(analysis_dict,
-                                                    min_advantage_treshold=min_advantage_treshold)
+        #  we may start construction of sentence hypotheses, the best one is found in the
+        #  lattice of candidates (see lattice_decoder):
+        hypotheses = decode_lattice(analysis_dict, min_advantage_treshold=min_advantage_treshold)
         # the_best:
-        output_sentence = hypotheses[0].text
+        output_sentence = self._restore_sentence(analysis_dict, hypotheses[0])
+        return output_sentence
 
-        # restore capitalization:
-        # output_sentence_tokens = self._lettercaser([analysis_dict['input_sentence'].split()],
-        #                                            [output_sentence.split()])[0]
-        output_sentence_tokens = self._lettercaser([word_tokenize(analysis_dict['input_sentence'])],
-                                                   [word_tokenize(output_sentence)])[0]
+    def make_fixes_k_best(self, analysis_dict, min_advantage_treshold=4.0, k_best=5):
+        """
+        Finds k best hypotheses of correction of the sentence
+
+        :param analysis_dict: dict SentenceAnalysisDictionary
+        :param k_best: int, max number of hypotheses
+        :return: list of tuples (corrected sentence, hypothesis text, advantage) sorted by
+            advantage, where hypothesis text is lowercased tokenized text of the hypothesis.
+            Corrected sentences are unique: different paths of the lattice may produce the
+            same sentence (ex.: equal candidates of a token), only the best of them is kept
+        """
+        decoded_count = k_best
+        while True:
+            hypotheses = decode_lattice(analysis_dict,
+                                        min_advantage_treshold=min_advantage_treshold,
+                                        k_best=decoded_count)
+            results = []
+            output_sentences = set()
+            for each_hypothesis in hypotheses:
+                output_sentence = self._restore_sentence(analysis_dict, each_hypothesis)
+                if output_sentence in output_sentences:
+                    continue
+                output_sentences.add(output_sentence)
+                results.append((output_sentence, each_hypothesis.text,
+                                each_hypothesis.calc_advantage_score()))
+            if len(results) >= k_best or len(hypotheses) < decoded_count:
+                # enough unique sentences or the lattice has no more paths:
+                return results[:k_best]
+            decoded_count *= 2
+
+    def _restore_sentence(self, analysis_dict, sentence_hypothesis):
+        """
+        Restores capitalization of the input sentence in hypothesis and detokenizes it.
 
+        Spans of token hypotheses tell which input tokens produced each token of the hypothesis,
+        so neither tokenization of strings nor their alignment is needed.
+
+        :param analysis_dict: dict SentenceAnalysisDictionary
+        :param sentence_hypothesis: SentenceHypothesis
+        :return: str
+        """
+        hypothesis_tokens, alignment = sentence_hypothesis.tokens_alignment()
+        # tokens of the input sentence before lowercasing (the same tokenization as of the
+        # tokenized_input_sentence which is indexed by spans):
+        input_tokens = analysis_dict.get('tokenized_cased_input_sentence',
+                                         analysis_dict['tokenized_input_sentence'])[1:-1]
+        if len(input_tokens) != len(analysis_dict['tokenized_input_sentence']) - 2:
+            # tokenizations of cased and lowercased sentence differ, spans are not valid for
+            # cased tokens:
+            input_tokens, alignment = word_tokenize(analysis_dict['input_sentence']), None
+        # restore capitalization:
+        output_sentence_tokens = self._lettercaser([input_tokens], [hypothesis_tokens],
+                                                   alignments=[alignment])[0]
 
         # output_sentence = " ".join(output_sentence_tokens)
         output_sentence = detokenize(output_sentence_tokens)
         return output_sentence
 
+    def process_sentences_batch_k_best(self, sentences, k_best=5, min_advantage_treshold=1.0,
+                                       max_tokens_count=None, rescorer=None, rescorer_weight=1.0):
+        """
+        Interface method for k-best corrections of a batch of sentences (ex.: to show
+        alternatives to users): the analysis is calculated once, then k best hypotheses are
+        decoded from the lattice of candidates.
+
+        :param sentences: list of input sentences
+        :param k_best: int, max number of corrections for each sentence
+        :param rescorer: optional scorer of hypotheses with score_batch method (ex.:
+            KenlmPrefixScorer), hypotheses of all sentences are scored in one batch
+        :param rescorer_weight: weight of rescorer score in the final score
+        :return: list (for each sentence) of lists of dicts sorted by score:
+            {
+                'sentence': corrected sentence,
+                'advantage': advantage of the hypothesis,
+                'rescorer_score': score of rescorer (only if rescorer is set),
+                'score': advantage + rescorer_weight * rescorer_score
+            }
+        """
+        anal_dicts = self._prepare_analysis_dicts_batch(sentences,
+                                                        max_tokens_count=max_tokens_count)
+        k_best_lists = [self.make_fixes_k_best(each_data, min_advantage_treshold, k_best=k_best)
+                        for each_data in anal_dicts]
+
+        if rescorer is not None:
+            rescorer_scores = iter(rescorer.score_batch(
+                [hypothesis_text for each_k_best in k_best_lists
+                 for _, hypothesis_text, _ in each_k_best]))
+
+        results = []
+        for each_k_best in k_best_lists:
+            sentence_results = []
+            for output_sentence, _, advantage in each_k_best:
+                result = {'sentence': output_sentence, 'advantage': advantage, 'score': advantage}
+                if rescorer is not None:
+                    result['rescorer_score'] = next(rescorer_scores)
+                    result['score'] = advantage + rescorer_weight * result['rescorer_score']
+                sentence_results.append(result)
+            results.append(sorted(sentence_results, key=lambda x: x['score'], reverse=True))
+        return results
+
     def prepare_analysis_dict_for_sentence(self, sentence):
         """
         The method which produces analysis dictionary of the sentence, it generates
         substitution candidates of the segments of the input sentence.
 
         :param sentence: str
-        :return: dict SentenceAnalysisDictionary
+        :return: dict SentenceAnalysisDictionary with word_substitutions_candidates
+        """
+        return materialize_analysis_dict(self._prepare_analysis_dict_for_sentence(sentence))
+
+    def _prepare_analysis_dict_for_sentence(self, sentence):
+        """
+        The same as prepare_analysis_dict_for_sentence, but candidates are kept in
+        HypothesesTable (see _analyze_sentence_with_elmo_data)
         """
         # preprocess
         preprocessed_sentence = self.preprocess_sentence(sentence)
+        tokenized_sentence = self.tokenize_input_sentence(sentence).wrapped_tokens()
 
-        # calculate elmo data for the input sentence
-        elmo_data = self.lm.analyze_sentence(sentence)
+        # candidates generation and calculation of their probabilities by elmo
+        candidates = self.precompute_candidates([tokenized_sentence])[0]
+        elmo_data = self.elmo_lm_for_candidates([tokenized_sentence], [candidates])[0]
 
-        # analyse sentence, atomic (token-token) hypotheses generation:
-        analysis_dict = self.elmo_analysis_with_probable_candidates_reduction_dict_in_dict_out(
-            {'input_sentence': preprocessed_sentence,
-             'tokenized_input_sentence': self.lm.tokenize_sentence(preprocessed_sentence)},
-            elmo_data)
+        # analyse sentence, atomic (token-token) and multi-token - token hypotheses generation:
         # TODO phonetic hypothese generation?
+        analysis_dict = self._analyze_sentence_with_elmo_data(
+            {'input_sentence': preprocessed_sentence,
+             'tokenized_input_sentence': tokenized_sentence},
+            elmo_data, candidates)
+        return analysis_dict
 
-        # multi-token - token hypotheses generation
-        merged_tokens_hypotheses_dict = self.generate_Nto1_hypotheses(
-            analysis_dict['tokenized_input_sentence'], elmo_data)
+    # generator of segments of the sentence which are hypothesised to be merged (2->1 merges):
+    merge_segments = staticmethod(merge_segments)
+
+    def precompute_candidates(self, wrapped_tokenized_sentences, wrapped_cased_sentences=None):
+        """
+        Generates levenshtein candidates for tokens (1->1) and merged segments (2->1) of sentences.
+        Candidates do not depend on LM output, so they may be calculated before (or in parallel
+        with) LM forward pass.
+
+        :param wrapped_tokenized_sentences: list of tokenized sentences wrapped with <S>, </S>
+        :param wrapped_cased_sentences: optional list of the same sentences before lowercasing,
+            they are used by token pre-classifier (see classify_token)
+        :return: list of dicts:
+            {
+                'tokens_candidates': list of candidates lists for each token,
+                'merges_candidates': dict {tok_idx: candidates list for merge of tokens
+                    tok_idx-1 and tok_idx}
+            }
+        """
+        if wrapped_cased_sentences is None:
+            wrapped_cased_sentences = wrapped_tokenized_sentences
+        token_classes_batch = [[self.classify_token(each_tok) for each_tok in each_sent]
+                               for each_sent in wrapped_cased_sentences]
+        tokens_candidates = self.generate_tokens_candidates(wrapped_tokenized_sentences,
+                                                            token_classes_batch)
+
+        merges_keys = []
+        merges_strs = []
+        for sent_idx, each_sent in enumerate(wrapped_tokenized_sentences):
+            for tok_idx, merge_hypothesis_str, _ in self.merge_segments(each_sent):
+                merges_keys.append((sent_idx, tok_idx))
+                merges_strs.append([merge_hypothesis_str])
+        merges_candidates = self.sccg(merges_strs) if merges_strs else []
+
+        results = [{'tokens_candidates': each_tokens_candidates, 'merges_candidates': {}}
+                   for each_tokens_candidates in tokens_candidates]
+        for (sent_idx, tok_idx), each_merge_candidates in zip(merges_keys, merges_candidates):
+            results[sent_idx]['merges_candidates'][tok_idx] = each_merge_candidates[0]
+        return results
 
+    def collect_word_ids(self, wrapped_tokenized_sentence, candidates):
+        """
+        Collects indexes of LM vocabulary which are looked up during hypotheses generation for
+        the sentence: input tokens, 1->1 candidates (the first and the last token of split
+        candidates) and merge candidates.
 
-        analysis_dict['word_substitutions_candidates'] += merged_tokens_hypotheses_dict
-        return analysis_dict
+        :param wrapped_tokenized_sentence: list of tokens wrapped with <S>, </S>
+        :param candidates: precomputed candidates of the sentence (see precompute_candidates)
+        :return: set of word indexes
+        """
+        lookup_tokens = set(wrapped_tokenized_sentence)
+        for each_token_candidates in candidates['tokens_candidates']:
+            for _, candidate_str in each_token_candidates:
+                if " " in candidate_str:
+                    mini_tokens = word_tokenize(candidate_str)
+                    lookup_tokens.add(mini_tokens[0])
+                    lookup_tokens.add(mini_tokens[-1])
+                else:
+                    lookup_tokens.add(candidate_str)
+        for each_merge_candidates in candidates['merges_candidates'].values():
+            lookup_tokens.update(candidate_str for _, candidate_str in each_merge_candidates)
 
-    def generate_Nto1_hypotheses(self, wrapped_tokenized_sentence, elmo_data):
+        return {self.lm.get_word_idx_or_unk(each_token)[0] for each_token in lookup_tokens}
+
+    def elmo_lm_for_candidates(self, wrapped_tokenized_sentences, candidates_batch):
+        """
+        Requests from LM probabilities of only those words which may be looked up during
+        hypotheses generation.
+
+        :param wrapped_tokenized_sentences: list of tokenized sentences wrapped with <S>, </S>
+        :param candidates_batch: list of precomputed candidates (see precompute_candidates)
+        :return: list of CandidatesElmoData
+        """
+        word_ids_batch = [self.collect_word_ids(each_sent, each_candidates)
+                          for each_sent, each_candidates in zip(wrapped_tokenized_sentences,
+                                                                candidates_batch)]
+        return self.lm.elmo_lm_for_word_ids(wrapped_tokenized_sentences, word_ids_batch)
+
+    def generate_Nto1_hypotheses(self, wrapped_tokenized_sentence, elmo_data, merges_candidates=None):
         """
         Given a tokenized sentence this method makes variation of tokens by merging two tokens
         into one and then populating dictionary with token hypothesys with specific
@@ -94,29 +367,23 @@ class ELMO40in2SpellingCorrector(ELMO40inSpellingCorrector):
 
         Another case is to make second variation by LevenshteinSearcherComponent
 
+        :param merges_candidates: optional dict with precomputed candidates of merges (see
+            precompute_candidates), if None they are calculated here
+
         TODO: make N->1 support. Now only 2->1 merges are hypothesised
         """
         token_hypotheses_dicts = []
 
-        for tok_idx, each_tok in enumerate(wrapped_tokenized_sentence):
-            if tok_idx <= 1 or tok_idx == len(wrapped_tokenized_sentence) - 1:
-                # the 0's token is <s> the last is </s>
-                continue
-
-            if len(wrapped_tokenized_sentence[tok_idx-1])==1 or len(wrapped_tokenized_sentence[tok_idx])==1:
-                # RULE of THUMB: don't merge words consisting of 1letter
-                continue
-
-            # simple merge hypothesis:
-            merge_hypothesis_str = wrapped_tokenized_sentence[tok_idx - 1] + \
-                                   wrapped_tokenized_sentence[tok_idx]
-            source_segment_str = wrapped_tokenized_sentence[tok_idx-1] +" "+ wrapped_tokenized_sentence[tok_idx]
+        for tok_idx, merge_hypothesis_str, source_segment_str in self.merge_segments(
+                wrapped_tokenized_sentence):
             ################################################################################
             # variate merged variant by levenshtein
             # print("Variate merged hypothesis: %s" % merge_hypothesis_str)
-            candidates_lists = self.sccg([[merge_hypothesis_str]])
-
-            candidates_list_for_token = candidates_lists[0][0]
+            if merges_candidates is None:
+                candidates_lists = self.sccg([[merge_hypothesis_str]])
+                candidates_list_for_token = candidates_lists[0][0]
+            else:
+                candidates_list_for_token = merges_candidates[tok_idx]
             # print("candidates_list_for_token")
             # print(candidates_list_for_token)
             for each_merge_candidate_err_score, each_merge_candidate_str in candidates_list_for_token:
@@ -271,15 +538,16 @@ class ELMO40in2SpellingCorrector(ELMO40inSpellingCorrector):
         Interface method for batchy estimation of corrections
         Given a batch of sentences it returns a batch of corrections
         :param sentences: list of input sentences
+        :param max_tokens_count: budget of padded tokens in minibatch of LM, if None then it is
+            measured against available memory
         :param supply_anal_dict: if true then returns anal dicts for all sentences, used for
-            debugging and analysis of errors
+            debugging and analysis of errors (sentences which are taken from the result cache
+            get copies of cached anal dicts)
         :param multisentences: if true then each element of batch may be a multiple sentence string,
             so we preprocess them by splitting into sentences.
         :return: list of corrected sentences
         """
 
-        if not max_tokens_count:
-            max_tokens_count=ELMO_BATCH_TOKEN_SIZE
         # ###############################################################################
         if multisentences:
             # TODO make as function decorator?
@@ -287,51 +555,94 @@ class ELMO40in2SpellingCorrector(ELMO40inSpellingCorrector):
             # and then process it, after that we need to restore sentence structure by joining
             # sentences that occured in the same input string.
 
-            # list of elementary sentences which are retrieved from input by sentence splitting:
-            flat_sents_list = []
-            # list which stores how many consequent sentences are must be joined into one input string
-            list_of_lengths = []
-            for each_string in sentences:
-                el_sents = ru_sent_tokenize(each_string)
-                list_of_lengths.append(len(el_sents))
+            # list of elementary sentences which are retrieved from input by sentence splitting and
+            # list which stores how many consequent sentences are must be joined into one input string:
+            sentences, list_of_lengths = split_multisentences(sentences)
+        # ###############################################################################
+        # identical sentences are corrected once, sentences corrected before are taken from the
+        # result cache:
+        fingerprint = self.model_fingerprint()
+        cache_keys = [(each_sentence, min_advantage_treshold, fingerprint)
+                      for each_sentence in sentences]
+        results = {}
+        unique_sentences = []
+        for key in cache_keys:
+            if key in results:
+                continue
+            cached_result = self.result_cache.get(key) if self.result_cache is not None else None
+            if cached_result is not None and supply_anal_dict and cached_result[1] is None:
+                # the sentence was cached without its anal dict:
+                cached_result = None
+            results[key] = cached_result
+            if cached_result is None:
+                unique_sentences.append(key[0])
+
+        if unique_sentences:
+            unique_output_sentences, unique_anal_dicts = self._process_unique_sentences(
+                unique_sentences, min_advantage_treshold=min_advantage_treshold,
+                max_tokens_count=max_tokens_count, token_length_sorting=token_length_sorting)
+            for each_sentence, each_output, each_anal_dict in zip(
+                    unique_sentences, unique_output_sentences, unique_anal_dicts):
+                key = (each_sentence, min_advantage_treshold, fingerprint)
+                results[key] = (each_output, each_anal_dict)
+                if self.result_cache is not None:
+                    self.result_cache.put(key, (each_output,
+                                                each_anal_dict if supply_anal_dict else None))
+
+        output_sentences = [results[key][0] for key in cache_keys]
+        anal_dicts = []
+        if supply_anal_dict:
+            # callers get own anal dicts in the format of word_substitutions_candidates, so their
+            # changes do not corrupt the cache or anal dicts of duplicates:
+            anal_dicts = [materialize_analysis_dict(results[key][1]) for key in cache_keys]
 
-                flat_sents_list += el_sents
+        # ###############################################################################
+        if multisentences:
+            # join output sentences of each input string into one:
+            output_sentences = [" ".join(each_group) for each_group in
+                                group_multisentences(output_sentences, list_of_lengths)]
+            if supply_anal_dict:
+                anal_dicts = group_multisentences(anal_dicts, list_of_lengths)
 
-            sentences = flat_sents_list
+        # ###############################################################################
+        if supply_anal_dict:
+            # TODO: anal_dicts has different sorting! Fix it?
+
+            return output_sentences, anal_dicts
+        else:
+            return output_sentences
+
+    def _process_unique_sentences(self, sentences, min_advantage_treshold=1.0,
+                                  max_tokens_count=None, token_length_sorting=True):
+        """
+        Corrects a batch of elementary sentences (without duplicates)
+
+        :return: tuple (list of corrected sentences, list of analysis dicts)
+        """
         # ###############################################################################
         if token_length_sorting:
             # TODO make as function decorator?
             # sort sentences by token length
             # and save initial order
-            # TODO use nltk tokenizer insted of split? - no speed advantage
-            # results = sorted(enumerate(sentences), key=lambda x: len(x[1].split()), reverse=True)
-            results = sorted(enumerate(sentences), key=lambda x: len(word_tokenize(x[1])), reverse=True)
-            source_idxs, sentences = zip(*results)
+            # sentences are tokenized once, the tokenization is passed to analysis dicts:
+            tokenized_sentences = [self.tokenize_input_sentence(each_sentence)
+                                   for each_sentence in sentences]
+            results = sorted(enumerate(tokenized_sentences), key=lambda x: len(x[1]),
+                             reverse=True)
+            source_idxs, tokenized_sentences = zip(*results)
+            sentences = [each_tokenized.text for each_tokenized in tokenized_sentences]
+        else:
+            tokenized_sentences = None
 
         # ###############################################################################
 
         start_dt = dt.datetime.now()
-        anal_dicts = self.prepare_analysis_dict_for_sentences_batch(
-            sentences, max_tokens_count=max_tokens_count)
+        anal_dicts = self._prepare_analysis_dicts_batch(
+            sentences, max_tokens_count=max_tokens_count, tokenized_sentences=tokenized_sentences)
         middle_dt = dt.datetime.now()
         print("datetimes. calculation of elmo analysis dicts: %s" % (str(middle_dt - start_dt)))
-        output_sentences = []
-
-        for sent_idx, each_data in enumerate(anal_dicts):
-
-            sentence_hypothesis = self.make_fixes(each_data, min_advantage_treshold)
-            # Letter caser:
-            # restore capitalization:
-            # output_sentence_tokens = self._lettercaser([each_data['input_sentence'].split()],
-            #                                            [sentence_hypothesis.split()])[0]
-            output_sentence_tokens = self._lettercaser([word_tokenize(each_data['input_sentence'])],
-                                                       [word_tokenize(sentence_hypothesis)])[0]
-
-            # output_sentence = " ".join(output_sentence_tokens)
-            output_sentence = detokenize(output_sentence_tokens)
-
-            # output_sentences.append(sentence_hypothesis)
-            output_sentences.append(output_sentence)
+        # capitalization is restored and sentences are detokenized by make_fixes:
+        output_sentences = self.make_fixes_batch(anal_dicts, min_advantage_treshold)
         fin_dt = dt.datetime.now()
         print("datetimes. making_fixes: %s" % (str(fin_dt-middle_dt)))
         print("datetimes. total calculation time: %s" % str(fin_dt-start_dt))
@@ -347,102 +658,257 @@ class ELMO40in2SpellingCorrector(ELMO40inSpellingCorrector):
             anal_dicts = anal_dicts_sorted
             output_sentences = output_sentences_2
 
-        # ###############################################################################
-        if multisentences:
+        return output_sentences, anal_dicts
 
-            merged_sentences = []
-            merged_anal_dicts = []
-            sent_offset = 0
-            for each_length in list_of_lengths:
-                # join each_length  of output sentences into one and continue
-                merged_sentence = " ".join(output_sentences[sent_offset:sent_offset+each_length])
-
-                merged_anal_dict_for_merged_sentences = anal_dicts[sent_offset:sent_offset+each_length]
-                sent_offset += each_length
-                merged_sentences.append(merged_sentence)
-                merged_anal_dicts.append(merged_anal_dict_for_merged_sentences)
-            output_sentences = merged_sentences
-            if supply_anal_dict:
-                anal_dicts = merged_anal_dicts
+    def prepare_analysis_dict_for_sentences_batch(self, sentences, max_tokens_count=None,
+                                                  tokenized_sentences=None):
+        """
+        The method which produces analysis dictionary of the sentence, it generates
+        substitution candidates of the segments of the input sentence.
 
-        # ###############################################################################
-        if supply_anal_dict:
-            # TODO: anal_dicts has different sorting! Fix it?
+        :param sentence: str
+        :param tokenized_sentences: list of TokenizedSentence of sentences, if None then
+            sentences are tokenized by tokenize_input_sentence
+        :return: list of dicts SentenceAnalysisDictionary with word_substitutions_candidates
+        """
+        return [materialize_analysis_dict(each_dict) for each_dict in
+                self._prepare_analysis_dicts_batch(sentences, max_tokens_count=max_tokens_count,
+                                                   tokenized_sentences=tokenized_sentences)]
 
-            return output_sentences, anal_dicts
+    def _prepare_analysis_dicts_batch(self, sentences, max_tokens_count=None,
+                                      tokenized_sentences=None):
+        """
+        The same as prepare_analysis_dict_for_sentences_batch, but candidates are kept in
+        HypothesesTable (see _analyze_sentence_with_elmo_data), so they are compact in the result
+        cache and are decoded without conversion
+        """
+        # tokenize sentences, lowercased tokens are preprocessed cased tokens, so both
+        # tokenizations have the same length:
+        tokenized_inputs = tokenized_sentences
+        if tokenized_inputs is None:
+            tokenized_inputs = [self.tokenize_input_sentence(sentence) for sentence in sentences]
+        tokenized_sentences = [each_tokenized.wrapped_tokens() for each_tokenized in tokenized_inputs]
+        tokenized_sentences_cased = [each_tokenized.wrapped_tokens(lowered=False)
+                                     for each_tokenized in tokenized_inputs]
+
+        # batches of sentences of close lengths fitting into the budget of padded tokens:
+        batch_scheduler = self._get_batch_scheduler(max_tokens_count)
+        batch_scheduler.reset_stats()
+        mini_batches = list(batch_scheduler.schedule(tokenized_sentences))
+
+        input_dicts = [{
+            'input_sentence': sentences[idx],
+            'tokenized_input_sentence': tokenized_sentences[idx],
+            'tokenized_cased_input_sentence': tokenized_sentences_cased[idx],
+        } for idx in range(len(sentences))]
+
+        if self.pipelined:
+            analysis_dicts = self._analyze_mini_batches_pipelined(mini_batches, input_dicts)
         else:
-            return output_sentences
+            analysis_dicts = self._analyze_mini_batches(mini_batches, input_dicts)
+        print("dynamic batching: %s" % batch_scheduler.report())
+        return analysis_dicts
 
-    def prepare_analysis_dict_for_sentences_batch(self, sentences, max_tokens_count=None):
+    def analyze_sentence_with_elmo_data(self, sentence_analysis_dict, elmo_data, candidates=None):
         """
-        The method which produces analysis dictionary of the sentence, it generates
-        substitution candidates of the segments of the input sentence.
+        Hypotheses generation for a sentence with calculated ELMO data: atomic (token-token)
+        hypotheses and multi-token - token hypotheses.
+
+        :param sentence_analysis_dict: dict with input_sentence, tokenized_input_sentence and
+            tokenized_cased_input_sentence
+        :param elmo_data: ELMO data of the sentence
+        :param candidates: optional precomputed candidates of the sentence (see
+            precompute_candidates)
+        :return: dict SentenceAnalysisDictionary with word_substitutions_candidates
+        """
+        return materialize_analysis_dict(self._analyze_sentence_with_elmo_data(
+            sentence_analysis_dict, elmo_data, candidates))
 
-        :param sentence: str
-        :return: dict SentenceAnalysisDictionary
+    def _analyze_sentence_with_elmo_data(self, sentence_analysis_dict, elmo_data,
+                                         candidates=None):
+        """
+        The same as analyze_sentence_with_elmo_data, but candidates are kept in HypothesesTable
+        under HYPOTHESES_TABLE_KEY instead of word_substitutions_candidates (see
+        materialize_analysis_dict)
         """
+        if candidates is None:
+            candidates = {'tokens_candidates': None, 'merges_candidates': None}
+        table_builder = HypothesesTableBuilder(sentence_analysis_dict['tokenized_input_sentence'])
+        # analyse sentence, atomic (token-token) hypotheses generation:
+        analysis_dict = self.elmo_analysis_with_probable_candidates_reduction_dict_in_dict_out(
+            sentence_analysis_dict, elmo_data,
+            candidates_list_for_sentence=candidates['tokens_candidates'],
+            table_builder=table_builder)
 
-        # preprocess
-        preprocessed_sentences = [self.preprocess_sentence(sentence) for sentence in sentences]
-
-        # tokenize sentences
-        tokenized_sentences = [self.lm.tokenize_sentence(sentence) for sentence in preprocessed_sentences]
-        tokenized_sentences_cased = [self.lm.tokenize_sentence(sentence) for sentence in sentences]
-
-        # offset from the start of the batch
-        batch_offset = 0
-        # batch_gen = self.chunk_generator(tokenized_sentences, ELMO_BATCH_SIZE)
-        if not max_tokens_count:
-            max_tokens_count=ELMO_BATCH_TOKEN_SIZE
-        batch_gen = self.chunk_generator_token_weighted(tokenized_sentences,
-                                                        max_tokens_count=max_tokens_count)
+        # multi-token - token hypotheses generation
+        merged_tokens_hypotheses_dict = self.generate_Nto1_hypotheses(
+            analysis_dict['tokenized_input_sentence'], elmo_data,
+            merges_candidates=candidates['merges_candidates'])
+        for each_group in merged_tokens_hypotheses_dict:
+            table_builder.add_group(each_group['tok_idx'], each_group['source_segment_str'])
+            for each_candidate in each_group['top_k_candidates']:
+                table_builder.add_candidate_dict(each_candidate)
+
+        analysis_dict[HYPOTHESES_TABLE_KEY] = table_builder.build()
+        return analysis_dict
 
-        analysis_dicts = []
+    def _analyze_mini_batches(self, mini_batches, input_dicts):
+        """
+        Sequential processing of minibatches: LM forward pass, then hypotheses generation.
 
-        for mini_batch_tokenized_sents in batch_gen:
+        :param mini_batches: list of tuples (indexes, tokenized sentences) from batch scheduler
+        :param input_dicts: list of input analysis dicts for all sentences
+        :return: list of analysis dicts in the order of input_dicts
+        """
+        analysis_dicts = [None] * len(input_dicts)
+        for mini_batch_indexes, mini_batch_tokenized_sents in mini_batches:
             # minibatch start:
             start_dt = dt.datetime.now()
-            elmo_datas_mini_batch = self.lm.elmo_lm(mini_batch_tokenized_sents)
+            # candidates do not depend on LM, so LM is requested only for their probabilities:
+            mini_batch_candidates = self.precompute_candidates(
+                mini_batch_tokenized_sents,
+                [input_dicts[idx]['tokenized_cased_input_sentence'] for idx in mini_batch_indexes])
+            candidates_dt = dt.datetime.now()
+            elmo_datas_mini_batch = self.elmo_lm_for_candidates(mini_batch_tokenized_sents,
+                                                                mini_batch_candidates)
             middle_dt = dt.datetime.now()
             # now we consequently execute hypotheses generation
-            for relative_offset, each_elmo_data in enumerate(elmo_datas_mini_batch):
-                absolute_offset = batch_offset + relative_offset
-                # analyse sentence, atomic (token-token) hypotheses generation:
-                try:
-                    # analysis_dict = self.elmo_analysis_with_probable_candidates_reduction_dict_in_dict_out(
-                    #     {
-                    #         # 'input_sentence': preprocessed_sentences[absolute_offset],
-                    #         'input_sentence': sentences[absolute_offset],
-                    #         'tokenized_input_sentence': tokenized_sentences[absolute_offset]},
-                    #     each_elmo_data)
-
-                    analysis_dict = self.elmo_analysis_with_probable_candidates_reduction_dict_in_dict_out( {
-                        'input_sentence': sentences[absolute_offset],
-                        'tokenized_input_sentence': tokenized_sentences[absolute_offset],
-                        'tokenized_cased_input_sentence': tokenized_sentences_cased[absolute_offset]
-
-                    }, each_elmo_data)
-                except Exception as e:
-                    print(e)
-                    print(absolute_offset)
-                    print(len(sentences))
-                    import ipdb; ipdb.set_trace()
-                    print("1")
-
-
-                # multi-token - token hypotheses generation
-                merged_tokens_hypotheses_dict = self.generate_Nto1_hypotheses(
-                    analysis_dict['tokenized_input_sentence'], each_elmo_data)
-
-                analysis_dict['word_substitutions_candidates'] += merged_tokens_hypotheses_dict
-                analysis_dicts.append(analysis_dict)
-            # increment offset with size of batch
-            batch_offset += len(mini_batch_tokenized_sents)
+            for absolute_offset, each_elmo_data, each_candidates in zip(
+                    mini_batch_indexes, elmo_datas_mini_batch, mini_batch_candidates):
+                analysis_dicts[absolute_offset] = self._analyze_sentence_with_elmo_data(
+                    input_dicts[absolute_offset], each_elmo_data, each_candidates)
             fin_dt = dt.datetime.now()
-            print("Calc elmo matricies in minibatch: %s, generating_hypotheses: %s" % (
-            str(middle_dt - start_dt), str(fin_dt - middle_dt)))
+            print("Minibatch of %d sentences. candidates: %s, calc elmo matricies: %s, generating_hypotheses: %s" % (
+                len(mini_batch_indexes), str(candidates_dt - start_dt), str(middle_dt - candidates_dt),
+                str(fin_dt - middle_dt)))
+        return analysis_dicts
+
+    def _analyze_mini_batches_pipelined(self, mini_batches, input_dicts):
+        """
+        Overlapped processing of minibatches.
+
+        Stages:
+            1. levenshtein candidates generation for all minibatches in a prefetching thread (it
+                runs ahead of LM, so candidates of minibatch N+1 are ready when LM finishes N);
+            2. LM forward passes (restricted to words of candidates) in a worker thread
+                (torch/TF release the GIL), outputs are passed through a bounded queue of
+                PIPELINE_QUEUE_SIZE minibatches;
+            3. hypotheses generation in the calling thread, or in a pool of processes if
+                hypotheses_workers > 1.
+
+        If a stage fails, candidates of pending minibatches are cancelled and the LM worker
+        stops before the exception is propagated.
+
+        :param mini_batches: list of tuples (indexes, tokenized sentences) from batch scheduler
+        :param input_dicts: list of input analysis dicts for all sentences
+        :return: list of analysis dicts in the order of input_dicts
+        """
+        # the pool must be forked before LM thread starts
+        hypotheses_pool = self._get_hypotheses_pool()
+        candidates_executor = ThreadPoolExecutor(max_workers=1)
+        candidates_futures = [
+            candidates_executor.submit(
+                self.precompute_candidates, batch,
+                [input_dicts[idx]['tokenized_cased_input_sentence'] for idx in batch_indexes])
+            for batch_indexes, batch in mini_batches]
+
+        lm_outputs_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        stop_event = threading.Event()
+
+        def lm_worker():
+            try:
+                for batch_no, (_, mini_batch_tokenized_sents) in enumerate(mini_batches):
+                    if stop_event.is_set():
+                        return
+                    elmo_datas_mini_batch = self.elmo_lm_for_candidates(
+                        mini_batch_tokenized_sents, candidates_futures[batch_no].result())
+                    lm_outputs_queue.put((batch_no, elmo_datas_mini_batch))
+            except Exception as e:
+                lm_outputs_queue.put((None, e))
+
+        lm_thread = threading.Thread(target=lm_worker, daemon=True)
+        lm_thread.start()
+
+        analysis_dicts = [None] * len(input_dicts)
+        try:
+            for _ in range(len(mini_batches)):
+                start_dt = dt.datetime.now()
+                batch_no, elmo_datas_mini_batch = lm_outputs_queue.get()
+                if batch_no is None:
+                    # exception in LM worker
+                    raise elmo_datas_mini_batch
+                mini_batch_indexes, _ = mini_batches[batch_no]
+                mini_batch_candidates = candidates_futures[batch_no].result()
+                middle_dt = dt.datetime.now()
+
+                tasks = [(input_dicts[absolute_offset], each_elmo_data, each_candidates)
+                         for absolute_offset, each_elmo_data, each_candidates in zip(
+                             mini_batch_indexes, elmo_datas_mini_batch, mini_batch_candidates)]
+                if hypotheses_pool:
+                    mini_batch_analysis_dicts = hypotheses_pool.map(_generate_hypotheses_in_worker,
+                                                                    tasks)
+                else:
+                    mini_batch_analysis_dicts = [
+                        self._analyze_sentence_with_elmo_data(*each_task) for each_task in tasks]
+                for absolute_offset, each_analysis_dict in zip(mini_batch_indexes,
+                                                               mini_batch_analysis_dicts):
+                    analysis_dicts[absolute_offset] = each_analysis_dict
+                fin_dt = dt.datetime.now()
+                print("Waiting for elmo matricies of minibatch of %d sentences: %s, generating_hypotheses: %s" % (
+                    len(mini_batch_indexes), str(middle_dt - start_dt), str(fin_dt - middle_dt)))
+        finally:
+            stop_event.set()
+            # pending candidates are not needed (LM worker gets CancelledError if it waits for
+            # them), only the running task is finished:
+            candidates_executor.shutdown(wait=False, cancel_futures=True)
+            # unblock LM worker if it waits for a free slot in the queue:
+            while lm_thread.is_alive():
+                try:
+                    lm_outputs_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
         return analysis_dicts
 
+    def _get_hypotheses_pool(self):
+        """
+        Returns pool of processes for hypotheses generation (or None if it is disabled).
+
+        With 'fork' start method workers share the candidates generator and the vocabulary of
+        the LM without pickling. Workers never run the LM, but the pool is forked after the LM
+        is loaded: if torch/TF runtime has started its threads, a lock held by them at the
+        moment of fork (ex.: by an allocator) may deadlock a worker. So 'fork' is safe for LMs
+        which do not start threads on load, otherwise use 'forkserver' or 'spawn', then the
+        corrector is pickled to each worker and its models must be picklable.
+
+        Only compact ELMO datas (probabilities of candidates) and candidates are pickled to be
+        passed to workers for each minibatch.
+        """
+        if self.hypotheses_workers <= 1:
+            return None
+        if self._hypotheses_pool is None:
+            context = multiprocessing.get_context(self.hypotheses_start_method)
+            self._hypotheses_pool = context.Pool(
+                self.hypotheses_workers, initializer=_init_hypotheses_worker, initargs=(self,))
+        return self._hypotheses_pool
+
+    def close(self):
+        """Terminates pool of hypotheses workers if it was started"""
+        if self._hypotheses_pool is not None:
+            self._hypotheses_pool.terminate()
+            self._hypotheses_pool = None
+
+    def _get_batch_scheduler(self, max_tokens_count=None):
+        """
+        Returns scheduler of minibatches for LM.
+
+        :param max_tokens_count: budget of padded tokens (max_len * batch_size) per minibatch, if
+            None then budget is measured against available memory by the LM's scheduler
+        :return: LengthBucketedBatchScheduler
+        """
+        if max_tokens_count:
+            return LengthBucketedBatchScheduler(max_padded_tokens=max_tokens_count)
+        return self.lm.get_batch_scheduler()
+
     def make_fixes_batch(self, analysis_dicts, min_advantage_treshold=4.0):
         results=[]
         for each_anal_dict in analysis_dicts:
@@ -16,6 +16,12 @@ from lettercaser import LettercaserForSpellchecker
 from language_models.elmolm_from_config import ELMOLM
 from dp_components.levenshtein_searcher_component import LevenshteinSearcherComponent
 from language_models.utils import yo_substitutor
+from spelling_correction_models.elmo_40in_spelling_corrector.hypotheses_table import \
+    HypothesesTableBuilder
+# constants of candidates generation and token classes are shared with light correctors:
+from spelling_correction_models.utils import LEVENSHTEIN_MAX_DIST, OOV_PENALTY, \
+    TOKEN_CLASS_FROZEN, TOKEN_CLASS_PUNCTUATION, TOKEN_CLASS_NUMBER, PUNCTUATION_TOKEN_REGEXP, \
+    NUMBER_TOKEN_REGEXP, TokenClassifier
 # due to computational error 0.0 advantage may occur as small negative number,
 # usually it is a zero-hypothesis (no need for spelling correction hypothesis),
 # so we need to grasp them.
@@ -28,15 +34,12 @@ TOKEN_SPLIT_LOGIT_MULTIPLICATOR = 1.5
 # error score incremented for tokens splitting
 TOKEN_SPLIT_ERROR_SCORE = -2.0
 
-# weighted distance limit for levenshtein search:
-LEVENSHTEIN_MAX_DIST = 1.0
-
-# out of vocabulary penalty
-OOV_PENALTY = -1.0
-
 # url where file with wordforms for candidates generator:
 URL_TO_WORDFORMS = "http://files.deeppavlov.ai/spelling_correctors/wordforms.txt"
 
+DIGITS_REGEXP = re.compile(r"\d")
+ABBREVIATION_REGEXP = re.compile(r"([A-ZА-Я]\.*){2,}s?")
+
 
 def clean_dialog16_sentences_from_punctuation(sentences):
     """
@@ -134,11 +137,11 @@ class ELMO40inSpellingCorrector():
         # minimal likelihood advantage treshold for fixing the sentence
         self.fix_treshold = fix_treshold
 
-        if not frozen_words_regex_patterns:
-            self.frozen_words_regex_patterns = []
-        else:
+        if frozen_words_regex_patterns:
             assert isinstance(frozen_words_regex_patterns, list)
-            self.frozen_words_regex_patterns = [re.compile(pat) for pat in frozen_words_regex_patterns]
+        # pre-classifier of tokens whose outcome is fixed (it memoizes its decisions):
+        self.token_classifier = TokenClassifier(frozen_words_regex_patterns)
+        self.frozen_words_regex_patterns = self.token_classifier.frozen_words_regex_patterns
         print("Initialization Completed.")
 
     def _init_elmo(self, mini_batch_size=None):
@@ -251,6 +254,113 @@ class ELMO40inSpellingCorrector():
 
         return lowercased_sentence
 
+    def classify_token(self, token):
+        """
+        Pre-classifier of tokens whose outcome is fixed: tokens matching frozen patterns,
+        punctuation and numbers. Such tokens get only zero hypothesis, so candidates generation
+        and LM lookups are skipped for them. Decisions are memoized per token string.
+
+        :param token: str, cased token
+        :return: one of TOKEN_CLASS_FROZEN, TOKEN_CLASS_PUNCTUATION, TOKEN_CLASS_NUMBER or None
+            if token must be analyzed
+        """
+        return self.token_classifier.classify(token)
+
+    def generate_tokens_candidates(self, tokenized_sentences, token_classes_batch):
+        """
+        Generates levenshtein candidates for tokens of sentences, pre-classified tokens (see
+        classify_token) are not passed to candidates generator and get only themselves as a
+        candidate.
+
+        :param tokenized_sentences: list of tokenized sentences
+        :param token_classes_batch: list of lists of token classes
+        :return: list of candidates lists for each token of each sentence
+        """
+        analyzed_sentences = [[each_tok for each_tok, token_class in zip(each_sent, token_classes)
+                               if token_class is None]
+                              for each_sent, token_classes in zip(tokenized_sentences,
+                                                                  token_classes_batch)]
+        analyzed_candidates = self.sccg(analyzed_sentences)
+
+        candidates_batch = []
+        for each_sent, token_classes, each_candidates in zip(
+                tokenized_sentences, token_classes_batch, analyzed_candidates):
+            each_candidates = iter(each_candidates)
+            candidates_batch.append([next(each_candidates) if token_class is None
+                                     else [(0.0, each_tok)]
+                                     for each_tok, token_class in zip(each_sent, token_classes)])
+        return candidates_batch
+
+    def _make_zero_hypothesis(self, token_str, cased_token_str, tok_idx, lm_advantage=0.0,
+                              error_score=0.0):
+        """
+        Makes candidate dict of zero hypothesis (token is not changed) with heuristic boosts of
+        advantage for capitalized words, abbreviations, short words and words with digits.
+
+        :param token_str: str, token
+        :param cased_token_str: str, token before lowercasing
+        :param tok_idx: int, index of token in the wrapped sentence
+        :param lm_advantage: advantage of pure language model (0.0 for zero hypothesis)
+        :param error_score: error score of the token from candidates generator
+        :return: dict
+        """
+        candidate_dict = {
+            # advantage of pure language model:
+            "lm_advantage": lm_advantage,
+            # advantage with error score:
+            "advantage": lm_advantage + error_score,
+
+            "token_str": token_str,
+            # if it is zero hypothesis
+            "zero_hypothesis": True,
+            "error_score": 0.0,
+            "token_merges": 0,
+            "token_splits": None
+        }
+        # TODO hack with abbreviations
+        # TODO refactor me!
+        # TODO refactor magic numbers
+        case = self._lettercaser.determine_lettercase(cased_token_str)
+        if case=='capitalize' and tok_idx>1:
+            # first token in sentence capitalization is not important
+            candidate_dict['advantage'] += 1.5
+            candidate_dict['case'] = case
+
+        elif case == 'upper':
+            # boost advantage of zero hypothesis?
+            # may be it is better to reduce advantage of all others?
+            candidate_dict['advantage'] += 5.0
+            candidate_dict['case'] = case
+
+        # abbreviation fuzzy match:
+        is_abbrev = ABBREVIATION_REGEXP.match(cased_token_str)
+        if is_abbrev:
+            candidate_dict['advantage'] += 5.0
+            candidate_dict['is_abbrev'] = True
+
+        # SHORT WORDS HANDLING:
+        # if token is 1-2 letters in length
+        if len(cased_token_str)==1:
+            # huge adbvantage to 1 letters
+            candidate_dict['advantage'] += 4.0
+            candidate_dict['comment'] = "1letter word"
+
+        if len(cased_token_str)==2:
+            # last symbol is dot
+            candidate_dict['advantage'] += 0.5
+            candidate_dict['comment'] = "2letter word"
+
+        if cased_token_str[-1]=="." and len(cased_token_str)<=3:
+            # last symbol is dot
+            candidate_dict['advantage'] += 4.0
+            candidate_dict['comment'] = "short word with punctuation"
+
+        if DIGITS_REGEXP.search(cased_token_str):
+            # has digit
+            candidate_dict['advantage'] += 4.0
+            candidate_dict['comment'] = "has digit"
+        return candidate_dict
+
     def process_sentence(self, sentence):
         """
         Interface method for sentence correction.
@@ -350,7 +460,9 @@ class ELMO40inSpellingCorrector():
         # elmo data array contains a ndarray of size: [1, len(sentence tokens), 1000000]
         return self.elmo_analysis_with_probable_candidates_reduction_dict_in_dict_out(result_data_dict, elmo_data)
 
-    def elmo_analysis_with_probable_candidates_reduction_dict_in_dict_out(self, sentence_analysis_dict, elmo_data, filter_by_lm_lower_bound=None):
+    def elmo_analysis_with_probable_candidates_reduction_dict_in_dict_out(self, sentence_analysis_dict, elmo_data, filter_by_lm_lower_bound=None,
+                                                                          candidates_list_for_sentence=None,
+                                                                          table_builder=None):
         """
         Given a sentence this method analyzes it and returns an analysis dictionary
         with hypotheses of the best substitutions (as scored lists for each token).
@@ -359,6 +471,14 @@ class ELMO40inSpellingCorrector():
         splitting or merging).
 
         The analysis dictionary allows to make parametrized hypothesis selection at the next stage.
+
+        candidates_list_for_sentence: optional list of levenshtein candidates lists for each token
+        of tokenized_input_sentence (output of self.sccg for the sentence). Candidates generation
+        does not depend on elmo_data, so it may be precomputed. If None then it is calculated here.
+
+        table_builder: optional HypothesesTableBuilder, if it is given then candidates are added to
+        it (groups of tokens in order) and word_substitutions_candidates is not set, otherwise
+        word_substitutions_candidates are converted from the table.
         Example of Input:
         {
             'input_sentence': 'очень классная тетка ктобы что не говорил',
@@ -434,49 +554,46 @@ class ELMO40inSpellingCorrector():
             tok_wrapped_cased = sentence_analysis_dict['tokenized_cased_input_sentence']
         else:
             tok_wrapped_cased = tok_wrapped
+        # tokens whose outcome is fixed (frozen words, punctuation, numbers) are not analyzed:
+        token_classes = [self.classify_token(each_tok) for each_tok in tok_wrapped_cased]
         # elmo data array contains a ndarray of size: [1, len(sentence tokens), 1000000]
-        candidates_lists = self.sccg([tok_wrapped])
-        # find the best substitutions in sentence from candidates sets
-        candidates_list_for_sentence = candidates_lists[0]
+        if candidates_list_for_sentence is None:
+            candidates_lists = self.generate_tokens_candidates([tok_wrapped], [token_classes])
+            # find the best substitutions in sentence from candidates sets
+            candidates_list_for_sentence = candidates_lists[0]
         # base_scores = self.lm.trace_sentence_probas_in_elmo_datas_batch([elmo_data], [tok_wrapped])
         # log_probas_base = np.log10(base_scores)
         # # summated_probas_base = log_probas_base.sum(axis=1)
         # # TODO check if it is not necessary?
         # summated_probas_base = log_probas_base.sum()
 
-        # for each candidate_list by levenshtein find top_k hypothese of susbstitutions in ELMO data
-        word_substitutions_candidates = [{'tok_idx': idx, 'top_k_candidates': []} for idx, _ in
-                                         enumerate(candidates_list_for_sentence)]
+        # for each candidate_list by levenshtein find top_k hypothese of susbstitutions in ELMO data,
+        # candidates are collected into columns of HypothesesTable instead of dicts:
+        builder = table_builder
+        if builder is None:
+            builder = HypothesesTableBuilder(tok_wrapped)
 
         #     for candi_idx, each_candidates_list in enumerate(candidates_list_for_sentence):
         #         # find scores in elmo data
         #         pass
 
         for tok_idx, input_token in enumerate(tok_wrapped):
+            builder.add_group(tok_idx)
             if tok_idx == 0:
                 continue
 
-            # if token in list of frozen patterns
-            if self.frozen_words_regex_patterns:
-                res = any(each_pat.match(tok_wrapped_cased[tok_idx]) for each_pat in self.frozen_words_regex_patterns)
-                if res:
-                    # matched pattern for blocking corrections, add zero hypothesis and continue
-                    candidate_dict = {
-                        # advantage of pure language model:
-                        "lm_advantage": 0,
-                        # advantage with error score:
-                        "advantage": 0,
-
-                        "token_str": tok_wrapped_cased[tok_idx],
-                        # if it is zero hypothesis
-                        "zero_hypothesis": True,
-                        "error_score": 0,
-                        "token_merges": 0,
-                        "token_splits": 0
-                    }
-                    word_substitutions_candidates[tok_idx]['top_k_candidates'].append(
-                        candidate_dict)
-                    continue
+            if token_classes[tok_idx] == TOKEN_CLASS_FROZEN:
+                # matched pattern for blocking corrections, add zero hypothesis and continue
+                builder.add_candidate(tok_wrapped_cased[tok_idx], 0, lm_advantage=0,
+                                      error_score=0, zero_hypothesis=True, token_merges=0,
+                                      token_splits=0)
+                continue
+            elif token_classes[tok_idx] is not None:
+                # punctuation or number, only zero hypothesis is possible
+                builder.add_candidate_dict(
+                    self._make_zero_hypothesis(input_token, tok_wrapped_cased[tok_idx], tok_idx))
+                continue
+
             # retieve the best candidates
             # 1. retrive best from levenshtein list
             levenshtein_candidates_for_current_token = candidates_list_for_sentence[tok_idx]
@@ -496,19 +613,8 @@ class ELMO40inSpellingCorrector():
                 error_score = each_candidate[0]
                 # TODO use  error_score for SCCG which can generate distant fixes
 
-                candidate_dict = {
-                    # advantage of pure language model:
-                    "lm_advantage": None,
-                    # advantage with error score:
-                    "advantage": None,
-
-                    "token_str": candidate_str,
-                    # if it is zero hypothesis
-                    "zero_hypothesis": None,
-                    "error_score": None,
-                    "token_merges": 0,
-                    "token_splits": None
-                }
+                # number of tokens split off the token:
+                token_splits = None
 
                 if " " in candidate_str:
                     ###########################################################################
@@ -541,7 +647,7 @@ class ELMO40inSpellingCorrector():
                                                                                 tok_idx,
                                                                                 mini_tokens[rightmost_index])
                     # provide information that token split occured:
-                    candidate_dict["token_splits"] = len(mini_tokens)-1
+                    token_splits = len(mini_tokens)-1
                     # TODO modify likelihoods or error score? otherwise it overestimates
                     assert left_logit < 0, "Left logit must be negative"
                     assert right_logit < 0, "Right logit must be negative"
@@ -560,75 +666,29 @@ class ELMO40inSpellingCorrector():
                 # with error score
                 lm_advantage = left_logit + right_logit - base_summa
                 advantage_score = lm_advantage + error_score
-                candidate_dict['lm_advantage'] = lm_advantage
-                candidate_dict['advantage'] = advantage_score
 
                 if candidate_str == tok_wrapped[tok_idx]:
                     # ZERO HYPOTHESIS case
-                    candidate_dict['zero_hypothesis'] = True
-                    candidate_dict['error_score'] = 0.0
-                    word_substitutions_candidates[tok_idx]['top_k_candidates'].append(candidate_dict)
-                    # TODO hack with abbreviations
-                    # TODO refactor me!
-                    # TODO refactor magic numbers
-                    case = self._lettercaser.determine_lettercase(tok_wrapped_cased[tok_idx])
-                    if case=='capitalize' and tok_idx>1:
-                        # first token in sentence capitalization is not important
-                        candidate_dict['advantage'] += 1.5
-                        candidate_dict['case'] = case
-
-                    elif case == 'upper':
-                        # boost advantage of zero hypothesis?
-                        # may be it is better to reduce advantage of all others?
-                        candidate_dict['advantage'] += 5.0
-                        candidate_dict['case'] = case
-
-                    # abbreviation fuzzy match:
-                    is_abbrev = re.match("([A-ZА-Я]\.*){2,}s?", tok_wrapped_cased[tok_idx])
-                    if is_abbrev:
-                        candidate_dict['advantage'] += 5.0
-                        candidate_dict['is_abbrev'] = True
-
-                    # SHORT WORDS HANDLING:
-                    # if token is 1-2 letters in length
-                    if len(tok_wrapped_cased[tok_idx])==1:
-                        # huge adbvantage to 1 letters
-                        candidate_dict['advantage'] += 4.0
-                        candidate_dict['comment'] = "1letter word"
-
-                    if len(tok_wrapped_cased[tok_idx])==2:
-                        # last symbol is dot
-                        candidate_dict['advantage'] += 0.5
-                        candidate_dict['comment'] = "2letter word"
-
-                    if tok_wrapped_cased[tok_idx][-1]=="." and len(tok_wrapped_cased[tok_idx])<=3:
-                        # last symbol is dot
-                        candidate_dict['advantage'] += 4.0
-                        candidate_dict['comment'] = "short word with punctuation"
-
-                    digits_regexp = re.compile('\d')
-
-                    if digits_regexp.search(tok_wrapped_cased[tok_idx]):
-                        # has digit
-                        candidate_dict['advantage'] += 4.0
-                        candidate_dict['comment'] = "has digit"
+                    builder.add_candidate_dict(self._make_zero_hypothesis(
+                        candidate_str, tok_wrapped_cased[tok_idx], tok_idx,
+                        lm_advantage=lm_advantage, error_score=error_score))
 
                 # elif advantage_score >= ZERO_LOWER_BOUND:
                 # temporarly filter by lm_advantage only:
                 elif lm_advantage >= filter_by_lm_lower_bound:
                     # hypothesis satisfies the policy
-                    candidate_dict['zero_hypothesis'] = False
-                    candidate_dict['error_score'] = error_score
-
-                    word_substitutions_candidates[tok_idx]['top_k_candidates'].append(candidate_dict)
+                    builder.add_candidate(candidate_str, advantage_score,
+                                          lm_advantage=lm_advantage, error_score=error_score,
+                                          zero_hypothesis=False, token_merges=0,
+                                          token_splits=token_splits)
                 else:
                     # skip the candidate
                     pass
-            word_substitutions_candidates[tok_idx]['top_k_candidates'] = sorted(word_substitutions_candidates[tok_idx]['top_k_candidates'],
-                                                           key=lambda x: x['advantage'],
-                                                           reverse=True)
+            builder.sort_group_by_advantage()
 
-        sentence_analysis_dict['word_substitutions_candidates'] = word_substitutions_candidates
+        if table_builder is None:
+            sentence_analysis_dict['word_substitutions_candidates'] = \
+                builder.build().to_word_substitutions_candidates()
         return sentence_analysis_dict
 
     #####################################################################
@@ -1,4 +1,6 @@
 from copy import deepcopy
+import numpy as np
+from .hypotheses_table import HypothesesTable
 # maximum number of hypotheses in hypotheses hub for correction of one sentence
 HYPOHUB_MAX_ALLOWED_SIZE = 1000
 
@@ -6,79 +8,87 @@ def estimate_the_best_s_hypotheses(data_analysis_dict, min_advantage_treshold=0.
     """
     Given a dictionary with analysis of sentence with all allowed token-candidate hypotheses
     constructs sentences hypotheses.
-    :param data_analysis_dict:
+
+    Hypotheses hub is kept in columns: scores and finish indexes of hypotheses are arrays and
+    texts are restored by back pointers only for the best hypothesis (see
+    HypothesesTable), so hypotheses are never deep copied.
+
+    :param data_analysis_dict: dict SentenceAnalysisDictionary or HypothesesTable
     :param min_advantage_treshold: minimal value of advantage for the hypothesis to pass through
-    :return:
+    :return: list with the best SentenceHypothesis
     """
-    hypotheses_hub = HypothesesHub()
-    for current_token_idx, each_tok in enumerate(data_analysis_dict['tokenized_input_sentence']):
-        if current_token_idx == 0:
-            # skip the first token which is <s>
-            continue
-        if current_token_idx == len(data_analysis_dict['tokenized_input_sentence']) - 1:
-            # skip the last token which is </s>
-            continue
-        # print(each_tok)
-        #  suffixes_hypotheses = data_analysis_dict['word_substitutions_candidates'].filter(start_idx=current_token_idx)
-        suffixes_hypotheses = SCAnalysisDictManager.filter_by_start_index(
-            data_anal_dict=data_analysis_dict, start_index=current_token_idx)
-        # print("suffixes_hypotheses")
-        # print(suffixes_hypotheses)
-
-        # suffixes hypotheses is a list of dicts with hypotheses that start at index: current_token_idx and finish at current_token_idx or later        
-        # expect that each s_hypothesis in hub has finish index (pointer of the final index position).
-        # Ex. suffixes_hypotheses: 
-        #         [{'tok_idx': 1,
-        #            'top_k_candidates': [{'advantage': 0.0, 'token_str': 'мамо'},
-        #             {'advantage': 0.8290032949621251, 'token_str': 'мама'},
-        #             {'advantage': 0.0682681172786106, 'token_str': 'маме'},
-        #             {'advantage': 1.4654415043774653, 'token_str': 'мало'},
-        #             {'advantage': 0.5788053066965881, 'token_str': 'мимо'}]},
-
-        #          {'tok_idx': (1, 3),
-        #              'tok_idx_start': 2,
-        #              'tok_idx_fin': 3,
-        #              'top_k_candidates': [{'token_str': 'мыла',
-        #                                    'token_merges': 1,
-        #                                    'error_score': -4.0,
-        #                                    'lm_scores_list': array([-4.99906474, -6.26263737]),
-        #                                    'summated_base_scores': array([-13.19048357, -11.76141742]),
-        #                                    'advantage': 9.690198885299584}]}
-        #         ]
-
-        #########################################################################################
-        # TODO filter suffixes which has low likelihood? (or top-1 suffix?)
-        # TODO add filtering by treshold?
-        # TODO but propogate base hypothesis
-        suffixes_hypotheses = deepcopy(suffixes_hypotheses)
-        for each_suffix_group_dict in suffixes_hypotheses:
-
-            filtered_top_k_candidates = []
-            for each_top_candidate in each_suffix_group_dict['top_k_candidates']:
-                if 'zero_hypothesis' in each_top_candidate and each_top_candidate['zero_hypothesis'] is True:
-                    filtered_top_k_candidates.append(each_top_candidate)
-                elif each_top_candidate['advantage'] < min_advantage_treshold:
-                    continue
-                else:
-                    # non zero hypothesis thta has minimal advantage for propagation
-                    filtered_top_k_candidates.append(each_top_candidate)
-            each_suffix_group_dict['top_k_candidates'] = filtered_top_k_candidates
-        #########################################################################################
-        # print("suffixes_hypotheses after filtering")
-        # print(suffixes_hypotheses)
-        hypotheses_hub = hypotheses_hub.fork_for_suffixes_segment_hypotheses(suffixes_hypotheses)
-        # print(str(current_token_idx) + " len(hypotheses_hub) " + str(len(hypotheses_hub)))
-
-        if len(hypotheses_hub)>HYPOHUB_MAX_ALLOWED_SIZE:
-            # prune hypotheses hub from bad hypotheses
-            hypotheses_hub.filter_the_best_hypotheses(top_k=HYPOHUB_MAX_ALLOWED_SIZE)
-        # TODO prune hypotheses that has finish_index==current_token_idx, but dont prune hypotheses that are longer
-
-    # TODO implement method:
-    the_best_sentence_hypothesis = hypotheses_hub.filter_the_best_hypotheses(top_k=1)
-    the_best_sentence_hypothesis = sorted(the_best_sentence_hypothesis,
-                                          key=lambda x: x.calc_advantage_score(), reverse=True)
-    return the_best_sentence_hypothesis
+    if isinstance(data_analysis_dict, HypothesesTable):
+        table = data_analysis_dict
+    else:
+        table = HypothesesTable.of_analysis_dict(data_analysis_dict)
+    sentence_length = len(table.tokenized_input_sentence)
+
+    # zero hypotheses pass through, others must have minimal advantage for propagation:
+    passed_rows_mask = table.zero_hypothesis | ~(table.advantage < min_advantage_treshold)
+
+    # hub of hypotheses: summated advantages, finish token indexes and nodes of back pointers
+    scores = np.zeros(1, dtype=np.float64)
+    finish_idxs = np.full(1, -1, dtype=np.int64)
+    hub_nodes = np.zeros(1, dtype=np.int64)
+    # node 0 is the null hypothesis, each node refers to a parent node and a row of the table:
+    nodes_parents = [np.full(1, -1, dtype=np.int64)]
+    nodes_rows = [np.full(1, -1, dtype=np.int64)]
+    nodes_count = 1
+
+    # skip the first token which is <s> and the last token which is </s>
+    for current_token_idx in range(1, sentence_length - 1):
+        rows = table.rows_starting_at(current_token_idx)
+        rows = rows[passed_rows_mask[rows]]
+
+        # hypotheses which finished before current token are forked for each suffix, longer
+        # hypotheses (with merged tokens) are propagated as is:
+        forked_mask = finish_idxs < current_token_idx
+        counts = np.where(forked_mask, len(rows), 1)
+        parents = np.repeat(np.arange(len(scores)), counts)
+        is_fork = np.repeat(forked_mask, counts)
+        suffix_positions = np.arange(len(parents)) - np.repeat(np.cumsum(counts) - counts, counts)
+        forked_rows = rows[suffix_positions[is_fork]]
+
+        scores = scores[parents]
+        scores[is_fork] += table.advantage[forked_rows]
+        finish_idxs = finish_idxs[parents]
+        finish_idxs[is_fork] = table.end[forked_rows]
+        hub_nodes = hub_nodes[parents]
+        new_nodes = np.arange(nodes_count, nodes_count + len(forked_rows))
+        nodes_parents.append(hub_nodes[is_fork])
+        nodes_rows.append(forked_rows)
+        hub_nodes[is_fork] = new_nodes
+        nodes_count += len(forked_rows)
+
+        if len(scores) > HYPOHUB_MAX_ALLOWED_SIZE:
+            # prune hypotheses hub from bad hypotheses (stable sorting keeps order of hub for
+            # hypotheses with equal advantages)
+            the_best = np.argsort(-scores, kind='stable')[:HYPOHUB_MAX_ALLOWED_SIZE]
+            scores = scores[the_best]
+            finish_idxs = finish_idxs[the_best]
+            hub_nodes = hub_nodes[the_best]
+
+    if not len(scores):
+        return []
+    nodes_parents = np.concatenate(nodes_parents)
+    nodes_rows = np.concatenate(nodes_rows)
+
+    best_idx = np.argsort(-scores, kind='stable')[0]
+    path_rows = []
+    node = hub_nodes[best_idx]
+    while node > 0:
+        path_rows.append(nodes_rows[node])
+        node = nodes_parents[node]
+    path_rows.reverse()
+
+    the_best_sentence_hypothesis = SentenceHypothesis("")
+    the_best_sentence_hypothesis.text = " ".join(table.token_str(row) for row in path_rows)
+    the_best_sentence_hypothesis.token_hypotheses = [table.candidate_dict(row)
+                                                     for row in path_rows]
+    the_best_sentence_hypothesis.spans = [(int(table.start[row]), int(table.end[row]))
+                                          for row in path_rows]
+    the_best_sentence_hypothesis.finish_idx = int(finish_idxs[best_idx])
+    return [the_best_sentence_hypothesis]
 
 
 class SCAnalysisDictManager():
@@ -141,7 +151,9 @@ class SCAnalysisDictManager():
     def filter_by_start_index(data_anal_dict, start_index):
         """Given a dict with data analysis it filters out word spans substitution candidates which start at specific token index 
         (integer measured in input sentence token space)"""
-        assert "word_substitutions_candidates" in data_anal_dict
+        if "word_substitutions_candidates" not in data_anal_dict:
+            # candidates of the corrector's analysis dicts are kept in HypothesesTable:
+            data_anal_dict = HypothesesTable.of_analysis_dict(data_anal_dict).to_analysis_dict()
         # results list is a list of dicts of hypotheses sets for particular spans (1token spans and 2-token spans, AS-IS)
         results_list = []
         for each_dict_set_of_candidates in data_anal_dict['word_substitutions_candidates']:
@@ -169,6 +181,9 @@ class SentenceHypothesis():
         self.text = ""
         # token hypotheses of the sentence
         self.token_hypotheses = []
+        # spans of input tokens (start token index, fin token index) which are substituted by
+        # token hypotheses (indexes of the input sentence wrapped with <s>, </s>)
+        self.spans = []
 
         # index of the last token in hypothesis
         self.finish_idx = -1
@@ -180,6 +195,26 @@ class SentenceHypothesis():
             adv_score += each_token_hypothesis['advantage']
         return adv_score
 
+    def tokens_alignment(self):
+        """
+        Alignment of input tokens and tokens of the hypothesis restored from spans of token
+        hypotheses, it is in the format of evaluate.align_sents, so it may be passed to
+        LettercaserForSpellchecker instead of alignment of strings
+
+        :return: tuple (list of tokens of the hypothesis, list of pairs ((i, j), (k, l))), where
+            input tokens i..j-1 (without <s>) are substituted by tokens k..l-1 of the hypothesis
+        """
+        tokens = []
+        alignment = []
+        for (start_tok_idx, fin_tok_idx), each_token_hypothesis in zip(self.spans,
+                                                                       self.token_hypotheses):
+            # split candidates have several tokens:
+            candidate_tokens = each_token_hypothesis['token_str'].split()
+            alignment.append(((start_tok_idx - 1, fin_tok_idx),
+                              (len(tokens), len(tokens) + len(candidate_tokens))))
+            tokens += candidate_tokens
+        return tokens, alignment
+
     def fork_for_each_suffix(self, suffixes_dicts_list):
         """Given a list of suffixes strings it forks the current hypotheses into several
         hypotheses for each suffix.
@@ -241,6 +276,7 @@ class SentenceHypothesis():
                     raise Exception("Wrong format! data: %s" % each_suffix_dict)
 
                 new_sentence_hypothesis.finish_idx = fin_tok_idx
+                new_sentence_hypothesis.spans.append((start_tok_idx, fin_tok_idx))
                 # ############################################################
 
                 hypotheses_list.append(new_sentence_hypothesis)
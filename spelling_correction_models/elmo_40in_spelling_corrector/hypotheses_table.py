@@ -0,0 +1,348 @@
+"""
+Columnar representation of substitution candidates of a sentence.
+
+Analysis dicts keep candidates as lists of dicts (see SCAnalysisDictManager), the table keeps
+the same data in NumPy columns (one row per candidate) plus a table of strings, so hypotheses
+search works with arrays instead of copying and sorting dicts.
+
+Usage:
+    table = HypothesesTable.from_analysis_dict(analysis_dict)
+    rows = table.rows_starting_at(1)
+    print(table.token_str(rows[0]), table.advantage[rows[0]])
+    analysis_dict['word_substitutions_candidates'] = table.to_word_substitutions_candidates()
+"""
+from copy import deepcopy
+from operator import itemgetter
+
+import numpy as np
+
+# keys of candidate dicts which are stored in columns, other keys are stored in extras
+COLUMN_KEYS = ('lm_advantage', 'advantage', 'error_score', 'zero_hypothesis', 'token_merges',
+               'token_splits', 'token_str')
+
+# keys of candidate dicts of the corrector in their order (see
+# ELMO40inSpellingCorrector.elmo_analysis_with_probable_candidates_reduction_dict_in_dict_out)
+CANDIDATE_KEYS = ('lm_advantage', 'advantage', 'token_str', 'zero_hypothesis', 'error_score',
+                  'token_merges', 'token_splits')
+
+# values of token_merges and token_splits columns for None
+NO_TOKEN_MERGES = -1
+NO_TOKEN_SPLITS = -1
+
+# key of analysis dicts of the corrector which keeps HypothesesTable of candidates instead of
+# word_substitutions_candidates
+HYPOTHESES_TABLE_KEY = 'hypotheses_table'
+
+
+class HypothesesTable():
+    """
+    Columns of candidates (rows are ordered by groups, then by candidates within a group as in
+    word_substitutions_candidates):
+        group: int32, index of group of the row
+        start, end: int32, indexes of the first and the last token of the substituted span
+        advantage, lm_advantage, error_score: float64 (NaN if the key is absent)
+        zero_hypothesis: bool
+        token_merges: int16 (NO_TOKEN_MERGES for None)
+        token_splits: int16 (NO_TOKEN_SPLITS for None)
+        token_str_id: int32, index in strings table
+
+    Groups (one per dict of word_substitutions_candidates):
+        group_start, group_end: int32, span of the group
+        group_is_merge: bool, if the group is a merge of tokens (tok_idx is a tuple)
+        group_source_segment_id: int32, index of source_segment_str in strings table or -1
+        group_offsets: int64, rows of group g are group_offsets[g]:group_offsets[g+1]
+
+    Keys which are not columns (case, comment, lm_scores_list, ...) are kept in a sparse dict
+    extras: {row: {key: value}}, key order of each row is kept in layouts table, so converters
+    restore dicts of the original format.
+    """
+
+    def __init__(self, tokenized_input_sentence=None):
+        self.tokenized_input_sentence = tokenized_input_sentence
+        self.strings = []
+        self.layouts = []
+        self.extras = {}
+
+    @classmethod
+    def from_analysis_dict(cls, analysis_dict):
+        """
+        Builds table from analysis dict
+
+        :param analysis_dict: dict SentenceAnalysisDictionary with word_substitutions_candidates
+        :return: HypothesesTable
+        """
+        builder = HypothesesTableBuilder(analysis_dict.get('tokenized_input_sentence'))
+        for each_group in analysis_dict['word_substitutions_candidates']:
+            builder.add_group(each_group['tok_idx'], each_group.get('source_segment_str'))
+            for each_candidate in each_group['top_k_candidates']:
+                builder.add_candidate_dict(each_candidate)
+        return builder.build()
+
+    @classmethod
+    def of_analysis_dict(cls, analysis_dict):
+        """
+        :param analysis_dict: dict SentenceAnalysisDictionary, with candidates in the table
+            (HYPOTHESES_TABLE_KEY) as analysis dicts of the corrector or in
+            word_substitutions_candidates
+        :return: HypothesesTable of the analysis dict (the stored one is not copied)
+        """
+        table = analysis_dict.get(HYPOTHESES_TABLE_KEY)
+        if table is None:
+            table = cls.from_analysis_dict(analysis_dict)
+        return table
+
+    def __len__(self):
+        return len(self.advantage)
+
+    @property
+    def nbytes(self):
+        """Bytes of columns (strings and extras are not counted)"""
+        return sum(column.nbytes for column in (
+            self.group_start, self.group_end, self.group_is_merge, self.group_source_segment_id,
+            self.group_offsets, self.group, self.start, self.end, self.advantage,
+            self.lm_advantage, self.error_score, self.zero_hypothesis, self.token_merges,
+            self.token_splits, self.token_str_id, self.layout))
+
+    def token_str(self, row):
+        return self.strings[self.token_str_id[row]]
+
+    def rows_starting_at(self, start_idx):
+        """
+        :param start_idx: int, token index
+        :return: ndarray of rows of spans starting at start_idx in the order of groups and
+            candidates
+        """
+        return np.flatnonzero(self.start == start_idx)
+
+    def candidate_dict(self, row):
+        """
+        Restores candidate dict of the row in the format of word_substitutions_candidates
+
+        :param row: int
+        :return: dict
+        """
+        extra = self.extras.get(row, {})
+        candidate_dict = {}
+        for key in self.layouts[self.layout[row]]:
+            if key == 'advantage':
+                candidate_dict[key] = float(self.advantage[row])
+            elif key == 'lm_advantage':
+                candidate_dict[key] = _nan_to_none(self.lm_advantage[row])
+            elif key == 'error_score':
+                candidate_dict[key] = _nan_to_none(self.error_score[row])
+            elif key == 'zero_hypothesis':
+                candidate_dict[key] = bool(self.zero_hypothesis[row])
+            elif key == 'token_merges':
+                token_merges = int(self.token_merges[row])
+                candidate_dict[key] = None if token_merges == NO_TOKEN_MERGES else token_merges
+            elif key == 'token_splits':
+                token_splits = int(self.token_splits[row])
+                candidate_dict[key] = None if token_splits == NO_TOKEN_SPLITS else token_splits
+            elif key == 'token_str':
+                candidate_dict[key] = self.token_str(row)
+            else:
+                candidate_dict[key] = extra[key]
+        return candidate_dict
+
+    def to_word_substitutions_candidates(self):
+        """
+        Converts table into the list of dicts format of analysis dicts (word_substitutions_candidates)
+
+        :return: list of dicts
+        """
+        groups = []
+        for group_idx in range(len(self.group_start)):
+            start = int(self.group_start[group_idx])
+            if self.group_is_merge[group_idx]:
+                end = int(self.group_end[group_idx])
+                group_dict = {'tok_idx': (start, end), 'tok_idx_start': start,
+                              'tok_idx_fin': end}
+            else:
+                group_dict = {'tok_idx': start}
+            source_segment_id = self.group_source_segment_id[group_idx]
+            if source_segment_id >= 0:
+                group_dict['source_segment_str'] = self.strings[source_segment_id]
+            group_dict['top_k_candidates'] = [
+                self.candidate_dict(row) for row in range(self.group_offsets[group_idx],
+                                                          self.group_offsets[group_idx + 1])]
+            groups.append(group_dict)
+        return groups
+
+    def to_analysis_dict(self):
+        """
+        :return: dict with tokenized_input_sentence and word_substitutions_candidates
+        """
+        return {'tokenized_input_sentence': self.tokenized_input_sentence,
+                'word_substitutions_candidates': self.to_word_substitutions_candidates()}
+
+
+def materialize_analysis_dict(analysis_dict):
+    """
+    Converts analysis dict with candidates in HypothesesTable (HYPOTHESES_TABLE_KEY) into a new
+    analysis dict with word_substitutions_candidates (the format of the reranker training,
+    JSONL shards and notebooks), values of other keys are copied
+
+    :param analysis_dict: dict SentenceAnalysisDictionary
+    :return: dict SentenceAnalysisDictionary
+    """
+    materialized_dict = {key: deepcopy(value) for key, value in analysis_dict.items()
+                         if key != HYPOTHESES_TABLE_KEY}
+    if HYPOTHESES_TABLE_KEY in analysis_dict:
+        materialized_dict['word_substitutions_candidates'] = \
+            analysis_dict[HYPOTHESES_TABLE_KEY].to_word_substitutions_candidates()
+    return materialized_dict
+
+
+class HypothesesTableBuilder():
+    """
+    Builds HypothesesTable from candidates which are added group by group, so candidates of the
+    analysis are not kept as dicts.
+
+    Usage:
+        builder = HypothesesTableBuilder(tokenized_input_sentence)
+        builder.add_group(1)
+        builder.add_candidate('мама', advantage=2.5, lm_advantage=6.5, error_score=-4.0)
+        builder.add_candidate_dict(zero_hypothesis_dict)
+        builder.sort_group_by_advantage()
+        table = builder.build()
+    """
+
+    def __init__(self, tokenized_input_sentence=None):
+        self.table = HypothesesTable(tokenized_input_sentence)
+        # indexes of strings and layouts of the table (they are not kept by the table):
+        self._string_ids = {}
+        self._layout_ids = {}
+        self._groups = []
+        self._group_offsets = [0]
+        self._columns = {key: [] for key in COLUMN_KEYS}
+        self._layout = []
+        # rows of the last group: tuples of values of COLUMN_KEYS, keys and extra dict
+        self._group_rows = []
+
+    def add_group(self, tok_idx, source_segment_str=None):
+        """
+        Starts the next group of candidates
+
+        :param tok_idx: int index of the token or tuple (start, end) of merged tokens
+        :param source_segment_str: str, source segment of merged tokens
+        """
+        self._flush_group()
+        source_segment_id = -1
+        if source_segment_str is not None:
+            source_segment_id = self._intern(source_segment_str)
+        self._groups.append((tok_idx, source_segment_id))
+
+    def add_candidate(self, token_str, advantage, lm_advantage=None, error_score=None,
+                      zero_hypothesis=False, token_merges=0, token_splits=None, extra=None,
+                      keys=CANDIDATE_KEYS):
+        """
+        Adds candidate to the last group
+
+        :param extra: dict of keys which are not columns (case, comment, ...)
+        :param keys: tuple of keys of the candidate dict in their order (it is restored by
+            candidate_dict)
+        """
+        self._group_rows.append((lm_advantage, advantage, error_score, zero_hypothesis,
+                                 token_merges, token_splits, token_str, keys, extra))
+
+    def add_candidate_dict(self, candidate_dict):
+        """Adds candidate dict of word_substitutions_candidates format to the last group"""
+        extra = {key: value for key, value in candidate_dict.items() if key not in COLUMN_KEYS}
+        self.add_candidate(candidate_dict['token_str'], candidate_dict.get('advantage'),
+                           lm_advantage=candidate_dict.get('lm_advantage'),
+                           error_score=candidate_dict.get('error_score'),
+                           zero_hypothesis=candidate_dict.get('zero_hypothesis') is True,
+                           token_merges=candidate_dict.get('token_merges'),
+                           token_splits=candidate_dict.get('token_splits'),
+                           extra=extra or None, keys=tuple(candidate_dict.keys()))
+
+    def sort_group_by_advantage(self):
+        """
+        Sorts candidates of the last group by advantage as
+        sorted(candidates, key=lambda x: x['advantage'], reverse=True)
+        """
+        self._group_rows.sort(key=itemgetter(1), reverse=True)
+
+    def _intern(self, string):
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.table.strings)
+            self._string_ids[string] = string_id
+            self.table.strings.append(string)
+        return string_id
+
+    def _layout_id(self, keys):
+        layout_id = self._layout_ids.get(keys)
+        if layout_id is None:
+            layout_id = len(self.table.layouts)
+            self._layout_ids[keys] = layout_id
+            self.table.layouts.append(keys)
+        return layout_id
+
+    def _flush_group(self):
+        if not self._groups:
+            return
+        columns = self._columns
+        for (lm_advantage, advantage, error_score, zero_hypothesis, token_merges, token_splits,
+             token_str, keys, extra) in self._group_rows:
+            if extra:
+                self.table.extras[len(self._layout)] = extra
+            columns['lm_advantage'].append(_float_or_nan(lm_advantage))
+            columns['advantage'].append(_float_or_nan(advantage))
+            columns['error_score'].append(_float_or_nan(error_score))
+            columns['zero_hypothesis'].append(zero_hypothesis is True)
+            columns['token_merges'].append(NO_TOKEN_MERGES if token_merges is None
+                                           else token_merges)
+            columns['token_splits'].append(NO_TOKEN_SPLITS if token_splits is None
+                                           else token_splits)
+            columns['token_str'].append(self._intern(token_str))
+            self._layout.append(self._layout_id(keys))
+        self._group_rows = []
+        self._group_offsets.append(len(self._layout))
+
+    def build(self):
+        """
+        :return: HypothesesTable
+        """
+        self._flush_group()
+        table = self.table
+        group_start, group_end, group_is_merge, group_source_segment_id = [], [], [], []
+        for tok_idx, source_segment_id in self._groups:
+            if isinstance(tok_idx, tuple):
+                group_start.append(tok_idx[0])
+                group_end.append(tok_idx[1])
+                group_is_merge.append(True)
+            else:
+                group_start.append(tok_idx)
+                group_end.append(tok_idx)
+                group_is_merge.append(False)
+            group_source_segment_id.append(source_segment_id)
+
+        table.group_start = np.array(group_start, dtype=np.int32)
+        table.group_end = np.array(group_end, dtype=np.int32)
+        table.group_is_merge = np.array(group_is_merge, dtype=bool)
+        table.group_source_segment_id = np.array(group_source_segment_id, dtype=np.int32)
+        table.group_offsets = np.array(self._group_offsets, dtype=np.int64)
+
+        table.group = np.repeat(np.arange(len(self._groups), dtype=np.int32),
+                                np.diff(table.group_offsets))
+        table.start = table.group_start[table.group]
+        table.end = table.group_end[table.group]
+        columns = self._columns
+        table.advantage = np.array(columns['advantage'], dtype=np.float64)
+        table.lm_advantage = np.array(columns['lm_advantage'], dtype=np.float64)
+        table.error_score = np.array(columns['error_score'], dtype=np.float64)
+        table.zero_hypothesis = np.array(columns['zero_hypothesis'], dtype=bool)
+        table.token_merges = np.array(columns['token_merges'], dtype=np.int16)
+        table.token_splits = np.array(columns['token_splits'], dtype=np.int16)
+        table.token_str_id = np.array(columns['token_str'], dtype=np.int32)
+        table.layout = np.array(self._layout, dtype=np.int32)
+        return table
+
+
+def _float_or_nan(value):
+    return np.nan if value is None else value
+
+
+def _nan_to_none(value):
+    return None if np.isnan(value) else float(value)
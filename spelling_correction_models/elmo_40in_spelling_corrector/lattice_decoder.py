@@ -0,0 +1,117 @@
+"""
+Lattice decoder of sentence hypotheses.
+
+Advantages of hypotheses are additive over substituted spans, so the search of the best sentence
+hypothesis is a search of the longest path in a DAG: nodes are token boundaries (node i means
+that tokens up to i-th are substituted), each candidate of a span (start, end) is an edge from
+node start-1 to node end weighted by its advantage. Unlike HypothesesHub the decoder is exact
+(no pruning) and it takes O(edges * k * log(k)) for k best hypotheses: partial paths are stored as
+back-pointers and rows of paths are rebuilt only for the k best hypotheses and for comparison of
+paths with equal scores. Other additive scores of candidates (ex.: scores of the reranker) may be
+weights of edges instead of advantages.
+
+Usage:
+    hypotheses = decode_lattice(analysis_dict, min_advantage_treshold=1.0, k_best=5)
+    print(hypotheses[0].text)
+"""
+import heapq
+
+from .helper_fns import SentenceHypothesis
+from .hypotheses_table import HypothesesTable
+
+
+class _PathPointer():
+    """
+    Back-pointer of a partial path: the last row of the path and the pointer of its prefix.
+    Pointers are ordered as tuples of rows of their paths (they are compared only when scores
+    of paths are equal)
+    """
+    __slots__ = ('prefix', 'row')
+
+    def __init__(self, prefix, row):
+        self.prefix = prefix
+        self.row = row
+
+    def rows(self):
+        """
+        :return: tuple of rows of the path
+        """
+        rows = []
+        pointer = self
+        while pointer is not None:
+            rows.append(pointer.row)
+            pointer = pointer.prefix
+        return tuple(reversed(rows))
+
+    def __lt__(self, other):
+        return self.rows() < other.rows()
+
+
+def build_lattice(table, min_advantage_treshold=0.0, edge_scores=None):
+    """
+    Builds edges of the lattice of a sentence
+
+    :param table: HypothesesTable of the sentence
+    :param min_advantage_treshold: minimal advantage of a non zero hypothesis for its edge
+    :param edge_scores: ndarray of weights of rows of the table (ex.: scores of a reranker), if
+        None then advantages are weights
+    :return: tuple (final_node, incoming_edges), where incoming_edges is a list (by node) of
+        lists of edges (source_node, row, weight) ordered by rows of the table
+    """
+    if edge_scores is None:
+        edge_scores = table.advantage
+    # <s> and </s> are not substituted:
+    final_node = len(table.tokenized_input_sentence) - 2
+    incoming_edges = [[] for _ in range(final_node + 1)]
+    passed_rows_mask = table.zero_hypothesis | ~(table.advantage < min_advantage_treshold)
+    for row in range(len(table)):
+        start = int(table.start[row])
+        end = int(table.end[row])
+        if start < 1 or end > final_node or not passed_rows_mask[row]:
+            continue
+        incoming_edges[end].append((start - 1, row, float(edge_scores[row])))
+    return final_node, incoming_edges
+
+
+def decode_lattice(data_analysis_dict, min_advantage_treshold=0.0, k_best=1, edge_scores=None):
+    """
+    Finds k best sentence hypotheses.
+
+    Scores of paths are summated from left to right as in SentenceHypothesis, hypotheses with
+    equal scores are ordered as in HypothesesHub (by rows of candidates along the path), so the
+    top-1 hypothesis reproduces estimate_the_best_s_hypotheses.
+
+    :param data_analysis_dict: dict SentenceAnalysisDictionary or HypothesesTable
+    :param min_advantage_treshold: minimal value of advantage for the hypothesis to pass through
+    :param k_best: int, number of hypotheses to return
+    :param edge_scores: ndarray of scores of rows of the table which are summated along paths
+        instead of advantages (see build_lattice)
+    :return: list of SentenceHypothesis sorted by score of the path (best first)
+    """
+    if isinstance(data_analysis_dict, HypothesesTable):
+        table = data_analysis_dict
+    else:
+        table = HypothesesTable.of_analysis_dict(data_analysis_dict)
+    final_node, incoming_edges = build_lattice(table, min_advantage_treshold, edge_scores)
+
+    # k best partial paths for each node: lists of tuples (score, back-pointer of the path), the
+    # empty path of node 0 has no pointer:
+    best_paths = [[] for _ in range(final_node + 1)]
+    best_paths[0] = [(0.0, None)]
+    for node in range(1, final_node + 1):
+        candidates = ((score + weight, _PathPointer(pointer, row))
+                      for source_node, row, weight in incoming_edges[node]
+                      for score, pointer in best_paths[source_node])
+        best_paths[node] = heapq.nsmallest(k_best, candidates, key=lambda item: (-item[0], item[1]))
+
+    hypotheses = []
+    for score, pointer in best_paths[final_node]:
+        path = pointer.rows() if pointer is not None else ()
+        sentence_hypothesis = SentenceHypothesis("")
+        sentence_hypothesis.text = " ".join(table.token_str(row) for row in path)
+        sentence_hypothesis.token_hypotheses = [table.candidate_dict(row) for row in path]
+        sentence_hypothesis.spans = [(int(table.start[row]), int(table.end[row])) for row in path]
+        if path:
+            sentence_hypothesis.finish_idx = int(table.end[path[-1]])
+        hypotheses.append(sentence_hypothesis)
+    return hypotheses
@@ -0,0 +1,260 @@
+"""
+Asyncio front end for spelling correctors which collects concurrent single sentence requests
+into micro-batches, so that concurrent requests share forward passes of the language model.
+
+Usage:
+    server = MicroBatchingSpellingCorrectorServer(ELMO40in2SpellingCorrector(), max_latency=0.005)
+    await server.start()
+    corrected = await server.correct("мама мыло раму")
+    print(server.metrics())
+    await server.stop()
+
+Degraded mode: if a fast fallback corrector is given (ex.: KenlmSpellingCorrector), batches
+formed while the queue is deeper than degrade_queue_depth (the main corrector is saturated) are
+corrected by the fallback:
+    server = MicroBatchingSpellingCorrectorServer(
+        ELMO40in2SpellingCorrector(), fallback_spelling_corrector=KenlmSpellingCorrector(...),
+        degrade_queue_depth=256, fallback_min_advantage_treshold=2.0)
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# how long (seconds) the first request of a micro-batch waits for companions:
+DEFAULT_MAX_LATENCY = 0.005
+
+# max number of sentences in a micro-batch:
+DEFAULT_MAX_BATCH_SIZE = 32
+
+# max number of requests waiting in the queue, when it is full new requests wait for a free slot
+# (or are rejected if reject_when_full is set):
+DEFAULT_MAX_QUEUE_SIZE = 1024
+
+
+class MicroBatchingSpellingCorrectorServer():
+    """
+    Wraps a spelling corrector with batchy interface (process_sentences_batch) with a queue of
+    requests.
+
+    Batches are formed by a single background task: it takes the first request from the queue and
+    then waits for more requests during max_latency (or until max_batch_size requests are
+    collected). The batch is corrected in a worker thread, so the event loop keeps accepting
+    requests while the LM is busy and the next batch grows with the load.
+    """
+
+    def __init__(self, spelling_corrector, max_latency=DEFAULT_MAX_LATENCY,
+                 max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+                 reject_when_full=False, min_advantage_treshold=1.0,
+                 fallback_spelling_corrector=None, degrade_queue_depth=None,
+                 fallback_min_advantage_treshold=1.0):
+        """
+
+        :param spelling_corrector: instance with process_sentences_batch method
+            (ex.: ELMO40in2SpellingCorrector)
+        :param max_latency: float, seconds to wait for requests to fill a micro-batch
+        :param max_batch_size: int, max number of sentences in a micro-batch
+        :param max_queue_size: int, max number of pending requests (backpressure)
+        :param reject_when_full: if true then requests which do not fit into the queue raise
+            asyncio.QueueFull, otherwise they wait for a free slot
+        :param min_advantage_treshold: threshold passed to process_sentences_batch of
+            spelling_corrector
+        :param fallback_spelling_corrector: optional fast corrector with process_sentences_batch
+            method for degraded mode
+        :param degrade_queue_depth: int, if the queue depth is not less than it when a batch is
+            formed then the batch is corrected by fallback_spelling_corrector (None disables
+            degraded mode)
+        :param fallback_min_advantage_treshold: threshold passed to process_sentences_batch of
+            fallback_spelling_corrector, it is in units of the fallback corrector scores (ex.:
+            log10 probability of KenLM instead of ELMO advantage)
+        """
+        self.spelling_corrector = spelling_corrector
+        self.max_latency = max_latency
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.reject_when_full = reject_when_full
+        self.min_advantage_treshold = min_advantage_treshold
+        self.fallback_spelling_corrector = fallback_spelling_corrector
+        self.degrade_queue_depth = degrade_queue_depth
+        self.fallback_min_advantage_treshold = fallback_min_advantage_treshold
+
+        self._queue = None
+        self._batching_task = None
+        # the corrector (and the LM under it) is not thread safe, so batches are processed
+        # one by one by a single worker:
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self._counters = {
+            'requests': 0,
+            'rejected_requests': 0,
+            'batches': 0,
+            'batched_sentences': 0,
+            'degraded_batches': 0,
+            'degraded_sentences': 0,
+            'max_queue_depth': 0,
+            'last_batch_size': 0,
+            'last_batch_seconds': 0.0,
+        }
+
+    async def start(self):
+        """Starts the background task which forms and processes micro-batches"""
+        if self._batching_task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._batching_task = asyncio.ensure_future(self._batching_loop())
+
+    async def stop(self):
+        """
+        Stops batching, pending requests are cancelled, as well as requests of the batch which is
+        being collected or corrected (the worker thread finishes the batch, its outputs are
+        dropped)
+        """
+        if self._batching_task is None:
+            return
+        self._batching_task.cancel()
+        try:
+            await self._batching_task
+        except asyncio.CancelledError:
+            pass
+        self._batching_task = None
+
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+
+    async def correct(self, sentence):
+        """
+        Corrects one sentence, the sentence is processed in a micro-batch together with
+        concurrent requests.
+
+        :param sentence: str
+        :return: str, corrected sentence
+        """
+        if self._batching_task is None:
+            raise RuntimeError("Server is not started, call start() first")
+
+        future = asyncio.get_running_loop().create_future()
+        self._counters['requests'] += 1
+        if self.reject_when_full:
+            try:
+                self._queue.put_nowait((sentence, future))
+            except asyncio.QueueFull:
+                self._counters['rejected_requests'] += 1
+                raise
+        else:
+            await self._queue.put((sentence, future))
+        self._counters['max_queue_depth'] = max(self._counters['max_queue_depth'],
+                                                self._queue.qsize())
+        return await future
+
+    async def correct_batch(self, sentences):
+        """Corrects a list of sentences as independent concurrent requests"""
+        return await asyncio.gather(*[self.correct(each_sentence) for each_sentence in sentences])
+
+    async def _collect_batch(self, batch):
+        """
+        Waits for the first request and then collects more requests during max_latency
+
+        :param batch: list to which tuples (sentence, future) are appended (requests which are
+            already taken from the queue stay there if the batching task is cancelled)
+        """
+        loop = asyncio.get_running_loop()
+        batch.append(await self._queue.get())
+        deadline = loop.time() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _batching_loop(self):
+        batch = []
+        try:
+            while True:
+                batch = []
+                await self._collect_batch(batch)
+                await self._process_batch(batch)
+        finally:
+            # requests of the batch which was collected or corrected when the loop was stopped:
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
+
+    async def _process_batch(self, batch):
+        """
+        Corrects the micro-batch in the worker thread and resolves futures of requests
+
+        :param batch: list of tuples (sentence, future)
+        """
+        # requests may be cancelled by clients while waiting:
+        batch = [(sentence, future) for sentence, future in batch if not future.done()]
+        if not batch:
+            return
+        sentences = [sentence for sentence, _ in batch]
+        spelling_corrector = self.spelling_corrector
+        if self._is_saturated():
+            spelling_corrector = self.fallback_spelling_corrector
+            self._counters['degraded_batches'] += 1
+            self._counters['degraded_sentences'] += len(batch)
+
+        start_time = time.time()
+        try:
+            outputs = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._correct_sentences, sentences, spelling_corrector)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._counters['batches'] += 1
+            self._counters['batched_sentences'] += len(batch)
+            self._counters['last_batch_size'] = len(batch)
+            self._counters['last_batch_seconds'] = time.time() - start_time
+
+        for (_, future), each_output in zip(batch, outputs):
+            if not future.done():
+                future.set_result(each_output)
+
+    def _is_saturated(self):
+        """
+        :return: bool, if the next batch must be corrected in degraded mode
+        """
+        return (self.fallback_spelling_corrector is not None and
+                self.degrade_queue_depth is not None and
+                self.queue_depth() >= self.degrade_queue_depth)
+
+    def _correct_sentences(self, sentences, spelling_corrector=None):
+        """Synchronous correction of a micro-batch (executed in the worker thread)"""
+        if spelling_corrector is None or spelling_corrector is self.spelling_corrector:
+            spelling_corrector = self.spelling_corrector
+            min_advantage_treshold = self.min_advantage_treshold
+        else:
+            min_advantage_treshold = self.fallback_min_advantage_treshold
+        return spelling_corrector.process_sentences_batch(
+            sentences, min_advantage_treshold=min_advantage_treshold)
+
+    def queue_depth(self):
+        """
+        :return: int, number of requests waiting for a micro-batch
+        """
+        if self._queue is None:
+            return 0
+        return self._queue.qsize()
+
+    def metrics(self):
+        """
+        :return: dict with queue depth and batching counters
+        """
+        metrics = dict(self._counters)
+        metrics['queue_depth'] = self.queue_depth()
+        if metrics['batches']:
+            metrics['mean_batch_size'] = metrics['batched_sentences'] / metrics['batches']
+        else:
+            metrics['mean_batch_size'] = 0.0
+        return metrics
@@ -0,0 +1,280 @@
+"""
+Spelling corrector based on KenLM n-gram language model (without ELMO).
+
+It has the same batchy interface as ELMO40in2SpellingCorrector (process_sentences_batch) and the
+same candidates: levenshtein candidates of tokens (1->1, including splits) and of merged pairs of
+tokens (2->1). Hypotheses are searched by a beam over the lattice of token boundaries, where
+every hypothesis keeps KenLM state, so n-gram scores of candidates are calculated in the context
+of the hypothesis.
+
+It is 10-100x faster than ELMO correctors at lower quality, so it may be used as a degraded mode
+of serving (see MicroBatchingSpellingCorrectorServer fallback_spelling_corrector).
+
+Usage:
+    sc = KenlmSpellingCorrector(language_model_path="/path/to/model.binary")
+    print(sc.process_sentences_batch(["Мама мыла раду"]))
+"""
+import heapq
+import os
+from operator import itemgetter
+
+import kenlm
+from nltk.tokenize import word_tokenize
+
+from lettercaser import LettercaserForSpellchecker
+from dp_components.kenlm_elector import KenlmElector
+from dp_components.levenshtein_searcher_component import LevenshteinSearcherComponent
+from language_models.utils import detokenize, yo_substitutor
+# helpers shared with ELMO correctors, they are imported without ELMO LM stack:
+from spelling_correction_models.utils import LEVENSHTEIN_MAX_DIST, OOV_PENALTY, \
+    ERROR_SCORE_FOR_MERGE, TokenClassifier, merge_segments, split_multisentences, \
+    group_multisentences
+
+SELF_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(os.path.dirname(SELF_DIR))
+
+# max number of hypotheses kept at each token boundary:
+DEFAULT_BEAM_SIZE = 8
+
+
+class KenlmSpellingCorrector():
+    """
+    Spelling corrector which scores candidates with KenLM n-gram LM.
+
+    Score of a sentence hypothesis is the sum of KenLM log10 probability of the hypothesis, error
+    scores of candidates and penalty min_advantage_treshold for each fix, so a fix is made only if
+    it increases the score of the sentence by more than min_advantage_treshold (as in lattice
+    decoding of ELMO correctors).
+    """
+
+    def __init__(self, kenlm_elector=None, spelling_correction_candidates_generator=None,
+                 language_model_path=None, data_path=None, beam_size=DEFAULT_BEAM_SIZE,
+                 load_method=None, frozen_words_regex_patterns=None):
+        """
+
+        :param kenlm_elector: KenlmElector instance, its KenLM model is used for scoring
+        :param spelling_correction_candidates_generator: LevenshteinSearcherComponent instance
+        :param language_model_path: path to KenLM model, used if kenlm_elector is not specified
+        :param data_path: path to data dir with wordforms.txt for default candidates generator
+        :param beam_size: max number of hypotheses kept at each token boundary
+        :param load_method: load method of KenLM model (see kenlm_loader.LOAD_METHODS)
+        :param frozen_words_regex_patterns: list of words regexp patterns which are prohibited
+            for correction
+        """
+        print("Init LetterCaser.")
+        self._lettercaser = LettercaserForSpellchecker()
+        print("Init language_model.")
+        if kenlm_elector:
+            self.kenlm_elector = kenlm_elector
+        else:
+            assert language_model_path, "language_model_path or kenlm_elector must be specified"
+            self.kenlm_elector = KenlmElector(language_model_path, beam_size=beam_size,
+                                              load_method=load_method)
+        self.lm = self.kenlm_elector.lm
+        self.beam_size = beam_size
+
+        print("Init spelling_correction_candidates_generator.")
+        self._data_path = data_path or os.path.join(ROOT_DIR, 'data')
+        if spelling_correction_candidates_generator:
+            self.sccg = spelling_correction_candidates_generator
+        else:
+            self.sccg = self._init_sccg()
+
+        # pre-classifier of frozen words, punctuation and numbers (the same as in ELMO correctors):
+        self.token_classifier = TokenClassifier(frozen_words_regex_patterns)
+        print("Initialization Completed.")
+
+    def _init_sccg(self):
+        """
+        Initializes levenshtein candidates generator with wordforms dictionary of data path
+        """
+        with open(os.path.join(self._data_path, "wordforms.txt"), "r") as dict_file:
+            words_dict = dict_file.read().splitlines()
+        return LevenshteinSearcherComponent(words=words_dict, max_distance=LEVENSHTEIN_MAX_DIST,
+                                            oov_penalty=OOV_PENALTY)
+
+    def preprocess_sentence(self, sentence):
+        return yo_substitutor(sentence.lower())
+
+    def is_fixed_token(self, token):
+        """
+        :param token: str, cased token
+        :return: bool, if the token is not corrected (frozen word, punctuation or number)
+        """
+        return self.token_classifier.classify(token) is not None
+
+    def precompute_candidates(self, tokenized_sentences, tokenized_cased_sentences):
+        """
+        Generates levenshtein candidates for tokens (1->1) and merged pairs of tokens (2->1)
+
+        :param tokenized_sentences: list of lowercased tokenized sentences
+        :param tokenized_cased_sentences: list of the same sentences before lowercasing
+        :return: list of dicts:
+            {
+                'tokens_candidates': list of candidates lists for each token,
+                'merges_candidates': dict {tok_idx: candidates list for merge of tokens
+                    tok_idx-1 and tok_idx}
+            }
+        """
+        analyzed_sentences = []
+        fixed_masks = []
+        merges_keys = []
+        merges_strs = []
+        for sent_idx, (each_sent, each_cased_sent) in enumerate(zip(tokenized_sentences,
+                                                                    tokenized_cased_sentences)):
+            fixed_mask = [self.is_fixed_token(each_tok) for each_tok in each_cased_sent]
+            fixed_masks.append(fixed_mask)
+            analyzed_sentences.append([each_tok for each_tok, is_fixed in zip(each_sent, fixed_mask)
+                                       if not is_fixed])
+            # merge segments are enumerated over the sentence wrapped with <s>, </s>, so tok_idx
+            # of a merge is the index of its second token plus 1:
+            for tok_idx, merge_hypothesis_str, _ in merge_segments(["<s>"] + each_sent + ["</s>"]):
+                if fixed_mask[tok_idx - 2] or fixed_mask[tok_idx - 1]:
+                    continue
+                merges_keys.append((sent_idx, tok_idx - 1))
+                merges_strs.append([merge_hypothesis_str])
+        analyzed_candidates = self.sccg(analyzed_sentences) if analyzed_sentences else []
+        merges_candidates = self.sccg(merges_strs) if merges_strs else []
+
+        results = []
+        for each_sent, fixed_mask, each_candidates in zip(tokenized_sentences, fixed_masks,
+                                                          analyzed_candidates):
+            each_candidates = iter(each_candidates)
+            results.append({
+                'tokens_candidates': [[(0.0, each_tok)] if is_fixed else next(each_candidates)
+                                      for each_tok, is_fixed in zip(each_sent, fixed_mask)],
+                'merges_candidates': {}})
+        for (sent_idx, tok_idx), each_merge_candidates in zip(merges_keys, merges_candidates):
+            # merged token must be known to the LM (as in generate_Nto1_hypotheses of ELMO):
+            results[sent_idx]['merges_candidates'][tok_idx] = [
+                (error_score + ERROR_SCORE_FOR_MERGE, candidate_str)
+                for error_score, candidate_str in each_merge_candidates[0]
+                if candidate_str in self.lm]
+        return results
+
+    def _extend(self, beam_item, candidate_str, error_score, fix_penalty):
+        """
+        Extends hypothesis of the beam with a candidate
+
+        :return: tuple (score, state, back-pointer)
+        """
+        score, state, node = beam_item
+        words = candidate_str.split()
+        for word in words:
+            out_state = kenlm.State()
+            score += self.lm.BaseScore(state, word, out_state)
+            state = out_state
+        return score + error_score - fix_penalty, state, (node, words)
+
+    def decode_sentence(self, tokenized_sentence, candidates, min_advantage_treshold=1.0):
+        """
+        Beam search of the best hypothesis over the lattice of token boundaries: node i means
+        that i tokens are corrected, 1->1 candidates of token i are edges from node i to i+1,
+        merges of tokens i, i+1 are edges from node i to i+2. Hypotheses in a node are
+        recombined by KenLM state.
+
+        :param tokenized_sentence: list of tokens
+        :param candidates: candidates of the sentence (see precompute_candidates)
+        :param min_advantage_treshold: penalty for each fix
+        :return: tuple (list of tokens of the best hypothesis, its score)
+        """
+        state = kenlm.State()
+        self.lm.BeginSentenceWrite(state)
+        tokens_count = len(tokenized_sentence)
+        # expansions of nodes: dicts {state: (score, state, back-pointer)}
+        expansions = [{} for _ in range(tokens_count + 1)]
+        expansions[0][state] = (0.0, state, None)
+        for node in range(tokens_count):
+            beam = heapq.nlargest(self.beam_size, expansions[node].values(), key=itemgetter(0))
+            edges = [(node + 1, error_score, candidate_str, tokenized_sentence[node])
+                     for error_score, candidate_str in candidates['tokens_candidates'][node]]
+            if node + 1 < tokens_count:
+                source_segment_str = " ".join(tokenized_sentence[node:node + 2])
+                edges += [(node + 2, error_score, candidate_str, source_segment_str)
+                          for error_score, candidate_str in candidates['merges_candidates'].get(
+                              node + 1, [])]
+            for beam_item in beam:
+                for target_node, error_score, candidate_str, source_str in edges:
+                    fix_penalty = 0.0 if candidate_str == source_str else min_advantage_treshold
+                    extension = self._extend(beam_item, candidate_str, error_score, fix_penalty)
+                    recombined = expansions[target_node].get(extension[1])
+                    if recombined is None or extension[0] > recombined[0]:
+                        expansions[target_node][extension[1]] = extension
+
+        best_score, best_state, best_node = max(
+            expansions[tokens_count].values(), key=itemgetter(0))
+        best_score += self.lm.BaseScore(best_state, "</s>", kenlm.State())
+        return KenlmElector._backtrace(best_node), best_score
+
+    def _restore_sentence(self, input_sentence, hypothesis_tokens):
+        """
+        Restores capitalization of the input sentence in hypothesis and detokenizes it
+        """
+        output_sentence_tokens = self._lettercaser([word_tokenize(input_sentence)],
+                                                   [hypothesis_tokens])[0]
+        return detokenize(output_sentence_tokens)
+
+    def prepare_analysis_dict_for_sentences_batch(self, sentences):
+        """
+        Generates candidates for a batch of sentences
+
+        :param sentences: list of str
+        :return: list of dicts with input_sentence, tokenized_input_sentence and candidates
+        """
+        tokenized_cased_sentences = [word_tokenize(each_sentence) for each_sentence in sentences]
+        tokenized_sentences = [[self.preprocess_sentence(each_tok) for each_tok in each_sent]
+                               for each_sent in tokenized_cased_sentences]
+        candidates_batch = self.precompute_candidates(tokenized_sentences,
+                                                      tokenized_cased_sentences)
+        return [{
+            'input_sentence': each_sentence,
+            'tokenized_input_sentence': each_tokenized,
+            'candidates': each_candidates
+        } for each_sentence, each_tokenized, each_candidates in zip(sentences, tokenized_sentences,
+                                                                  candidates_batch)]
+
+    def process_sentences_batch(self, sentences, min_advantage_treshold=1.0,
+                                supply_anal_dict=False, multisentences=False, **kwargs):
+        """
+        Interface method for batchy estimation of corrections (the same as in
+        ELMO40in2SpellingCorrector, arguments of LM batching are ignored)
+
+        :param sentences: list of input sentences
+        :param min_advantage_treshold: min advantage (in log10 probability of KenLM) of each fix
+        :param supply_anal_dict: if true then returns anal dicts for all sentences
+        :param multisentences: if true then each element of batch may be a multiple sentence
+            string, so we preprocess them by splitting into sentences.
+        :return: list of corrected sentences
+        """
+        if multisentences:
+            sentences, list_of_lengths = split_multisentences(sentences)
+
+        anal_dicts = self.prepare_analysis_dict_for_sentences_batch(sentences)
+        output_sentences = []
+        for each_data in anal_dicts:
+            hypothesis_tokens, score = self.decode_sentence(
+                each_data['tokenized_input_sentence'], each_data['candidates'],
+                min_advantage_treshold=min_advantage_treshold)
+            each_data['hypothesis_tokens'] = hypothesis_tokens
+            each_data['score'] = score
+            output_sentences.append(self._restore_sentence(each_data['input_sentence'],
+                                                           hypothesis_tokens))
+
+        if multisentences:
+            output_sentences = [" ".join(each_group) for each_group in
+                                group_multisentences(output_sentences, list_of_lengths)]
+            anal_dicts = group_multisentences(anal_dicts, list_of_lengths)
+
+        if supply_anal_dict:
+            return output_sentences, anal_dicts
+        else:
+            return output_sentences
+
+    def process_sentence(self, sentence):
+        return self.process_sentences_batch([sentence])[0]
+
+    def close(self):
+        self.kenlm_elector.close()
+
+    def __call__(self, *args, **kwargs):
+        return self.process_sentences_batch(*args, **kwargs)
@@ -0,0 +1,165 @@
+"""
+Helpers shared by spelling correctors (ELMO40in2SpellingCorrector, KenlmSpellingCorrector):
+constants of candidates generation, pre-classification of tokens whose outcome is fixed,
+segments of 2->1 merges and splitting of multi-sentence inputs.
+
+The module depends neither on LMs nor on deeppavlov, so light correctors (ex.: the KenLM
+fallback of MicroBatchingSpellingCorrectorServer) do not load the ELMO stack.
+"""
+import re
+
+from utilities.lru_cache import LRUCache
+
+# weighted distance limit for levenshtein search:
+LEVENSHTEIN_MAX_DIST = 1.0
+
+# out of vocabulary penalty
+OOV_PENALTY = -1.0
+
+# increment of the logit for merging 2tokens->1token:
+ERROR_SCORE_FOR_MERGE = -2.0
+
+# classes of tokens whose outcome is fixed, so they are not analyzed by candidates generator and
+# LM (see TokenClassifier):
+TOKEN_CLASS_FROZEN = "frozen"
+TOKEN_CLASS_PUNCTUATION = "punctuation"
+TOKEN_CLASS_NUMBER = "number"
+
+PUNCTUATION_TOKEN_REGEXP = re.compile(r"^[^\w\s]+$")
+NUMBER_TOKEN_REGEXP = re.compile(r"^\d+([.,:/-]\d+)*$")
+
+# max number of memoized decisions of token pre-classifier
+TOKEN_CLASSES_MEMO_SIZE = 100000
+
+# global inline flags at the start of a pattern (ex.: "(?i)слово"), they are not allowed
+# inside of an alternation
+INLINE_GLOBAL_FLAGS_REGEXP = re.compile(r"^\(\?[aiLmsux]+\)")
+
+# marker of tokens which are not memoized (None is a valid class)
+_NOT_MEMOIZED = object()
+
+
+class TokenClassifier():
+    """
+    Pre-classifier of tokens whose outcome is fixed: tokens matching frozen patterns,
+    punctuation and numbers. Such tokens get only zero hypothesis, so candidates generation
+    and LM lookups are skipped for them. Decisions are memoized per token string in LRUCache.
+
+    Frozen patterns with equal flags are matched by one alternation regex. Patterns with
+    groups (backreferences are numbered within a pattern) and patterns with global inline
+    flags are matched one by one.
+    """
+
+    def __init__(self, frozen_words_regex_patterns=None):
+        """
+        :param frozen_words_regex_patterns: list of words regexp patterns (str or compiled)
+            which are prohibited for correction
+        """
+        self.frozen_words_regex_patterns = [re.compile(pat)
+                                            for pat in frozen_words_regex_patterns or []]
+        self.frozen_words_regexes = self._combine_patterns(self.frozen_words_regex_patterns)
+        self._memo = LRUCache(TOKEN_CLASSES_MEMO_SIZE)
+
+    @staticmethod
+    def _combine_patterns(patterns):
+        """
+        :param patterns: list of compiled patterns
+        :return: list of compiled regexes which match a token iff any of patterns matches it
+        """
+        regexes = []
+        # {flags: list of patterns which may be combined}
+        combinable_patterns = {}
+        for pat in patterns:
+            if pat.groups or isinstance(pat.pattern, bytes) or \
+                    INLINE_GLOBAL_FLAGS_REGEXP.match(pat.pattern):
+                regexes.append(pat)
+            else:
+                combinable_patterns.setdefault(pat.flags, []).append(pat)
+        for flags, flags_patterns in combinable_patterns.items():
+            if len(flags_patterns) == 1:
+                regexes.append(flags_patterns[0])
+            else:
+                regexes.append(re.compile("|".join("(?:%s)" % pat.pattern
+                                                   for pat in flags_patterns), flags))
+        return regexes
+
+    def classify(self, token):
+        """
+        :param token: str, cased token
+        :return: one of TOKEN_CLASS_FROZEN, TOKEN_CLASS_PUNCTUATION, TOKEN_CLASS_NUMBER or None
+            if token must be analyzed
+        """
+        token_class = self._memo.get(token, default=_NOT_MEMOIZED)
+        if token_class is not _NOT_MEMOIZED:
+            return token_class
+
+        if any(regex.match(token) for regex in self.frozen_words_regexes):
+            token_class = TOKEN_CLASS_FROZEN
+        elif PUNCTUATION_TOKEN_REGEXP.match(token):
+            token_class = TOKEN_CLASS_PUNCTUATION
+        elif NUMBER_TOKEN_REGEXP.match(token):
+            token_class = TOKEN_CLASS_NUMBER
+        else:
+            token_class = None
+
+        self._memo.put(token, token_class)
+        return token_class
+
+
+def merge_segments(wrapped_tokenized_sentence):
+    """
+    Generator of segments of the sentence which are hypothesised to be merged (2->1 merges)
+
+    :param wrapped_tokenized_sentence: list of tokens wrapped with <S>, </S>
+    :return: yields tuples (tok_idx, merge_hypothesis_str, source_segment_str), where
+        tok_idx is the index of the last token of the segment
+    """
+    for tok_idx, each_tok in enumerate(wrapped_tokenized_sentence):
+        if tok_idx <= 1 or tok_idx == len(wrapped_tokenized_sentence) - 1:
+            # the 0's token is <s> the last is </s>
+            continue
+
+        if len(wrapped_tokenized_sentence[tok_idx-1])==1 or len(wrapped_tokenized_sentence[tok_idx])==1:
+            # RULE of THUMB: don't merge words consisting of 1letter
+            continue
+
+        # simple merge hypothesis:
+        merge_hypothesis_str = wrapped_tokenized_sentence[tok_idx - 1] + \
+                               wrapped_tokenized_sentence[tok_idx]
+        source_segment_str = wrapped_tokenized_sentence[tok_idx-1] +" "+ wrapped_tokenized_sentence[tok_idx]
+        yield tok_idx, merge_hypothesis_str, source_segment_str
+
+
+def split_multisentences(strings):
+    """
+    Splits each input string into elementary sentences
+
+    :param strings: list of str, each string may contain multiple sentences
+    :return: tuple (list of elementary sentences, list of numbers of sentences of each string)
+    """
+    # sentence splitter is needed only for multi-sentence inputs:
+    from rusenttokenize import ru_sent_tokenize
+
+    flat_sents_list = []
+    list_of_lengths = []
+    for each_string in strings:
+        el_sents = ru_sent_tokenize(each_string)
+        list_of_lengths.append(len(el_sents))
+        flat_sents_list += el_sents
+    return flat_sents_list, list_of_lengths
+
+
+def group_multisentences(items, list_of_lengths):
+    """
+    Groups items of elementary sentences back by input strings (see split_multisentences)
+
+    :param items: list of items of elementary sentences (ex.: outputs or anal dicts)
+    :param list_of_lengths: list of numbers of sentences of each input string
+    :return: list of lists of items
+    """
+    groups = []
+    sent_offset = 0
+    for each_length in list_of_lengths:
+        groups.append(items[sent_offset:sent_offset + each_length])
+        sent_offset += each_length
+    return groups
@@ -0,0 +1,35 @@
+"""
+Stubs of models of spelling correctors for tests: a tiny LM and a candidates generator with fixed
+candidates, so correctors are tested without ELMO weights and levenshtein search.
+"""
+import numpy as np
+
+from language_models.base_elmo_lm import BaseELMOLM
+
+
+class StubLM(BaseELMOLM):
+    """LM which prefers "мыла" after "мама" and counts forward passes"""
+    def __init__(self):
+        self.words = ["<UNK>", "<S>", "</S>", "мама", "мыла", "мыло", "раму", "папа"]
+        self.word_index = {word: i for i, word in enumerate(self.words)}
+        self.IDX_UNK_TOKEN = self.word_index.get("<UNK>")
+        self.forward_passes = 0
+
+    def elmo_lm(self, tokenized_sentences):
+        self.forward_passes += 1
+        max_len = max(len(each_sent) for each_sent in tokenized_sentences)
+        elmo_data = np.full((len(tokenized_sentences), max_len, 2, len(self.words)), 0.01)
+        for sent_idx, each_sent in enumerate(tokenized_sentences):
+            for tok_idx, each_tok in enumerate(each_sent):
+                if tok_idx > 0 and each_sent[tok_idx - 1] == "мама":
+                    elmo_data[sent_idx, tok_idx, :, self.word_index["мыла"]] = 0.9
+        return elmo_data
+
+
+class StubCandidatesGenerator():
+    """Candidates generator with fixed candidates instead of levenshtein search"""
+    CANDIDATES = {"мыло": [(-1.0, "мыла")]}
+
+    def __call__(self, batch):
+        return [[[(0.0, each_tok)] + self.CANDIDATES.get(each_tok, []) for each_tok in tokens]
+                for tokens in batch]
@@ -0,0 +1,38 @@
+import unittest
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from language_models.batch_scheduler import LengthBucketedBatchScheduler
+
+
+class TestLengthBucketedBatchScheduler(unittest.TestCase):
+    def setUp(self):
+        lengths = [3, 12, 5, 4, 12, 11, 3, 7, 30, 6]
+        self.sentences = [["w%d" % i] * length for i, length in enumerate(lengths)]
+
+    def test_batches_fit_budget_and_cover_all_sentences(self):
+        scheduler = LengthBucketedBatchScheduler(max_padded_tokens=24, bucket_width=4)
+        scheduled_indexes = []
+        for indexes, batch in scheduler.schedule(self.sentences):
+            max_len = max(len(each_sent) for each_sent in batch)
+            min_len = min(len(each_sent) for each_sent in batch)
+            if len(batch) > 1:
+                self.assertLessEqual(max_len * len(batch), 24)
+            self.assertLess(max_len - min_len, 4)
+            scheduled_indexes.extend(indexes)
+        self.assertEqual(sorted(scheduled_indexes), list(range(len(self.sentences))))
+        self.assertEqual(scheduler.stats['real_tokens'],
+                         sum(len(each_sent) for each_sent in self.sentences))
+        self.assertTrue(0.0 < scheduler.padding_efficiency() <= 1.0)
+
+    def test_map_restores_order(self):
+        scheduler = LengthBucketedBatchScheduler(max_padded_tokens=20)
+        outputs = scheduler.map(lambda batch: [len(each_sent) for each_sent in batch],
+                                self.sentences)
+        self.assertEqual(outputs, [len(each_sent) for each_sent in self.sentences])
+
+
+if __name__ == '__main__':
+    unittest.main()
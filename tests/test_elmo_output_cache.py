@@ -0,0 +1,114 @@
+import unittest
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from language_models.base_elmo_lm import BaseELMOLM
+from language_models.elmo_output_cache import ElmoOutputCache
+from utilities.lru_cache import LRUCache
+
+
+class CountingLM(BaseELMOLM):
+    """LM with deterministic outputs which counts sentences passed to forward passes"""
+    def __init__(self):
+        self.words = ["<UNK>", "<S>", "</S>", "привет", "спасибо", "пока"]
+        self.word_index = {word: i for i, word in enumerate(self.words)}
+        self.IDX_UNK_TOKEN = self.word_index.get("<UNK>")
+        self.calculated_sentences = 0
+
+    def elmo_lm(self, tokenized_sentences):
+        self.calculated_sentences += len(tokenized_sentences)
+        max_len = max(len(each_sent) for each_sent in tokenized_sentences)
+        elmo_data = np.zeros((len(tokenized_sentences), max_len, 2, len(self.words)))
+        for sent_idx, each_sent in enumerate(tokenized_sentences):
+            for tok_idx, each_tok in enumerate(each_sent):
+                elmo_data[sent_idx, tok_idx, :, :] = (len(each_tok) + tok_idx) / 100.0
+        return elmo_data
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction_by_size(self):
+        cache = LRUCache(10, size_fn=len)
+        cache.put("a", "xxxx")
+        cache.put("b", "xxxx")
+        self.assertEqual(cache.get("a"), "xxxx")
+        cache.put("c", "xxxx")
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertEqual(cache.current_size, 8)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class TestElmoOutputCache(unittest.TestCase):
+    def setUp(self):
+        self.lm = CountingLM()
+        self.sentences = [["<S>", "привет", "</S>"], ["<S>", "спасибо", "</S>"],
+                          ["<S>", "привет", "</S>"]]
+        self.word_ids = [[3, 5], [4], [3]]
+
+    def test_duplicates_are_collapsed(self):
+        elmo_datas = self.lm.elmo_lm_for_word_ids(self.sentences, self.word_ids)
+        self.assertEqual(self.lm.calculated_sentences, 2)
+        self.assertEqual(elmo_datas[0][1, 0, 5], elmo_datas[2][1, 0, 5])
+        with self.assertRaises(KeyError):
+            elmo_datas[1][1, 0, 5]
+
+    def test_cached_outputs_are_not_recalculated(self):
+        expected = self.lm.elmo_lm_for_word_ids(self.sentences, self.word_ids)
+        self.lm.set_output_cache(ElmoOutputCache(max_bytes=2 ** 20))
+        self.lm.elmo_lm_for_word_ids(self.sentences, self.word_ids)
+        self.lm.calculated_sentences = 0
+        elmo_datas = self.lm.elmo_lm_for_word_ids(self.sentences, self.word_ids)
+        self.assertEqual(self.lm.calculated_sentences, 0)
+        for each_expected, each_elmo_data, word_ids in zip(expected, elmo_datas, self.word_ids):
+            for word_idx in word_ids:
+                self.assertEqual(each_expected[1, 0, word_idx], each_elmo_data[1, 0, word_idx])
+        self.assertEqual(self.lm.output_cache.stats()['hits'], 2)
+
+        # request of a word which is not cached leads to recalculation, it is not a hit:
+        self.lm.elmo_lm_for_word_ids([self.sentences[1]], [[5]])
+        self.assertEqual(self.lm.calculated_sentences, 1)
+        self.assertEqual(self.lm.output_cache.stats()['hits'], 2)
+
+        # words of both requests are cached:
+        self.lm.elmo_lm_for_word_ids([self.sentences[1]], [[4, 5]])
+        self.assertEqual(self.lm.calculated_sentences, 1)
+        self.assertEqual(self.lm.output_cache.stats()['items'], 2)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.lm.set_output_cache(ElmoOutputCache(max_bytes=2 ** 20, cache_dir=cache_dir,
+                                                     model_fingerprint="counting_lm_v1"))
+            expected = self.lm.elmo_lm_for_word_ids(self.sentences, self.word_ids)
+
+            # new cache with empty memory tier (ex.: after restart):
+            self.lm.set_output_cache(ElmoOutputCache(max_bytes=2 ** 20, cache_dir=cache_dir,
+                                                     model_fingerprint="counting_lm_v1"))
+            self.lm.calculated_sentences = 0
+            elmo_datas = self.lm.elmo_lm_for_word_ids(self.sentences, self.word_ids)
+            self.assertEqual(self.lm.calculated_sentences, 0)
+            self.assertEqual(self.lm.output_cache.stats()['disk_hits'], 2)
+            np.testing.assert_array_equal(expected[0].probas, elmo_datas[0].probas)
+
+            # outputs of other version of the model are not loaded:
+            self.lm.set_output_cache(ElmoOutputCache(max_bytes=2 ** 20, cache_dir=cache_dir,
+                                                     model_fingerprint="counting_lm_v2"))
+            self.lm.elmo_lm_for_word_ids(self.sentences, self.word_ids)
+            self.assertEqual(self.lm.calculated_sentences, 2)
+            self.assertEqual(self.lm.output_cache.stats()['disk_hits'], 0)
+
+    def test_disk_tier_requires_model_fingerprint(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with self.assertRaises(ValueError):
+                ElmoOutputCache(cache_dir=cache_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import random
+import unittest
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import evaluate
+from evaluate import align_sents, extract_words, get_partition_indexes, levenstein_dist
+
+DIALOG16_DIR = os.path.join(ROOT_DIR, "data", "dialog16")
+
+
+def make_noisy_sentence(words, rng):
+    """Splits, merges, drops and misspells words of the sentence"""
+    noisy_words = []
+    for word in words:
+        action = rng.random()
+        if action < 0.1 and len(word) > 2:
+            split_idx = rng.randrange(1, len(word))
+            noisy_words += [word[:split_idx], word[split_idx:]]
+        elif action < 0.2 and noisy_words:
+            noisy_words[-1] += word
+        elif action < 0.3:
+            noisy_words.append(word[:-1] + rng.choice("аео"))
+        elif action < 0.35:
+            continue
+        else:
+            noisy_words.append(word)
+    return noisy_words
+
+
+class TestLevensteinTable(unittest.TestCase):
+    def test_transpositions(self):
+        self.assertEqual(levenstein_dist("кот", "кто", allow_transpositions=True), 1.0)
+        self.assertEqual(levenstein_dist("кот", "кто"), 2.0)
+        self.assertEqual(levenstein_dist(["в", "общем", "то"], ["в", "то", "общем"],
+                                         allow_transpositions=True, transposition_cost=0.5), 0.5)
+
+    def test_replace_cost(self):
+        self.assertEqual(levenstein_dist("кот", "кит", replace_cost=1.9), 1.9)
+
+    def test_antidiagonal_fill_matches_row_fill(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            source = [rng.choice("абв") for _ in range(rng.randrange(0, 25))]
+            correct = [rng.choice("абв") for _ in range(rng.randrange(0, 25))]
+            source_codes, correct_codes = evaluate.encode_tokens(source, correct)
+            for allow_transpositions in (False, True):
+                args = (source_codes, correct_codes, allow_transpositions, 1.0, 1.0, 1.9, 1.0)
+                table, backtraces = evaluate._fill_levenstein_table_by_rows(*args)
+                other_table, other_backtraces = \
+                    evaluate._fill_levenstein_table_by_antidiagonals(*args)
+                self.assertTrue((table == other_table).all())
+                self.assertTrue((backtraces == other_backtraces).all())
+
+
+class TestAlignSents(unittest.TestCase):
+    def test_alignment(self):
+        source = ['фотка', 'классная', 'кстате', 'хоть', 'и', 'не', 'по', 'теме']
+        correct = ['фотка', 'классная', 'кстати', 'хотя', 'не', 'по', 'теме']
+        self.assertEqual(align_sents(source, correct, return_only_different=True,
+                                     replace_cost=1.9),
+                         [((2, 3), (2, 3)), ((3, 5), (3, 4))])
+
+    def test_ambiguous_partition_matches_enumeration(self):
+        # both partitions are optimal, the engine reproduces the choice of enumeration:
+        first, second = ['ка', 'кв'], ['как', 'в']
+        self.assertEqual(get_partition_indexes(first, second, max_enumerated_paths=8),
+                         get_partition_indexes(first, second))
+
+    def test_canonical_alignment_is_optimal(self):
+        source = "ну кто то придет на встречу".split()
+        correct = "ну кто-то придёт на встречу".split()
+        groups = align_sents(source, correct, replace_cost=1.9, max_enumerated_paths=0)
+        # groups cover both sentences in order:
+        self.assertEqual([group[0] for group in groups],
+                         [(0, 1), (1, 3), (3, 4), (4, 5), (5, 6)])
+        self.assertEqual([group[1] for group in groups],
+                         [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)])
+
+    def test_engine_matches_enumeration_on_dialog16(self):
+        with open(os.path.join(DIALOG16_DIR, "dialog_testset.txt"), "r", encoding="utf8") as f:
+            source_sents = [extract_words(line) for line in f][:300]
+        with open(os.path.join(DIALOG16_DIR, "true_dialog_testset.txt"), "r",
+                  encoding="utf8") as f:
+            correct_sents = [extract_words(line) for line in f][:300]
+        rng = random.Random(0)
+        for source, correct in zip(source_sents, correct_sents):
+            for other in (correct, make_noisy_sentence(source, rng)):
+                self.assertEqual(
+                    align_sents(source, other, replace_cost=1.9,
+                                max_enumerated_paths=evaluate.MAX_ENUMERATED_PATHS ** 3),
+                    align_sents(source, other, replace_cost=1.9, max_enumerated_paths=None))
+
+
+class TestStreamingEvaluation(unittest.TestCase):
+    def test_streaming_matches_serial(self):
+        with open(os.path.join(DIALOG16_DIR, "dialog_testset.txt"), "r", encoding="utf8") as f:
+            source_sents = [line.strip() for line in f][:200]
+        with open(os.path.join(DIALOG16_DIR, "true_dialog_testset.txt"), "r",
+                  encoding="utf8") as f:
+            correct_sents = [line.strip() for line in f][:200]
+        rng = random.Random(1)
+        answer_sents = [" ".join(make_noisy_sentence(sent.split(), rng)) for sent in correct_sents]
+        serial = evaluate.evaluate_spelling_corrector(source_sents, correct_sents, answer_sents)
+        for jobs in (1, 2):
+            streaming = evaluate.evaluate_spelling_corrector_streaming(
+                zip(source_sents, correct_sents, answer_sents), jobs=jobs, chunk_size=32,
+                verbose=False)
+            self.assertEqual(streaming['sentences_number'], 200)
+            self.assertEqual(streaming['answer_corrections_number'],
+                             len(serial['answer_corrections']))
+            self.assertEqual(streaming['etalon_corrections_number'],
+                             len(serial['etalon_corrections']))
+            for key in ('precision', 'recall', 'f_measure'):
+                self.assertAlmostEqual(streaming[key], serial[key])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import unittest
+import os
+from copy import deepcopy
+import sys
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from spelling_correction_models.elmo_40in_spelling_corrector.helper_fns import \
+    estimate_the_best_s_hypotheses, HypothesesHub, SCAnalysisDictManager
+from spelling_correction_models.elmo_40in_spelling_corrector.hypotheses_table import \
+    HYPOTHESES_TABLE_KEY, HypothesesTable, HypothesesTableBuilder, materialize_analysis_dict
+from spelling_correction_models.elmo_40in_spelling_corrector.lattice_decoder import \
+    build_lattice, decode_lattice
+
+
+def zero_hypothesis(token_str, advantage=0.0):
+    return {'lm_advantage': 0.0, 'advantage': advantage, 'token_str': token_str,
+            'zero_hypothesis': True, 'error_score': 0.0, 'token_merges': 0,
+            'token_splits': None}
+
+
+def substitution(token_str, advantage):
+    return {'lm_advantage': advantage + 4.0, 'advantage': advantage, 'token_str': token_str,
+            'zero_hypothesis': False, 'error_score': -4.0, 'token_merges': 0,
+            'token_splits': None}
+
+
+def legacy_best_hypothesis(data_analysis_dict, min_advantage_treshold):
+    # search of the best hypothesis by dicts of HypothesesHub:
+    hypotheses_hub = HypothesesHub()
+    for current_token_idx in range(1, len(data_analysis_dict['tokenized_input_sentence']) - 1):
+        suffixes_hypotheses = deepcopy(SCAnalysisDictManager.filter_by_start_index(
+            data_anal_dict=data_analysis_dict, start_index=current_token_idx))
+        for each_suffix_group_dict in suffixes_hypotheses:
+            each_suffix_group_dict['top_k_candidates'] = [
+                each_candidate for each_candidate in each_suffix_group_dict['top_k_candidates']
+                if each_candidate.get('zero_hypothesis') is True or
+                not each_candidate['advantage'] < min_advantage_treshold]
+        hypotheses_hub.fork_for_suffixes_segment_hypotheses(suffixes_hypotheses)
+    return hypotheses_hub.filter_the_best_hypotheses(top_k=1)[0]
+
+
+class TestHypothesesTable(unittest.TestCase):
+    def setUp(self):
+        self.analysis_dict = {
+            'tokenized_input_sentence': ['<S>', 'мамо', 'мы', 'ла', 'рабу', '</S>'],
+            'word_substitutions_candidates': [
+                {'tok_idx': 0, 'top_k_candidates': []},
+                {'tok_idx': 1, 'top_k_candidates': [substitution('мама', 2.5),
+                                                    zero_hypothesis('мамо'),
+                                                    substitution('маме', 0.5)]},
+                {'tok_idx': 2, 'top_k_candidates': [zero_hypothesis('мы', 0.5)]},
+                {'tok_idx': 3, 'top_k_candidates': [substitution('на', 7.9),
+                                                    zero_hypothesis('ла', 0.5)]},
+                {'tok_idx': 4, 'top_k_candidates': [substitution('раму', 1.3),
+                                                    zero_hypothesis('рабу')]},
+                {'tok_idx': 5, 'top_k_candidates': [zero_hypothesis('</S>')]},
+                {'tok_idx': (2, 3), 'tok_idx_start': 2, 'tok_idx_fin': 3,
+                 'source_segment_str': 'мы ла',
+                 'top_k_candidates': [{'token_str': 'мыла', 'token_merges': 1,
+                                       'error_score': -4.0, 'lm_scores_list': [-4.9, -6.2],
+                                       'advantage': 9.69, 'lm_advantage': 13.69}]}
+            ]
+        }
+
+    def test_round_trip(self):
+        table = HypothesesTable.from_analysis_dict(self.analysis_dict)
+        self.assertEqual(len(table), 10)
+        self.assertEqual(table.to_word_substitutions_candidates(),
+                         self.analysis_dict['word_substitutions_candidates'])
+        self.assertEqual(list(table.rows_starting_at(2)), [3, 9])
+
+    def test_none_values_round_trip(self):
+        self.analysis_dict['word_substitutions_candidates'][2]['top_k_candidates'][0][
+            'token_merges'] = None
+        table = HypothesesTable.from_analysis_dict(self.analysis_dict)
+        self.assertEqual(table.candidate_dict(3)['token_merges'], None)
+        self.assertEqual(table.to_word_substitutions_candidates(),
+                         self.analysis_dict['word_substitutions_candidates'])
+
+    def test_builder_reproduces_dicts(self):
+        # the corrector builds the table during analysis and dicts are materialized on demand:
+        builder = HypothesesTableBuilder(self.analysis_dict['tokenized_input_sentence'])
+        for each_group in self.analysis_dict['word_substitutions_candidates']:
+            builder.add_group(each_group['tok_idx'], each_group.get('source_segment_str'))
+            for each_candidate in each_group['top_k_candidates']:
+                builder.add_candidate_dict(each_candidate)
+        analysis_dict = {
+            'tokenized_input_sentence': self.analysis_dict['tokenized_input_sentence'],
+            HYPOTHESES_TABLE_KEY: builder.build()}
+        self.assertIs(HypothesesTable.of_analysis_dict(analysis_dict),
+                      analysis_dict[HYPOTHESES_TABLE_KEY])
+        self.assertEqual(materialize_analysis_dict(analysis_dict), self.analysis_dict)
+
+    def test_filter_by_start_index_of_table(self):
+        analysis_dict = {
+            'tokenized_input_sentence': self.analysis_dict['tokenized_input_sentence'],
+            HYPOTHESES_TABLE_KEY: HypothesesTable.from_analysis_dict(self.analysis_dict)}
+        for start_index in range(len(self.analysis_dict['tokenized_input_sentence'])):
+            self.assertEqual(
+                SCAnalysisDictManager.filter_by_start_index(analysis_dict, start_index),
+                SCAnalysisDictManager.filter_by_start_index(self.analysis_dict, start_index))
+
+    def test_the_best_hypothesis(self):
+        hypotheses = estimate_the_best_s_hypotheses(self.analysis_dict,
+                                                    min_advantage_treshold=1.0)
+        self.assertEqual(hypotheses[0].text, "мама мыла раму")
+        self.assertEqual(hypotheses[0].calc_advantage_score(), 2.5 + 9.69 + 1.3)
+
+        # only the merge passes a higher threshold:
+        hypotheses = estimate_the_best_s_hypotheses(self.analysis_dict,
+                                                    min_advantage_treshold=8.0)
+        self.assertEqual(hypotheses[0].text, "мамо мыла рабу")
+
+
+    def test_lattice_reproduces_hypotheses_hub(self):
+        for min_advantage_treshold in [0.0, 1.0, 8.0, 100.0]:
+            expected = legacy_best_hypothesis(self.analysis_dict, min_advantage_treshold)
+            for hypotheses in [
+                    estimate_the_best_s_hypotheses(self.analysis_dict, min_advantage_treshold),
+                    decode_lattice(self.analysis_dict, min_advantage_treshold)]:
+                self.assertEqual(hypotheses[0].text, expected.text)
+                self.assertEqual(hypotheses[0].token_hypotheses, expected.token_hypotheses)
+                self.assertEqual(hypotheses[0].spans, expected.spans)
+                self.assertEqual(hypotheses[0].calc_advantage_score(),
+                                 expected.calc_advantage_score())
+
+    def test_tokens_alignment(self):
+        hypotheses = decode_lattice(self.analysis_dict, min_advantage_treshold=1.0)
+        self.assertEqual(hypotheses[0].spans, [(1, 1), (2, 3), (4, 4)])
+        tokens, alignment = hypotheses[0].tokens_alignment()
+        self.assertEqual(tokens, ["мама", "мыла", "раму"])
+        # the same format as evaluate.align_sents:
+        self.assertEqual(alignment, [((0, 1), (0, 1)), ((1, 3), (1, 2)), ((3, 4), (2, 3))])
+
+    def test_k_best(self):
+        hypotheses = decode_lattice(self.analysis_dict, min_advantage_treshold=0.0, k_best=4)
+        self.assertEqual([each.text for each in hypotheses],
+                         ["мама мыла раму", "мама мы на раму", "мама мыла рабу", "маме мыла раму"])
+        scores = [each.calc_advantage_score() for each in hypotheses]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_edge_scores(self):
+        # the merge has the best score at its start, but the path through 2 tokens is better:
+        edge_scores = np.zeros(10)
+        edge_scores[[0, 3, 4, 6, 9]] = [1.0, 1.0, 4.5, 1.0, 5.0]
+        hypotheses = decode_lattice(self.analysis_dict, min_advantage_treshold=-np.inf,
+                                    edge_scores=edge_scores)
+        self.assertEqual(hypotheses[0].text, "мама мы на раму")
+        self.assertEqual(hypotheses[0].spans, [(1, 1), (2, 2), (3, 3), (4, 4)])
+
+        edge_scores[9] = 6.0
+        hypotheses = decode_lattice(self.analysis_dict, min_advantage_treshold=-np.inf,
+                                    edge_scores=edge_scores)
+        self.assertEqual(hypotheses[0].text, "мама мыла раму")
+        self.assertEqual(hypotheses[0].spans, [(1, 1), (2, 3), (4, 4)])
+
+    def test_equal_scores_are_ordered_by_rows(self):
+        # all paths have equal scores, so they are ordered as tuples of rows:
+        table = HypothesesTable.from_analysis_dict(self.analysis_dict)
+        final_node, incoming_edges = build_lattice(table, -np.inf, edge_scores=np.zeros(10))
+        paths = {0: [()]}
+        for node in range(1, final_node + 1):
+            paths[node] = [path + (row,) for source_node, row, _ in incoming_edges[node]
+                           for path in paths[source_node]]
+        expected = sorted(paths[final_node])
+        hypotheses = decode_lattice(table, min_advantage_treshold=-np.inf, k_best=len(expected),
+                                    edge_scores=np.zeros(10))
+        self.assertEqual([each.spans for each in hypotheses],
+                         [[(int(table.start[row]), int(table.end[row])) for row in path]
+                          for path in expected])
+        self.assertEqual([each.text for each in hypotheses],
+                         [" ".join(table.token_str(row) for row in path) for path in expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from tests.corrector_stubs import StubCandidatesGenerator, StubLM
+from spelling_correction_models.elmo_40in_spelling_corrector.elmo_40in2_spelling_corrector import \
+    ELMO40in2SpellingCorrector
+
+
+class TestKBestCorrections(unittest.TestCase):
+    class LengthRescorer():
+        """Rescorer which prefers hypotheses with short words"""
+        def score_batch(self, sentences):
+            return [-len(each_sentence) for each_sentence in sentences]
+
+    def setUp(self):
+        self.spelling_corrector = ELMO40in2SpellingCorrector(
+            language_model=StubLM(),
+            spelling_correction_candidates_generator=StubCandidatesGenerator())
+
+    def test_k_best(self):
+        sentences = ["мама мыло раму", "папа мыло раму"]
+        results = self.spelling_corrector.process_sentences_batch_k_best(
+            sentences, k_best=3, min_advantage_treshold=0.0)
+        self.assertEqual([each['sentence'] for each in results[0]],
+                         ["мама мыла раму", "мама мыло раму"])
+        self.assertEqual(results[0][0]['sentence'],
+                         self.spelling_corrector.process_sentences_batch(
+                             sentences[:1], min_advantage_treshold=0.0)[0])
+        self.assertGreater(results[0][0]['score'], results[0][1]['score'])
+
+    def test_rescoring(self):
+        results = self.spelling_corrector.process_sentences_batch_k_best(
+            ["мама мыло раму"], k_best=3, min_advantage_treshold=0.0,
+            rescorer=self.LengthRescorer(), rescorer_weight=100.0)
+        self.assertEqual(results[0][0]['rescorer_score'], -len("мама мыла раму"))
+        self.assertEqual(results[0][0]['score'],
+                         results[0][0]['advantage'] + 100.0 * results[0][0]['rescorer_score'])
+
+    def test_corrections_are_unique(self):
+        # equal candidates of a token are different paths of the lattice with the same sentence:
+        class DuplicatesCandidatesGenerator(StubCandidatesGenerator):
+            CANDIDATES = {"мыло": [(-1.0, "мыла"), (-1.5, "мыла")]}
+
+        spelling_corrector = ELMO40in2SpellingCorrector(
+            language_model=StubLM(),
+            spelling_correction_candidates_generator=DuplicatesCandidatesGenerator())
+        results = spelling_corrector.process_sentences_batch_k_best(
+            ["мама мыло раму"], k_best=2, min_advantage_treshold=-100.0)
+        self.assertEqual([each['sentence'] for each in results[0]],
+                         ["мама мыла раму", "мама мыло раму"])
+
+
+if __name__ == '__main__':
+    unittest.main()
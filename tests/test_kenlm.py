@@ -0,0 +1,192 @@
+import itertools
+import unittest
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+try:
+    import kenlm
+    from dp_components.kenlm_loader import load_kenlm_model
+    from dp_components.kenlm_prefix_scorer import KenlmPrefixScorer
+except ImportError:
+    kenlm = None
+try:
+    from dp_components.kenlm_elector import KenlmElector
+    from spelling_correction_models.kenlm_spelling_corrector.kenlm_spelling_corrector import \
+        KenlmSpellingCorrector
+except ImportError:
+    KenlmElector = None
+
+# tiny bigram model
+ARPA = """\\data\\
+ngram 1=7
+ngram 2=5
+
+\\1-grams:
+-1.5\t<unk>\t0
+-99\t<s>\t-0.3
+-0.9\t</s>\t0
+-0.8\tмама\t-0.2
+-0.9\tмыла\t-0.2
+-1.0\tраму\t-0.2
+-1.2\tрамы\t-0.2
+
+\\2-grams:
+-0.2\t<s> мама
+-0.1\tмама мыла
+-0.3\tмыла раму
+-0.9\tмыла рамы
+-0.2\tраму </s>
+
+\\end\\
+"""
+
+
+def write_arpa(directory):
+    path = os.path.join(directory, "tiny.arpa")
+    with open(path, "w", encoding="utf-8") as arpa_file:
+        arpa_file.write(ARPA)
+    return path
+
+
+@unittest.skipIf(kenlm is None, "kenlm is not installed")
+class TestKenlmPrefixScorer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.model = kenlm.Model(write_arpa(self.tmp_dir.name))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_scores_match_kenlm(self):
+        scorer = KenlmPrefixScorer(self.model)
+        sentences = ["мама мыла раму", "мама мыла рамы", "мама мыла", "раму мама"]
+        for _ in range(2):
+            scores = scorer.score_batch(sentences)
+            for each_sentence, each_score in zip(sentences, scores):
+                self.assertAlmostEqual(each_score, self.model.score(each_sentence), places=4)
+        self.assertAlmostEqual(scorer.score_tokens(["мыла", "раму"], bos=False, eos=False),
+                               self.model.score("мыла раму", bos=False, eos=False), places=4)
+
+    def test_shared_prefixes_are_cached(self):
+        scorer = KenlmPrefixScorer(self.model)
+        scorer.score_batch(["мама мыла раму", "мама мыла рамы"])
+        # the second sentence reuses prefixes "мама" and "мама мыла", other tokens are queried:
+        self.assertEqual(scorer.stats()['hits'], 2)
+        self.assertEqual(scorer.stats()['misses'], 4)
+
+    def test_evicted_prefixes_are_rescored(self):
+        scorer = KenlmPrefixScorer(self.model, cache_size=2)
+        sentences = ["мама мыла раму", "мама мыла рамы", "мыла раму", "мама мыла раму"]
+        for each_sentence, each_score in zip(sentences, scorer.score_batch(sentences)):
+            self.assertAlmostEqual(each_score, self.model.score(each_sentence), places=4)
+        self.assertEqual(len(scorer.prefix_cache), 2)
+
+
+@unittest.skipIf(kenlm is None, "kenlm is not installed")
+class TestKenlmLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.arpa_path = write_arpa(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_probe(self):
+        model, probe = load_kenlm_model(self.arpa_path, load_method="read", verbose=False)
+        self.assertFalse(probe['is_binary'])
+        self.assertEqual(probe['load_method'], "read")
+        self.assertGreaterEqual(probe['load_seconds'], 0.0)
+        self.assertAlmostEqual(model.score("мама мыла раму"),
+                               kenlm.Model(self.arpa_path).score("мама мыла раму"), places=4)
+
+    def test_unknown_load_method(self):
+        with self.assertRaises(ValueError):
+            load_kenlm_model(self.arpa_path, load_method="mmap", verbose=False)
+
+
+@unittest.skipIf(kenlm is None or KenlmElector is None, "kenlm or deeppavlov is not installed")
+class TestKenlmElector(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.arpa_path = write_arpa(self.tmp_dir.name)
+        self.candidates = [[(-0.0, "мама"), (-4.0, "мамы"), (-4.0, "ма ма")],
+                           [(-0.0, "мыло"), (-1.0, "мыла"), (-1.0, "мы ла")],
+                           [(-0.0, "рамы"), (-0.5, "раму"), (-4.0, "рама")]]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def exhaustive_best(self, elector):
+        best_score, best_words = None, None
+        for choice in itertools.product(*self.candidates):
+            words = " ".join(candidate for _, candidate in choice)
+            score = sum(error_score for error_score, _ in choice) + elector.lm.score(words)
+            if best_score is None or score > best_score:
+                best_score, best_words = score, words.split()
+        return best_words
+
+    def test_beam_finds_the_best_hypothesis(self):
+        elector = KenlmElector(self.arpa_path, beam_size=4)
+        self.assertEqual(elector([self.candidates])[0], self.exhaustive_best(elector))
+        self.assertEqual(elector([self.candidates])[0], ["мама", "мыла", "раму"])
+
+    def test_forked_processes_preserve_order(self):
+        batch = [self.candidates, self.candidates[1:], self.candidates[:1], self.candidates[::-1]]
+        expected = KenlmElector(self.arpa_path)(batch)
+        elector = KenlmElector(self.arpa_path, n_processes=2)
+        self.assertEqual(elector(batch), expected)
+        elector.close()
+
+    def test_score_sentences_hypotheses(self):
+        elector = KenlmElector(self.arpa_path)
+        hypotheses = ["мама мыла раму", ["мама", "мыла", "рамы"]]
+        scores = elector.score_sentences_hypotheses(hypotheses)
+        self.assertAlmostEqual(scores[0], elector.lm.score("мама мыла раму"), places=4)
+        self.assertAlmostEqual(scores[1], elector.lm.score("мама мыла рамы"), places=4)
+
+
+class StubCandidatesGenerator():
+    """Candidates generator with fixed candidates instead of levenshtein search"""
+    CANDIDATES = {"мыло": [(-1.0, "мыла")], "мама": [(-1.0, "мамы")]}
+
+    def __call__(self, batch):
+        return [[[(0.0, each_tok)] + self.CANDIDATES.get(each_tok, []) for each_tok in tokens]
+                for tokens in batch]
+
+
+@unittest.skipIf(kenlm is None or KenlmElector is None, "kenlm or deeppavlov is not installed")
+class TestKenlmSpellingCorrector(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.spelling_corrector = KenlmSpellingCorrector(
+            language_model_path=write_arpa(self.tmp_dir.name),
+            spelling_correction_candidates_generator=StubCandidatesGenerator())
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_corrections(self):
+        sentences = ["Мама мыло раму", "ма ма мыло раму.", "Мама мыла раму"]
+        self.assertEqual(self.spelling_corrector.process_sentences_batch(sentences),
+                         ["Мама мыла раму", "мама мыла раму.", "Мама мыла раму"])
+
+    def test_threshold(self):
+        outputs, anal_dicts = self.spelling_corrector.process_sentences_batch(
+            ["мама мыло раму"], min_advantage_treshold=100.0, supply_anal_dict=True)
+        self.assertEqual(outputs, ["мама мыло раму"])
+        self.assertEqual(anal_dicts[0]['hypothesis_tokens'], ["мама", "мыло", "раму"])
+
+    def test_frozen_words(self):
+        spelling_corrector = KenlmSpellingCorrector(
+            kenlm_elector=self.spelling_corrector.kenlm_elector,
+            spelling_correction_candidates_generator=StubCandidatesGenerator(),
+            frozen_words_regex_patterns=["мыл."])
+        self.assertEqual(spelling_corrector.process_sentences_batch(["мама мыло раму"]),
+                         ["мама мыло раму"])
+
+
+if __name__ == '__main__':
+    unittest.main()
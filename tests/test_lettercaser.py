@@ -0,0 +1,38 @@
+import unittest
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from lettercaser import LettercaserForSpellchecker
+
+
+class TestLettercaserForSpellchecker(unittest.TestCase):
+    def setUp(self):
+        self.lettercaser = LettercaserForSpellchecker()
+
+    def test_alignment(self):
+        self.assertEqual(self.lettercaser(['Тут есть КТО НИБУДЬ'.split()],
+                                          ['тут есть кто-нибудь'.split()]),
+                         [['Тут', 'есть', 'КТО-НИБУДЬ']])
+
+    def test_position_wise_alignment_matches_calculated(self):
+        # alignment of 1->1 substitutions which the corrector restores from spans:
+        source = 'Фотка КЛАССНАЯ кстате , Вася'.split()
+        correct = 'фотка классная кстати , вася'.split()
+        alignment = [((idx, idx + 1), (idx, idx + 1)) for idx in range(len(source))]
+        self.assertEqual(self.lettercaser([source], [correct], alignments=[alignment]),
+                         self.lettercaser([source], [correct]))
+        self.assertEqual(self.lettercaser([source], [correct], alignments=[alignment]),
+                         [['Фотка', 'КЛАССНАЯ', 'кстати', ',', 'Вася']])
+
+    def test_given_alignment(self):
+        source = 'Мамо мы ЛА рабу'.split()
+        correct = 'мама мыла раму'.split()
+        alignment = [((0, 1), (0, 1)), ((1, 3), (1, 2)), ((3, 4), (2, 3))]
+        self.assertEqual(self.lettercaser([source], [correct], alignments=[alignment]),
+                         [['Мама', 'мыла', 'раму']])
+
+
+if __name__ == '__main__':
+    unittest.main()
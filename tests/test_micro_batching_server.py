@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from tests.corrector_stubs import StubCandidatesGenerator, StubLM
+from spelling_correction_models.elmo_40in_spelling_corrector.elmo_40in2_spelling_corrector import \
+    ELMO40in2SpellingCorrector
+from spelling_correction_models.elmo_40in_spelling_corrector.micro_batching_server import \
+    MicroBatchingSpellingCorrectorServer
+
+
+class TestMicroBatchingServer(unittest.TestCase):
+    def setUp(self):
+        self.lm = StubLM()
+        self.spelling_corrector = ELMO40in2SpellingCorrector(
+            language_model=self.lm,
+            spelling_correction_candidates_generator=StubCandidatesGenerator())
+
+    def test_concurrent_requests_share_forward_passes(self):
+        sentences = ["мама мыло раму", "папа мыло раму", "мама мыло", "раму мыло"]
+        expected = self.spelling_corrector.process_sentences_batch(sentences)
+        self.lm.forward_passes = 0
+
+        async def run():
+            server = MicroBatchingSpellingCorrectorServer(self.spelling_corrector,
+                                                          max_latency=0.05)
+            await server.start()
+            results = await server.correct_batch(sentences)
+            metrics = server.metrics()
+            await server.stop()
+            return results, metrics
+
+        results, metrics = asyncio.run(run())
+        self.assertEqual(results, expected)
+        self.assertEqual(results[0], "мама мыла раму")
+        self.assertEqual(metrics['requests'], len(sentences))
+        self.assertEqual(metrics['batches'], 1)
+        self.assertEqual(self.lm.forward_passes, 1)
+
+    def test_rejects_requests_when_queue_is_full(self):
+        async def run():
+            server = MicroBatchingSpellingCorrectorServer(self.spelling_corrector,
+                                                          max_queue_size=1,
+                                                          reject_when_full=True)
+            await server.start()
+            first = asyncio.ensure_future(server.correct("мама мыло раму"))
+            second = asyncio.ensure_future(server.correct("мама мыло раму"))
+            results = await asyncio.gather(first, second, return_exceptions=True)
+            await server.stop()
+            return results, server.metrics()
+
+        results, metrics = asyncio.run(run())
+        self.assertEqual(results[0], "мама мыла раму")
+        self.assertIsInstance(results[1], asyncio.QueueFull)
+        self.assertEqual(metrics['rejected_requests'], 1)
+
+    def test_stop_cancels_requests_of_batch_in_flight(self):
+        class SlowCorrector():
+            def process_sentences_batch(self, sentences, min_advantage_treshold=1.0):
+                time.sleep(0.2)
+                return sentences
+
+        async def run():
+            server = MicroBatchingSpellingCorrectorServer(SlowCorrector())
+            await server.start()
+            in_flight = asyncio.ensure_future(server.correct("мама мыло раму"))
+            await asyncio.sleep(0.05)
+            await server.stop()
+            return await asyncio.wait_for(asyncio.gather(in_flight, return_exceptions=True), 1.0)
+
+        results = asyncio.run(run())
+        self.assertIsInstance(results[0], asyncio.CancelledError)
+
+    def test_degraded_mode(self):
+        class FallbackCorrector():
+            tresholds = []
+
+            def process_sentences_batch(self, sentences, min_advantage_treshold=1.0):
+                self.tresholds.append(min_advantage_treshold)
+                return ["fallback: " + each_sentence for each_sentence in sentences]
+
+        async def run(degrade_queue_depth):
+            server = MicroBatchingSpellingCorrectorServer(
+                self.spelling_corrector, fallback_spelling_corrector=FallbackCorrector(),
+                degrade_queue_depth=degrade_queue_depth, fallback_min_advantage_treshold=3.0)
+            await server.start()
+            results = await server.correct_batch(["мама мыло раму"])
+            await server.stop()
+            return results, server.metrics()
+
+        results, metrics = asyncio.run(run(degrade_queue_depth=None))
+        self.assertEqual(results, ["мама мыла раму"])
+        self.assertEqual(metrics['degraded_batches'], 0)
+        # the queue is always saturated:
+        results, metrics = asyncio.run(run(degrade_queue_depth=0))
+        self.assertEqual(results, ["fallback: мама мыло раму"])
+        self.assertEqual(metrics['degraded_batches'], 1)
+        self.assertEqual(metrics['degraded_sentences'], 1)
+        # the fallback corrector gets its own threshold (its scores are in other units):
+        self.assertEqual(FallbackCorrector.tresholds, [3.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import threading
+import time
+import unittest
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from tests.corrector_stubs import StubCandidatesGenerator, StubLM
+from spelling_correction_models.elmo_40in_spelling_corrector.elmo_40in2_spelling_corrector import \
+    ELMO40in2SpellingCorrector
+
+
+class FailingLMSpellingCorrector(ELMO40in2SpellingCorrector):
+    """Corrector whose LM fails on the first minibatch and whose candidates generation is slow"""
+    def precompute_candidates(self, *args, **kwargs):
+        time.sleep(0.05)
+        with self.lock:
+            self.candidates_calls += 1
+        return super().precompute_candidates(*args, **kwargs)
+
+    def elmo_lm_for_candidates(self, *args, **kwargs):
+        raise RuntimeError("LM failure")
+
+
+class TestPipelinedAnalysis(unittest.TestCase):
+    SENTENCES = ["мама мыло раму", "папа мыло раму", "мама мыло", "раму мыло"]
+
+    def make_corrector(self, corrector_class=ELMO40in2SpellingCorrector, **kwargs):
+        return corrector_class(language_model=StubLM(),
+                               spelling_correction_candidates_generator=StubCandidatesGenerator(),
+                               **kwargs)
+
+    def test_pipelined_reproduces_sequential(self):
+        expected = self.make_corrector().process_sentences_batch(self.SENTENCES)
+        spelling_corrector = self.make_corrector(pipelined=True)
+        # one sentence per minibatch:
+        self.assertEqual(spelling_corrector.process_sentences_batch(self.SENTENCES,
+                                                                    max_tokens_count=1),
+                         expected)
+
+    def test_lm_failure_cancels_pending_candidates(self):
+        spelling_corrector = self.make_corrector(FailingLMSpellingCorrector, pipelined=True)
+        spelling_corrector.lock = threading.Lock()
+        spelling_corrector.candidates_calls = 0
+        with self.assertRaises(RuntimeError):
+            spelling_corrector.process_sentences_batch(self.SENTENCES * 5, max_tokens_count=1)
+        # the running task may finish, pending ones are cancelled:
+        time.sleep(0.2)
+        self.assertLess(spelling_corrector.candidates_calls, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import os
+import sys
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from reranker.features import FEATURE_INDEX, FEATURE_NAMES, batch_feature_matrix, \
+    table_feature_matrix
+from spelling_correction_models.elmo_40in_spelling_corrector.hypotheses_table import \
+    HypothesesTable
+try:
+    from reranker.reranker_40in import ReRanker40inRegressor
+except ImportError:
+    ReRanker40inRegressor = None
+
+
+def make_analysis_dict():
+    return {
+        'tokenized_input_sentence': ['<S>', 'мамо', 'в', 'рабу', '</S>'],
+        'word_substitutions_candidates': [
+            {'tok_idx': 0, 'top_k_candidates': []},
+            {'tok_idx': 1, 'top_k_candidates': [
+                {'lm_advantage': 6.5, 'advantage': 2.5, 'token_str': 'мама',
+                 'zero_hypothesis': False, 'error_score': -4.0, 'token_merges': 0,
+                 'token_splits': None},
+                {'lm_advantage': 0.0, 'advantage': 0.0, 'token_str': 'мамо',
+                 'zero_hypothesis': True, 'error_score': 0.0, 'token_merges': 0,
+                 'token_splits': None, 'is_abbrev': True}]},
+            {'tok_idx': 2, 'top_k_candidates': [
+                {'lm_advantage': 0.0, 'advantage': 0.0, 'token_str': 'в',
+                 'zero_hypothesis': True, 'error_score': 0.0, 'token_merges': 0,
+                 'token_splits': None, 'comment': '1letter word'}]},
+            {'tok_idx': 3, 'top_k_candidates': [
+                {'lm_advantage': 5.3, 'advantage': 1.3, 'token_str': 'раму',
+                 'zero_hypothesis': False, 'error_score': -4.0, 'token_merges': 0,
+                 'token_splits': 2, 'comment': 'has digit'},
+                {'lm_advantage': 0.0, 'advantage': 0.0, 'token_str': 'рабу',
+                 'zero_hypothesis': True, 'error_score': 0.0, 'token_merges': 0,
+                 'token_splits': None}]},
+            {'tok_idx': 4, 'top_k_candidates': [
+                {'lm_advantage': 0.0, 'advantage': 0.0, 'token_str': '</S>',
+                 'zero_hypothesis': True, 'error_score': 0.0, 'token_merges': 0,
+                 'token_splits': None}]},
+            {'tok_idx': (1, 2), 'tok_idx_start': 1, 'tok_idx_fin': 2,
+             'top_k_candidates': [{'token_str': 'мамов', 'token_merges': 1,
+                                   'error_score': -4.0, 'advantage': 0.3,
+                                   'lm_advantage': 4.3}]}
+        ]
+    }
+
+
+class TestFeatureMatrix(unittest.TestCase):
+    def test_columns(self):
+        table = HypothesesTable.from_analysis_dict(make_analysis_dict())
+        matrix = table_feature_matrix(table)
+        self.assertEqual(matrix.shape, (7, len(FEATURE_NAMES)))
+        self.assertEqual(list(matrix[:, FEATURE_INDEX['zero_hypothesis']]),
+                         [0, 1, 1, 0, 1, 1, 0])
+        self.assertEqual(list(matrix[:, FEATURE_INDEX['token_splits']]), [0, 0, 0, 2, 0, 0, 0])
+        self.assertEqual(list(matrix[:, FEATURE_INDEX['is_abbrev']]), [0, 1, 0, 0, 0, 0, 0])
+        self.assertEqual(list(matrix[:, FEATURE_INDEX['has_digit']]), [0, 0, 0, 1, 0, 0, 0])
+        # the substring of preprocess_feature_dict is not in comments of the corrector:
+        self.assertFalse(matrix[:, FEATURE_INDEX['1letter_word']].any())
+        self.assertEqual(matrix[6, FEATURE_INDEX['token_merges']], 1)
+
+    def test_batch(self):
+        table = HypothesesTable.from_analysis_dict(make_analysis_dict())
+        matrix, row_offsets = batch_feature_matrix([table, table])
+        self.assertEqual(list(row_offsets), [0, 7, 14])
+        self.assertTrue((matrix[7:] == table_feature_matrix(table)).all())
+
+    @unittest.skipIf(ReRanker40inRegressor is None, "reranker dependencies are not installed")
+    def test_matches_feature_dicts(self):
+        analysis_dict = make_analysis_dict()
+        expected = [ReRanker40inRegressor.binarize_features(
+            ReRanker40inRegressor.preprocess_feature_dict(each_candidate))
+            for each_group in analysis_dict['word_substitutions_candidates']
+            for each_candidate in each_group['top_k_candidates']]
+        matrix = table_feature_matrix(HypothesesTable.from_analysis_dict(analysis_dict))
+        self.assertTrue(np.array_equal(matrix, np.array(expected, dtype=np.float64)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+import sys
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from tests.corrector_stubs import StubCandidatesGenerator, StubLM
+from spelling_correction_models.elmo_40in_spelling_corrector.elmo_40in2_spelling_corrector import \
+    ELMO40in2SpellingCorrector
+from spelling_correction_models.elmo_40in_spelling_corrector.\
+    elmo_40in2_reranking_spelling_corrector import ELMO40in2RerankingSpellingCorrector
+from spelling_correction_models.elmo_40in_spelling_corrector.hypotheses_table import \
+    HYPOTHESES_TABLE_KEY
+
+
+class TestResultCache(unittest.TestCase):
+    SENTENCES = ["мама мыло раму", "папа мыло раму", "мама мыло раму"]
+
+    def setUp(self):
+        self.lm = StubLM()
+        self.spelling_corrector = ELMO40in2SpellingCorrector(
+            language_model=self.lm,
+            spelling_correction_candidates_generator=StubCandidatesGenerator(),
+            result_cache_size=10 ** 6)
+
+    def test_repeated_sentences_are_corrected_once(self):
+        outputs, anal_dicts = self.spelling_corrector.process_sentences_batch(
+            self.SENTENCES, supply_anal_dict=True)
+        self.assertEqual(outputs[0], outputs[2])
+        self.assertEqual(anal_dicts[0], anal_dicts[2])
+        self.assertIsNot(anal_dicts[0], anal_dicts[2])
+        self.assertEqual(self.spelling_corrector.result_cache.stats()['items'], 2)
+
+        self.lm.forward_passes = 0
+        self.assertEqual(self.spelling_corrector.process_sentences_batch(self.SENTENCES), outputs)
+        self.assertEqual(self.lm.forward_passes, 0)
+
+        # other threshold is other key:
+        self.spelling_corrector.process_sentences_batch(self.SENTENCES,
+                                                        min_advantage_treshold=2.0)
+        self.assertEqual(self.lm.forward_passes, 1)
+
+    def test_cached_anal_dicts_are_copied(self):
+        _, anal_dicts = self.spelling_corrector.process_sentences_batch(
+            self.SENTENCES, supply_anal_dict=True)
+        expected = anal_dicts[0]['word_substitutions_candidates'][:]
+        anal_dicts[0]['word_substitutions_candidates'].clear()
+        _, anal_dicts = self.spelling_corrector.process_sentences_batch(
+            self.SENTENCES, supply_anal_dict=True)
+        self.assertEqual(anal_dicts[0]['word_substitutions_candidates'], expected)
+
+    def test_anal_dicts_are_cached_on_request(self):
+        self.spelling_corrector.process_sentences_batch(self.SENTENCES)
+        size_without_anal_dicts = self.spelling_corrector.result_cache.current_size
+        self.lm.forward_passes = 0
+        _, anal_dicts = self.spelling_corrector.process_sentences_batch(
+            self.SENTENCES, supply_anal_dict=True)
+        self.assertEqual(self.lm.forward_passes, 1)
+        self.assertIn('word_substitutions_candidates', anal_dicts[0])
+        # the cache is bounded by bytes:
+        self.assertGreater(self.spelling_corrector.result_cache.current_size,
+                           size_without_anal_dicts)
+
+    def test_public_analysis_dicts_have_candidates(self):
+        _, anal_dicts = self.spelling_corrector.process_sentences_batch(
+            self.SENTENCES[:1], supply_anal_dict=True)
+        batch_anal_dicts = self.spelling_corrector.prepare_analysis_dict_for_sentences_batch(
+            self.SENTENCES[:1])
+        anal_dict = self.spelling_corrector.prepare_analysis_dict_for_sentence(self.SENTENCES[0])
+        for each_dict in [batch_anal_dicts[0], anal_dict]:
+            self.assertNotIn(HYPOTHESES_TABLE_KEY, each_dict)
+            self.assertEqual(each_dict['word_substitutions_candidates'],
+                             anal_dicts[0]['word_substitutions_candidates'])
+
+    def test_updated_models_invalidate_results(self):
+        self.spelling_corrector.process_sentences_batch(self.SENTENCES)
+        self.lm.forward_passes = 0
+        self.spelling_corrector.models_updated()
+        self.spelling_corrector.process_sentences_batch(self.SENTENCES)
+        self.assertEqual(self.lm.forward_passes, 1)
+
+        self.spelling_corrector.lm = StubLM()
+        self.spelling_corrector.process_sentences_batch(self.SENTENCES)
+        self.assertEqual(self.spelling_corrector.lm.forward_passes, 1)
+
+    def test_trained_reranker_invalidates_results(self):
+        spelling_corrector = ELMO40in2RerankingSpellingCorrector(
+            language_model=StubLM(),
+            spelling_correction_candidates_generator=StubCandidatesGenerator())
+        fingerprint = spelling_corrector.model_fingerprint()
+        self.assertEqual(spelling_corrector.model_fingerprint(), fingerprint)
+        # the regressor is trained in place:
+        spelling_corrector.reranker.fit_token_front([np.eye(14)[0], np.eye(14)[1]], etalon_idx=0)
+        self.assertNotEqual(spelling_corrector.model_fingerprint(), fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+import contextlib
+import io
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from tests.corrector_stubs import StubCandidatesGenerator, StubLM
+try:
+    import joblib
+    from reranker.reranker_40in import ReRanker40inRegressor
+    from reranker.streaming_trainer import StreamingRerankerTrainer, iterate_pairwise_batches, \
+        read_analysis_dicts_jsonl, write_analysis_dicts_jsonl
+    from spelling_correction_models.elmo_40in_spelling_corrector.hypotheses_table import \
+        HYPOTHESES_TABLE_KEY, HypothesesTable
+except ImportError:
+    ReRanker40inRegressor = None
+try:
+    from spelling_correction_models.elmo_40in_spelling_corrector.elmo_40in2_spelling_corrector \
+        import ELMO40in2SpellingCorrector
+except ImportError:
+    ELMO40in2SpellingCorrector = None
+
+
+def make_annotated_analysis_dict(rng, tokens_count=4):
+    """
+    Sentence with a substitution candidate for each token: the etalon is the substitution if its
+    lm_advantage is high and the zero hypothesis otherwise
+    """
+    tokens = ['<S>'] + ['tok%d' % idx for idx in range(1, tokens_count + 1)] + ['</S>']
+    word_substitutions_candidates = [{'tok_idx': 0, 'top_k_candidates': []}]
+    for tok_idx in range(1, tokens_count + 1):
+        lm_advantage = float(rng.uniform(0.0, 10.0))
+        substitution = {'lm_advantage': lm_advantage, 'advantage': lm_advantage - 5.0,
+                        'token_str': 'fix%d' % tok_idx, 'zero_hypothesis': False,
+                        'error_score': -5.0, 'token_merges': 0, 'token_splits': None}
+        zero_hypothesis = {'lm_advantage': 0.0, 'advantage': 0.0, 'token_str': tokens[tok_idx],
+                           'zero_hypothesis': True, 'error_score': 0.0, 'token_merges': 0,
+                           'token_splits': None}
+        etalon = substitution if lm_advantage > 5.0 else zero_hypothesis
+        etalon['etalon_ref'] = tok_idx
+        word_substitutions_candidates.append({'tok_idx': tok_idx,
+                                              'top_k_candidates': [substitution, zero_hypothesis]})
+    word_substitutions_candidates.append({'tok_idx': tokens_count + 1, 'top_k_candidates': [
+        {'lm_advantage': 0.0, 'advantage': 0.0, 'token_str': '</S>', 'zero_hypothesis': True,
+         'error_score': 0.0, 'token_merges': 0, 'token_splits': None, 'etalon_ref': 0}]})
+    return {'tokenized_input_sentence': tokens,
+            'word_substitutions_candidates': word_substitutions_candidates}
+
+
+@unittest.skipIf(ReRanker40inRegressor is None, "reranker dependencies are not installed")
+class TestStreamingRerankerTrainer(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(13)
+        self.analysis_dicts = [make_annotated_analysis_dict(rng) for _ in range(60)]
+        self.tmp_dir = tempfile.mkdtemp()
+        self.shard_paths = [os.path.join(self.tmp_dir, "shard-%03d.jsonl" % idx)
+                            for idx in range(2)]
+        write_analysis_dicts_jsonl(self.analysis_dicts[:30], self.shard_paths[0])
+        write_analysis_dicts_jsonl(self.analysis_dicts[30:], self.shard_paths[1])
+        self.checkpoint_path = os.path.join(self.tmp_dir, "reranker_40in.joblib.pkl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def accuracy(self, reranker):
+        hits, total = 0, 0
+        for each_dict in self.analysis_dicts:
+            predicted_tokens = reranker.predict_fixes_tokens(each_dict)
+            etalon_tokens = [each_candidate['token_str']
+                             for each_group in each_dict['word_substitutions_candidates'][1:-1]
+                             for each_candidate in each_group['top_k_candidates']
+                             if 'etalon_ref' in each_candidate]
+            hits += sum(predicted == etalon
+                        for predicted, etalon in zip(predicted_tokens, etalon_tokens))
+            total += len(etalon_tokens)
+        return hits / total
+
+    def test_shards_round_trip(self):
+        self.assertEqual(list(read_analysis_dicts_jsonl(self.shard_paths)), self.analysis_dicts)
+
+    @unittest.skipIf(ELMO40in2SpellingCorrector is None,
+                     "spelling corrector dependencies are not installed")
+    def test_writes_analysis_dicts_of_corrector(self):
+        spelling_corrector = ELMO40in2SpellingCorrector(
+            language_model=StubLM(),
+            spelling_correction_candidates_generator=StubCandidatesGenerator())
+        _, analysis_dicts = spelling_corrector(["Мама мыло раму.", "мыло"],
+                                               supply_anal_dict=True)
+        shard_path = os.path.join(self.tmp_dir, "corrector.jsonl")
+        self.assertEqual(write_analysis_dicts_jsonl(analysis_dicts, shard_path), 2)
+        written_dicts = list(read_analysis_dicts_jsonl([shard_path]))
+        self.assertEqual([each_dict['tokenized_input_sentence'] for each_dict in written_dicts],
+                         [each_dict['tokenized_input_sentence'] for each_dict in analysis_dicts])
+
+    def test_analysis_dicts_with_tables(self):
+        table_dicts = [{'tokenized_input_sentence': each_dict['tokenized_input_sentence'],
+                        HYPOTHESES_TABLE_KEY: HypothesesTable.from_analysis_dict(each_dict)}
+                       for each_dict in self.analysis_dicts[:5]]
+        shard_path = os.path.join(self.tmp_dir, "tables.jsonl")
+        write_analysis_dicts_jsonl(table_dicts, shard_path)
+        self.assertEqual(list(read_analysis_dicts_jsonl([shard_path])), self.analysis_dicts[:5])
+
+        reranker = ReRanker40inRegressor()
+        for each_dict, each_table_dict in zip(self.analysis_dicts[:5], table_dicts):
+            features, labels = reranker._prepare_sentence_training_data(each_dict)
+            table_features, table_labels = reranker._prepare_sentence_training_data(
+                each_table_dict)
+            self.assertTrue(np.array_equal(table_features, features))
+            self.assertEqual(table_labels, labels)
+
+    def test_batches(self):
+        reranker = ReRanker40inRegressor()
+        expected_features, expected_labels = reranker.prepare_dataset_from_data_anal_dicts(
+            self.analysis_dicts)
+        batches = list(iterate_pairwise_batches(reranker, self.analysis_dicts, batch_size=50))
+        self.assertTrue(all(len(labels) >= 50 for _, labels in batches[:-1]))
+        self.assertTrue(np.array_equal(np.vstack([features for features, _ in batches]),
+                                       np.array(expected_features)))
+        self.assertEqual(list(np.concatenate([labels for _, labels in batches])),
+                         expected_labels)
+
+    def test_train_and_resume(self):
+        trainer = StreamingRerankerTrainer(batch_size=64, checkpoint_path=self.checkpoint_path)
+        reranker = trainer.train(self.shard_paths, epochs=2)
+        self.assertGreater(self.accuracy(reranker), 0.9)
+        self.assertTrue(os.path.exists(self.checkpoint_path))
+        self.assertTrue(os.path.exists(trainer.state_path))
+        self.assertEqual(trainer.examples_count, 2 * 2 * 4 * 60)
+
+        # completed epochs are not repeated:
+        resumed_trainer = StreamingRerankerTrainer(batch_size=64,
+                                                   checkpoint_path=self.checkpoint_path)
+        resumed_trainer.train(self.shard_paths, epochs=3)
+        self.assertEqual(resumed_trainer.epoch, 3)
+        self.assertEqual(resumed_trainer.examples_count, 3 * 2 * 4 * 60)
+
+        # resumed training is the same as training without interruption:
+        trainer = StreamingRerankerTrainer(batch_size=64)
+        trainer.train(self.shard_paths, epochs=3)
+        self.assertTrue(np.allclose(trainer.reranker.reg.coef_,
+                                    resumed_trainer.reranker.reg.coef_))
+
+    def test_resume_inside_epoch(self):
+        class InterruptedTrainer(StreamingRerankerTrainer):
+            def fit_batch(self, features, labels):
+                if self.batches_count == 5:
+                    raise KeyboardInterrupt()
+                super().fit_batch(features, labels)
+
+        trainer = InterruptedTrainer(batch_size=64, checkpoint_path=self.checkpoint_path,
+                                     checkpoint_every=2)
+        with self.assertRaises(KeyboardInterrupt):
+            trainer.train(self.shard_paths, epochs=2)
+
+        # mini-batches fitted before the checkpoint are not fitted again:
+        resumed_trainer = StreamingRerankerTrainer(batch_size=64,
+                                                   checkpoint_path=self.checkpoint_path)
+        resumed_trainer.train(self.shard_paths, epochs=2)
+        self.assertEqual(resumed_trainer.examples_count, 2 * 2 * 4 * 60)
+        trainer = StreamingRerankerTrainer(batch_size=64)
+        trainer.train(self.shard_paths, epochs=2)
+        self.assertEqual(resumed_trainer.batches_count, trainer.batches_count)
+        self.assertTrue(np.allclose(trainer.reranker.reg.coef_,
+                                    resumed_trainer.reranker.reg.coef_))
+
+    def test_model_and_state_are_in_sync(self):
+        trainer = StreamingRerankerTrainer(batch_size=64, checkpoint_path=self.checkpoint_path)
+        trainer.train(self.shard_paths, epochs=2)
+        # the process died after the state of epoch 2 was renamed, but before the model:
+        shutil.copy(self.checkpoint_path, trainer.tmp_checkpoint_path)
+        StreamingRerankerTrainer(batch_size=64).reranker.save(self.checkpoint_path)
+        resumed_trainer = StreamingRerankerTrainer(batch_size=64,
+                                                   checkpoint_path=self.checkpoint_path)
+        self.assertTrue(resumed_trainer.load_checkpoint())
+        self.assertTrue(np.array_equal(resumed_trainer.reranker.reg.coef_,
+                                       trainer.reranker.reg.coef_))
+        self.assertFalse(os.path.exists(trainer.tmp_checkpoint_path))
+
+        # the model of other state is not loaded:
+        StreamingRerankerTrainer(batch_size=64).reranker.save(self.checkpoint_path)
+        with self.assertRaises(ValueError):
+            resumed_trainer.load_checkpoint()
+
+    def test_fronts_without_etalon_are_counted(self):
+        reranker = ReRanker40inRegressor()
+        reranker.prepare_dataset_from_data_anal_dicts(self.analysis_dicts)
+        self.assertEqual(reranker.skipped_fronts, 0)
+        for each_candidate in self.analysis_dicts[0]['word_substitutions_candidates'][1][
+                'top_k_candidates']:
+            each_candidate.pop('etalon_ref', None)
+        features, labels = reranker._prepare_sentence_training_data(self.analysis_dicts[0])
+        self.assertEqual(reranker.skipped_fronts, 1)
+        self.assertEqual(len(labels), 2 * 3)
+
+    def test_skipped_fronts_are_reported_per_epoch(self):
+        for each_candidate in self.analysis_dicts[0]['word_substitutions_candidates'][1][
+                'top_k_candidates']:
+            each_candidate.pop('etalon_ref', None)
+        write_analysis_dicts_jsonl(self.analysis_dicts[:30], self.shard_paths[0])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            StreamingRerankerTrainer(batch_size=64).train(self.shard_paths, epochs=2)
+        self.assertEqual(output.getvalue().count("1 fronts without etalon skipped"), 2)
+
+    def test_models_of_old_format_are_rejected(self):
+        trainer = StreamingRerankerTrainer(checkpoint_path=self.checkpoint_path)
+        trainer.train(self.shard_paths, epochs=1)
+        reranker = ReRanker40inRegressor().load(self.checkpoint_path)
+        self.assertTrue(np.array_equal(reranker.coef_, trainer.reranker.reg.coef_))
+
+        # models of format 1 were saved as bare classifiers:
+        joblib.dump(trainer.reranker.reg, self.checkpoint_path)
+        with self.assertRaises(ValueError):
+            ReRanker40inRegressor().load(self.checkpoint_path)
+
+    def test_fit_token_front_is_incremental(self):
+        trainer = StreamingRerankerTrainer()
+        features = [np.eye(14)[0], np.eye(14)[1]]
+        trainer.reranker.fit_token_front(features, etalon_idx=0)
+        first_coef = trainer.reranker.reg.coef_.copy()
+        trainer.reranker.fit_token_front(features, etalon_idx=0)
+        self.assertFalse(np.array_equal(first_coef, trainer.reranker.reg.coef_))
+        self.assertGreater(trainer.reranker.reg.coef_[0][0], trainer.reranker.reg.coef_[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import re
+import unittest
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from spelling_correction_models.utils import TokenClassifier, TOKEN_CLASS_FROZEN, \
+    TOKEN_CLASS_NUMBER, TOKEN_CLASS_PUNCTUATION
+
+
+class TestTokenClassifier(unittest.TestCase):
+    def test_classes(self):
+        token_classifier = TokenClassifier(["мыл.", "рам[уы]"])
+        self.assertEqual(len(token_classifier.frozen_words_regexes), 1)
+        for _ in range(2):
+            self.assertEqual(token_classifier.classify("мыло"), TOKEN_CLASS_FROZEN)
+            self.assertEqual(token_classifier.classify("раму"), TOKEN_CLASS_FROZEN)
+            self.assertEqual(token_classifier.classify("?!"), TOKEN_CLASS_PUNCTUATION)
+            self.assertEqual(token_classifier.classify("12.05"), TOKEN_CLASS_NUMBER)
+            self.assertIsNone(token_classifier.classify("мама"))
+        self.assertEqual(token_classifier._memo.hits, 5)
+
+    def test_patterns_keep_flags(self):
+        token_classifier = TokenClassifier([re.compile("мыл.", re.I), "рам[уы]", "(?i)папа",
+                                            r"(\w)\1"])
+        self.assertEqual(token_classifier.classify("МЫЛО"), TOKEN_CLASS_FROZEN)
+        self.assertIsNone(token_classifier.classify("РАМУ"))
+        self.assertEqual(token_classifier.classify("Папа"), TOKEN_CLASS_FROZEN)
+        # backreference of a pattern with groups:
+        self.assertEqual(token_classifier.classify("аа"), TOKEN_CLASS_FROZEN)
+        self.assertIsNone(token_classifier.classify("аб"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+from nltk.tokenize import word_tokenize
+from language_models.tokenization import regex_tokenize, tokenize_sentence
+
+CORPORA_PATHS = [
+    os.path.join(ROOT_DIR, "data", "dialog", "train_input_sentences.txt"),
+    os.path.join(ROOT_DIR, "data", "dialog", "train_golden_sentences.txt"),
+    os.path.join(ROOT_DIR, "data", "dialog16", "dialog_testset.txt"),
+    os.path.join(ROOT_DIR, "data", "dialog16", "true_dialog_testset.txt"),
+]
+
+
+class TestRegexTokenizer(unittest.TestCase):
+    def test_conformance_with_nltk_on_corpora(self):
+        try:
+            from nltk.tokenize.punkt import PunktTokenizer
+        except ImportError:
+            self.skipTest("conformance is checked with NLTK>=3.8.2")
+        try:
+            word_tokenize("Тест.")
+        except LookupError:
+            self.skipTest("punkt models for nltk.word_tokenize are not downloaded")
+        for path in CORPORA_PATHS:
+            with open(path, "r", encoding="utf8") as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    self.assertEqual(regex_tokenize(line)[0], word_tokenize(line), line)
+
+    def test_offsets(self):
+        text = 'Он сказал: "Мама мыла раму, т.е. окно в 10:30."'
+        tokens, offsets = regex_tokenize(text)
+        # punkt breaks the sentence after an abbreviation, so its period is split off:
+        self.assertEqual(tokens, ['Он', 'сказал', ':', '``', 'Мама', 'мыла', 'раму', ',', 'т.е',
+                                  '.', 'окно', 'в', '10:30', '.', "''"])
+        for token, (start, end) in zip(tokens, offsets):
+            if token not in ("``", "''"):
+                self.assertEqual(text[start:end], token)
+        self.assertEqual(text[offsets[3][0]:offsets[3][1]], '"')
+
+    def test_tokenized_sentence(self):
+        tokenized = tokenize_sentence("Ёлка У Дома.", tokenizer='regex',
+                                      preprocess=lambda x: x.lower().replace("ё", "е"))
+        self.assertEqual(tokenized.tokens, ['Ёлка', 'У', 'Дома', '.'])
+        self.assertEqual(tokenized.wrapped_tokens(), ['<S>', 'елка', 'у', 'дома', '.', '</S>'])
+        self.assertEqual(len(tokenized), 4)
+        with self.assertRaises(ValueError):
+            tokenize_sentence("Ёлка", tokenizer='split')
+
+
+if __name__ == '__main__':
+    unittest.main()
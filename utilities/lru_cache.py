@@ -0,0 +1,128 @@
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+
+def deep_sizeof(value):
+    """
+    Estimates memory consumed by a value with its nested containers and attributes of objects
+    (ex.: analysis dicts with HypothesesTable), it may be used as size_fn of LRUCache to bound
+    the cache by bytes
+
+    :param value: object
+    :return: int, bytes
+    """
+    if isinstance(value, np.ndarray):
+        return sys.getsizeof(value) + (0 if value.base is None else value.nbytes)
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(each_key) + deep_sizeof(each_value)
+                    for each_key, each_value in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(each_item) for each_item in value)
+    elif hasattr(value, '__dict__'):
+        size += deep_sizeof(vars(value))
+    return size
+
+
+class LRUCache():
+    """
+    Bounded mapping with least recently used eviction.
+
+    Size of the cache is measured by size_fn of values (by default each value has size 1, so
+    max_size is a number of items), for example size_fn=lambda value: value.nbytes bounds the
+    cache by bytes. Hits and misses are counted for monitoring of the hit rate.
+    """
+
+    def __init__(self, max_size, size_fn=None):
+        """
+
+        :param max_size: max total size of values in the cache
+        :param size_fn: function which returns size of a value, if None each value has size 1
+        """
+        self.max_size = max_size
+        self.size_fn = size_fn or (lambda value: 1)
+        self._items = OrderedDict()
+        self._sizes = {}
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None, is_valid=None):
+        """
+        Returns value for the key and marks it as recently used, counts hit or miss
+
+        :param is_valid: optional predicate of the value, values which do not satisfy it are
+            counted as misses (ex.: cached data which does not cover the request)
+        """
+        if key not in self._items or (is_valid is not None and not is_valid(self._items[key])):
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def peek(self, key, default=None):
+        """
+        Returns value for the key without counting and without marking it as recently used
+        """
+        return self._items.get(key, default)
+
+    def put(self, key, value):
+        """
+        Puts value into the cache and evicts least recently used values to fit max_size.
+        Values bigger than max_size are not cached.
+        """
+        size = self.size_fn(value)
+        if key in self._items:
+            self._remove(key)
+        if size > self.max_size:
+            return
+        self._items[key] = value
+        self._sizes[key] = size
+        self.current_size += size
+        while self.current_size > self.max_size:
+            oldest_key = next(iter(self._items))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        del self._items[key]
+        self.current_size -= self._sizes.pop(key)
+
+    def clear(self):
+        """Drops all values, counters are preserved"""
+        self._items.clear()
+        self._sizes.clear()
+        self.current_size = 0
+
+    def hit_rate(self):
+        """
+        :return: float, share of hits among lookups
+        """
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return self.hits / lookups
+
+    def stats(self):
+        """
+        :return: dict with counters of the cache
+        """
+        return {
+            'items': len(self._items),
+            'size': self.current_size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate()
+        }